@@ -0,0 +1 @@
+"""Offline benchmarks for the Database Context MCP Server (run with ``python -m benchmarks.<name>``)."""
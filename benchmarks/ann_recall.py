@@ -0,0 +1,98 @@
+"""
+Recall/latency benchmark of the IVF vector index against exact search.
+
+Queries are perturbed copies of indexed vectors; ground truth is a brute-force float32
+scan. Reports recall@k and latency percentiles for each nprobe, plus the exact NumPy
+engine as a baseline, as JSON.
+
+Usage:
+    python setup_db.py --mcp synth --ivf                # build the export + IVF index
+    python -m benchmarks.ann_recall --mcp synth --nprobe 1 2 4 8 16 32
+"""
+import argparse
+import json
+import time
+from typing import List, Dict, Any
+
+import numpy as np
+
+import server
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    return round(float(np.percentile(samples, pct)), 3) if samples else 0.0
+
+
+def _exact_top_k(exact: np.ndarray, q: np.ndarray, k: int) -> set:
+    distances = np.empty(len(exact), dtype=np.float32)
+    for start in range(0, len(exact), server.VECTOR_SCAN_CHUNK):
+        block = np.asarray(exact[start:start + server.VECTOR_SCAN_CHUNK], dtype=np.float32)
+        distances[start:start + len(block)] = ((block - q) ** 2).sum(axis=1)
+    top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+    return set(top.tolist())
+
+
+def run(mcp_name: str, nprobes: List[int], queries: int, k: int, noise: float, seed: int) -> Dict[str, Any]:
+    engine = server._load_vector_engine(mcp_name)
+    if engine is None or "ivf" not in engine:
+        raise SystemExit(f"No IVF export for '{mcp_name}'. Run: python setup_db.py --mcp {mcp_name} --ivf")
+
+    exact = engine["exact"]
+    ids = engine["ids"]
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(ids), min(queries, len(ids)), replace=False)
+    workload = []
+    for row in picks:
+        vector = np.asarray(exact[row], dtype=np.float32)
+        direction = rng.standard_normal(vector.shape).astype(np.float32)
+        direction *= noise * np.linalg.norm(vector) / (np.linalg.norm(direction) or 1.0)
+        q = vector + direction
+        truth = {int(ids[i]) for i in _exact_top_k(exact, q, k)}
+        workload.append((q.tolist(), truth))
+
+    results = []
+    for nprobe in [0] + sorted(set(nprobes)):
+        latencies, recalls = [], []
+        for q, truth in workload:
+            started = time.perf_counter()
+            matches = server._numpy_knn(engine, q, {}, k, nprobe)
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(len({doc_id for doc_id, _ in matches} & truth) / len(truth))
+        results.append({
+            "engine": "numpy-exact" if nprobe == 0 else "ivf",
+            "nprobe": nprobe or None,
+            f"recall_at_{k}": round(float(np.mean(recalls)), 4),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "p99_ms": _percentile(latencies, 99),
+        })
+
+    return {
+        "mcp_name": mcp_name,
+        "vectors": int(len(ids)),
+        "dimensions": int(exact.shape[1]),
+        "quantization": engine["quantization"],
+        "nlist": int(len(engine["ivf"]["centroids"])),
+        "queries": len(workload),
+        "k": k,
+        "noise": noise,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure IVF recall and latency against exact vector search.")
+    parser.add_argument("--mcp", default=None, help="MCP name (default: MCP_NAME)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="nprobe values to test")
+    parser.add_argument("--queries", type=int, default=200, help="Number of benchmark queries")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours per query (recall@k)")
+    parser.add_argument("--noise", type=float, default=0.3, help="Query perturbation relative to vector norm")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = run(args.mcp or server._get_mcp_name(), args.nprobe, args.queries, args.k, args.noise, args.seed)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Synthetic large-catalog generator.
+
+Replicates the table files of an existing map (default: the tracked sftp-markdown-files
+export; Markdown files are read with setup_db's parser, JSON siblings take precedence) into
+data/<mcp>/map/<database>/domains/<domain>/tables at any scale, then builds
+data/<mcp>/index/index.db with setup_db.build_index. Every replica keeps the template's
+columns, keys, indexes and foreign keys (remapped to the same replica); --columns pads
+tables to a minimum width and --extra-fks adds cross-replica foreign keys for a dense
+join graph. Embeddings use the offline "local" provider, so no API key is needed.
+
+Generated datasets carry a marker file; the generator refuses to overwrite any other
+data/<mcp> directory (such as a real dataset) unless --force is given.
+
+Usage:
+    python -m benchmarks.catalog --tables 10000                       # -> data/bench_10000
+    python -m benchmarks.catalog --tables 1000 --columns 120 --extra-fks 4 --mcp bench_wide
+"""
+import argparse
+import json
+import random
+import re
+import shutil
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import server
+from setup_db import TABLE_FILE_SUFFIXES, _parse_markdown_table, build_index
+
+DEFAULT_SOURCE = server.BASE_DIR / "sftp-markdown-files"
+# Written into data/<mcp>/ by generate(); only directories carrying it are overwritten
+CATALOG_MARKER = ".bench-catalog"
+_REFERENCE_PATTERN = re.compile(r"^([^(]+)\((.*)\)$")
+
+
+def _load_templates(source: Path) -> List[Dict[str, Any]]:
+    """Template tables (with their domain) from every table file under a map directory."""
+    templates = []
+    seen = set()
+    paths = [
+        path for path in sorted(source.glob("*/domains/*/tables/*"))
+        if path.suffix in TABLE_FILE_SUFFIXES
+        and not (path.suffix == ".md" and path.with_suffix(".json").exists())
+    ]
+    for path in paths:
+        text = path.read_text(encoding="utf-8")
+        doc = json.loads(text) if path.suffix == ".json" else _parse_markdown_table(text)
+        if not doc.get("table"):
+            continue
+        key = f"{doc.get('schema', '')}.{doc['table']}".lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        templates.append({"domain": path.parent.parent.name, "key": key, "doc": doc})
+    if not templates:
+        raise SystemExit(f"No template table files found under {source}")
+    return templates
+
+
+def _check_target(mcp_name: str, force: bool, source: Optional[Path] = None) -> None:
+    """Refuse to overwrite data/<mcp_name> unless the generator created it (or force is set)."""
+    data_dir = server._get_data_dir(mcp_name).resolve()
+    if source is not None:
+        source = source.resolve()
+        if source == data_dir or data_dir in source.parents or source in data_dir.parents:
+            raise SystemExit(f"Template source {source} overlaps the target {data_dir}")
+    if force or not data_dir.exists() or (data_dir / CATALOG_MARKER).exists() or not any(data_dir.iterdir()):
+        return
+    raise SystemExit(
+        f"{data_dir} was not created by benchmarks.catalog; refusing to overwrite it (pass --force to override)"
+    )
+
+
+def _replica_name(table: str, replica: int) -> str:
+    return f"{table}_r{replica:04d}"
+
+
+def _remap_reference(reference: str, names: Dict[str, str]) -> str:
+    """Point "schema.table(col)" / "schema.table" at the same replica when the target was cloned."""
+    match = _REFERENCE_PATTERN.match(reference)
+    target, columns = (match.group(1), match.group(2)) if match else (reference, None)
+    schema, _, table = target.rpartition(".")
+    renamed = names.get(target.lower())
+    if renamed is None:
+        return reference
+    target = f"{schema}.{renamed}" if schema else renamed
+    return f"{target}({columns})" if columns is not None else target
+
+
+def _clone_table(
+    template: Dict[str, Any],
+    database: str,
+    names: Dict[str, str],
+    min_columns: int,
+) -> Dict[str, Any]:
+    src = template["doc"]
+    table = names[template["key"]]
+    doc = {
+        "table": table,
+        "schema": src.get("schema", ""),
+        "database": database,
+        "description": src.get("description", ""),
+        "row_count": src.get("row_count"),
+        "columns": [dict(col) for col in src.get("columns", [])],
+        "primary_key": list(src.get("primary_key", [])),
+        "foreign_keys": [
+            {"columns": list(fk.get("columns", [])), "references": _remap_reference(fk.get("references", ""), names)}
+            for fk in src.get("foreign_keys", [])
+        ],
+        "indexes": [
+            {**index, "index_name": index.get("index_name", "").replace(src["table"], table, 1)}
+            for index in src.get("indexes", [])
+        ],
+    }
+    depends_on = (src.get("relationships") or {}).get("depends_on")
+    if depends_on is not None:
+        doc["relationships"] = {"depends_on": [_remap_reference(ref, names) for ref in depends_on]}
+
+    # Wide tables: repeat the template's own columns under numbered names
+    base = [col for col in src.get("columns", []) if col["name"] not in doc["primary_key"]] or src.get("columns", [])
+    copy = 1
+    while base and len(doc["columns"]) < min_columns:
+        for col in base:
+            if len(doc["columns"]) >= min_columns:
+                break
+            doc["columns"].append({**col, "name": f"{col['name']}_{copy}", "nullable": True})
+        copy += 1
+    return doc
+
+
+def _add_cross_links(docs: List[Dict[str, Any]], per_table: int, rng: random.Random) -> int:
+    """Give each table up to per_table extra FK columns pointing at random other tables' primary keys."""
+    targets = [doc for doc in docs if len(doc["primary_key"]) == 1]
+    if len(targets) < 2:
+        return 0
+    added = 0
+    for doc in docs:
+        for _ in range(per_table):
+            target = rng.choice(targets)
+            if target is doc:
+                continue
+            column = f"{target['table']}_{target['primary_key'][0]}"
+            if any(col["name"] == column for col in doc["columns"]):
+                continue
+            reference = f"{target['schema']}.{target['table']}"
+            doc["columns"].append({
+                "name": column,
+                "type": "integer",
+                "nullable": True,
+                "description": f"References {reference}.",
+            })
+            doc["foreign_keys"].append({"columns": [column], "references": f"{reference}({target['primary_key'][0]})"})
+            doc.setdefault("relationships", {"depends_on": []})["depends_on"].append(reference)
+            added += 1
+    return added
+
+
+def _render_markdown(doc: Dict[str, Any]) -> str:
+    """Markdown sibling in the exporter's layout (header, columns, keys, indexes)."""
+    lines = [
+        f"# {doc['table']}",
+        "",
+        f"**Database:** {doc['database']}",
+        f"**Schema:** {doc['schema']}",
+        f"**Description:** {doc['description']}",
+        "",
+        "## Columns",
+        "",
+        "| Column | Type | Nullable | Description |",
+        "|--------|------|----------|-------------|",
+    ]
+    for col in doc["columns"]:
+        nullable = "YES" if col.get("nullable", True) else "NO"
+        lines.append(f"| {col['name']} | {col.get('type', '')} | {nullable} | {col.get('description', '')} |")
+    if doc["primary_key"]:
+        lines += ["", "## Primary Key", "", f"`{', '.join(doc['primary_key'])}`"]
+    if doc["foreign_keys"]:
+        lines += ["", "## Foreign Keys", ""]
+        for fk in doc["foreign_keys"]:
+            match = _REFERENCE_PATTERN.match(fk["references"])
+            target = f"{match.group(1)}.{match.group(2)}" if match else fk["references"]
+            lines.append(f"- `{', '.join(fk['columns'])}` → `{target}`")
+    if doc["indexes"]:
+        lines += ["", "## Indexes", ""]
+        for index in doc["indexes"]:
+            unique = "UNIQUE " if index.get("is_unique") else ""
+            lines.append(
+                f"- `{index.get('index_name', '')}`: CREATE {unique}INDEX {index.get('index_name', '')} "
+                f"ON {doc['schema']}.{doc['table']} USING btree ({', '.join(index.get('columns', []))})"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def generate(
+    mcp_name: str,
+    tables: int,
+    source: Path = DEFAULT_SOURCE,
+    database: str = "",
+    min_columns: int = 0,
+    extra_fks: int = 0,
+    markdown: bool = True,
+    seed: int = 0,
+    force: bool = False,
+) -> Dict[str, Any]:
+    """
+    Write a synthetic map of `tables` tables to data/<mcp_name>/map, replacing any previous one.
+
+    Args:
+        mcp_name: Target MCP data directory name.
+        tables: Number of tables to generate.
+        source: Map directory whose JSON table files are replicated.
+        database: Database name (default: synthetic_<tables>_postgres).
+        min_columns: Pad every table to at least this many columns.
+        extra_fks: Cross-replica foreign keys added per table.
+        markdown: Also write the Markdown sibling of every JSON file.
+        seed: Random seed for cross-replica links.
+        force: Overwrite data/<mcp_name> even if the generator did not create it.
+    Returns:
+        Dict with table/column/foreign key counts and the map path.
+    """
+    _check_target(mcp_name, force, source)
+    templates = _load_templates(source)
+    database = database or f"synthetic_{tables}_postgres"
+    rng = random.Random(seed)
+
+    docs, domains = [], []
+    for replica in range((tables + len(templates) - 1) // len(templates)):
+        names = {template["key"]: _replica_name(template["doc"]["table"], replica) for template in templates}
+        for template in templates[: tables - len(docs)]:
+            docs.append(_clone_table(template, database, names, min_columns))
+            domains.append(template["domain"])
+    cross_links = _add_cross_links(docs, extra_fks, rng) if extra_fks else 0
+
+    map_root = server._get_data_map_path(mcp_name)
+    if map_root.exists():
+        shutil.rmtree(map_root)
+    map_root.mkdir(parents=True)
+    (server._get_data_dir(mcp_name) / CATALOG_MARKER).write_text(
+        json.dumps({"tables": tables, "source": str(source)}), encoding="utf-8"
+    )
+    for doc, domain in zip(docs, domains):
+        table_dir = map_root / database / "domains" / domain / "tables"
+        table_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{doc['schema']}.{doc['table']}" if doc["schema"] else doc["table"]
+        (table_dir / f"{stem}.json").write_text(json.dumps(doc, indent=2), encoding="utf-8")
+        if markdown:
+            (table_dir / f"{stem}.md").write_text(_render_markdown(doc), encoding="utf-8")
+
+    return {
+        "mcp_name": mcp_name,
+        "map_path": str(map_root),
+        "database": database,
+        "tables": len(docs),
+        "templates": len(templates),
+        "columns": sum(len(doc["columns"]) for doc in docs),
+        "foreign_keys": sum(len(doc["foreign_keys"]) for doc in docs),
+        "cross_links": cross_links,
+    }
+
+
+def build(mcp_name: str, workers: Optional[int] = None, force: bool = False) -> Dict[str, Any]:
+    """Build (from scratch) the index and cache snapshot for a generated catalog with local embeddings."""
+    _check_target(mcp_name, force)
+    index_dir = server._get_db_path(mcp_name).parent
+    if index_dir.exists():
+        shutil.rmtree(index_dir)
+    return build_index(mcp_name=mcp_name, full=True, workers=workers, embedding_provider="local")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic catalog and its index at a given scale.")
+    parser.add_argument("--tables", type=int, required=True, help="Number of tables to generate")
+    parser.add_argument("--mcp", default=None, help="MCP name (default: bench_<tables>)")
+    parser.add_argument("--source", type=Path, default=DEFAULT_SOURCE, help="Map directory to replicate")
+    parser.add_argument("--database", default="", help="Database name (default: synthetic_<tables>_postgres)")
+    parser.add_argument("--columns", type=int, default=0, help="Minimum columns per table (wide tables)")
+    parser.add_argument("--extra-fks", type=int, default=0, help="Extra cross-replica foreign keys per table")
+    parser.add_argument("--no-markdown", action="store_true", help="Only write JSON table files")
+    parser.add_argument("--no-index", action="store_true", help="Skip building index.db")
+    parser.add_argument("--workers", type=int, default=None, help="Index parser processes (0 = in-process)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action="store_true", help="Overwrite a data/<mcp> directory not made by this tool")
+    args = parser.parse_args()
+
+    mcp_name = args.mcp or f"bench_{args.tables}"
+    report = generate(
+        mcp_name,
+        args.tables,
+        source=args.source,
+        database=args.database,
+        min_columns=args.columns,
+        extra_fks=args.extra_fks,
+        markdown=not args.no_markdown,
+        seed=args.seed,
+        force=args.force,
+    )
+    if not args.no_index:
+        report["index"] = build(mcp_name, args.workers, force=args.force)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Concurrent-session load generator for the MCP HTTP transport.
+
+Speaks the same protocol as the frontend's call_mcp_tool_on_server: POST an initialize
+request, take the mcp-session-id header, then POST tools/call with it and read the
+JSON-RPC reply from the SSE "data: " lines. A configurable tool mix is replayed
+against a running server. Open loop is the default: calls are started at --rate per
+second, and each one waits for a free session slot. With --rate 0 every slot runs
+back-to-back. Every --calls-per-session calls a slot opens a new session. The default
+of 1 matches the frontend, which initializes once per call.
+
+Reports throughput, error rates by kind and tool, and latency percentiles as JSON:
+- initialize round trips
+- tools/call round trips
+- response time: from the scheduled start, including queueing and initialize
+
+Tool arguments come from the server's own list_tables. --spawn starts a local
+server.py on --port for the run, so nothing leaves the machine: the spawned server gets
+no OPENAI_API_KEY and the local embedding provider, and the default mix drops the vector
+workloads unless --mix names them.
+
+Usage:
+    python -m benchmarks.http_load --spawn synth --rate 50 --concurrency 16 --duration 30
+    python -m benchmarks.http_load --url http://localhost:8000/mcp/synth --rate 0 --concurrency 64
+    python -m benchmarks.http_load --spawn bench_10000 --mix search_tables=3 get_table_schema=5 get_join_path=2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+
+from benchmarks.workload import WORKLOADS, WORKLOAD_TOOLS, percentile
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_MIX = {
+    "search_tables": 4,
+    "get_table_schema": 4,
+    "list_columns": 2,
+    "search_fts": 2,
+    "get_join_path": 2,
+    "list_tables_by_domain": 1,
+    "search_hybrid": 1,
+}
+# Workloads that embed the query, dropped from the default mix under --spawn
+VECTOR_WORKLOADS = {"search_vector", "search_hybrid"}
+HEADERS = {"Content-Type": "application/json", "Accept": "application/json, text/event-stream"}
+ERROR_SAMPLES = 5
+
+
+# --- Protocol ---
+
+class _CallError(Exception):
+    """A failed call; kind is initialize, http, protocol, rpc or tool."""
+
+    def __init__(self, kind: str, message: str) -> None:
+        super().__init__(message)
+        self.kind = kind
+
+
+def _parse_reply(response: httpx.Response, request_id: int) -> Optional[Dict[str, Any]]:
+    """JSON-RPC reply for request_id from a JSON or SSE (data: lines) response body."""
+    if response.headers.get("content-type", "").startswith("application/json"):
+        try:
+            return response.json()
+        except ValueError:
+            return None
+    reply = None
+    for line in response.text.split("\n"):
+        if not line.startswith("data: "):
+            continue
+        try:
+            message = json.loads(line[6:])
+        except json.JSONDecodeError:
+            continue
+        if isinstance(message, dict) and message.get("id") == request_id:
+            reply = message
+    return reply
+
+
+async def _initialize(client: httpx.AsyncClient, url: str) -> str:
+    payload = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "initialize",
+        "params": {
+            "protocolVersion": "2024-11-05",
+            "capabilities": {},
+            "clientInfo": {"name": "CompanyMCP-LoadTest", "version": "1.0.0"},
+        },
+    }
+    response = await client.post(url, json=payload, headers=HEADERS)
+    session_id = response.headers.get("mcp-session-id")
+    if response.status_code != 200 or not session_id:
+        raise _CallError("initialize", f"HTTP {response.status_code}: {response.text[:200]}")
+    return session_id
+
+
+async def _close(client: httpx.AsyncClient, url: str, session_id: str) -> None:
+    try:
+        await client.delete(url, headers={**HEADERS, "mcp-session-id": session_id})
+    except httpx.HTTPError:
+        pass
+
+
+async def _call_tool(
+    client: httpx.AsyncClient, url: str, session_id: str, request_id: int, tool: str, arguments: Dict[str, Any]
+) -> Dict[str, Any]:
+    payload = {"jsonrpc": "2.0", "id": request_id, "method": "tools/call", "params": {"name": tool, "arguments": arguments}}
+    response = await client.post(url, json=payload, headers={**HEADERS, "mcp-session-id": session_id})
+    if response.status_code != 200:
+        raise _CallError("http", f"HTTP {response.status_code}: {response.text[:200]}")
+    reply = _parse_reply(response, request_id)
+    if reply is None:
+        raise _CallError("protocol", f"No JSON-RPC reply in response: {response.text[:200]}")
+    if "error" in reply:
+        raise _CallError("rpc", json.dumps(reply["error"])[:200])
+    result = reply.get("result", {})
+    structured = result.get("structuredContent")
+    if result.get("isError") or (isinstance(structured, dict) and "error" in structured):
+        text = "".join(block.get("text", "") for block in result.get("content", []))
+        raise _CallError("tool", text[:200])
+    return result
+
+
+# --- Load loop ---
+
+def _new_stats() -> Dict[str, Any]:
+    return {
+        "initialize_ms": [],
+        "latency_ms": [],
+        "response_ms": [],
+        "by_workload": {},
+        "errors": Counter(),
+        "error_samples": [],
+        "per_second": Counter(),
+        "sessions": 0,
+    }
+
+
+def _record_error(stats: Dict[str, Any], workload: str, kind: str, message: str) -> None:
+    stats["errors"][kind] += 1
+    stats["by_workload"][workload]["errors"] += 1
+    if len(stats["error_samples"]) < ERROR_SAMPLES:
+        stats["error_samples"].append({"workload": workload, "kind": kind, "message": message})
+
+
+async def _one_call(
+    client: httpx.AsyncClient,
+    url: str,
+    slot: Dict[str, Any],
+    workload: str,
+    arguments: Dict[str, Any],
+    calls_per_session: int,
+    stats: Dict[str, Any],
+    started_at: float,
+    scheduled: float,
+) -> None:
+    entry = stats["by_workload"].setdefault(workload, {"latency_ms": [], "errors": 0, "calls": 0})
+    entry["calls"] += 1
+    try:
+        if slot["session_id"] is None:
+            begin = time.perf_counter()
+            slot["session_id"] = await _initialize(client, url)
+            stats["initialize_ms"].append((time.perf_counter() - begin) * 1000)
+            stats["sessions"] += 1
+            slot["calls"] = 0
+        slot["calls"] += 1
+        begin = time.perf_counter()
+        await _call_tool(
+            client, url, slot["session_id"], slot["calls"] + 1, WORKLOAD_TOOLS.get(workload, workload), arguments
+        )
+        elapsed = (time.perf_counter() - begin) * 1000
+        stats["latency_ms"].append(elapsed)
+        entry["latency_ms"].append(elapsed)
+    except _CallError as e:
+        _record_error(stats, workload, e.kind, str(e))
+    except httpx.TimeoutException as e:
+        _record_error(stats, workload, "timeout", repr(e))
+    except httpx.HTTPError as e:
+        _record_error(stats, workload, "transport", repr(e))
+    finally:
+        done = time.perf_counter()
+        stats["response_ms"].append((done - scheduled) * 1000)
+        stats["per_second"][int(done - started_at)] += 1
+        if slot["session_id"] is not None and slot["calls"] >= calls_per_session:
+            session_id, slot["session_id"] = slot["session_id"], None
+            await _close(client, url, session_id)
+
+
+async def _run_load(
+    client: httpx.AsyncClient,
+    url: str,
+    ctx: Dict[str, Any],
+    mix: Dict[str, float],
+    rate: float,
+    concurrency: int,
+    duration: float,
+    calls_per_session: int,
+    seed: int,
+) -> Tuple[Dict[str, Any], float]:
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    stats = _new_stats()
+    slots: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    for _ in range(concurrency):
+        slots.put_nowait({"session_id": None, "calls": 0})
+
+    def next_call() -> Tuple[str, Dict[str, Any]]:
+        workload = rng.choices(names, weights)[0]
+        return workload, WORKLOADS[workload](rng, ctx)
+
+    async def dispatch(workload: str, arguments: Dict[str, Any], scheduled: float) -> None:
+        slot = await slots.get()
+        try:
+            await _one_call(client, url, slot, workload, arguments, calls_per_session, stats, started_at, scheduled)
+        finally:
+            slots.put_nowait(slot)
+
+    started_at = time.perf_counter()
+    deadline = started_at + duration
+    if rate > 0:
+        # Open loop: start times follow the schedule regardless of how slow replies are
+        tasks = []
+        i = 0
+        while True:
+            scheduled = started_at + i / rate
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(dispatch(*next_call(), scheduled)))
+            i += 1
+        await asyncio.gather(*tasks)
+    else:
+        async def worker() -> None:
+            while time.perf_counter() < deadline:
+                await dispatch(*next_call(), time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    while not slots.empty():
+        slot = slots.get_nowait()
+        if slot["session_id"] is not None:
+            await _close(client, url, slot["session_id"])
+    return stats, elapsed
+
+
+async def _catalog_context(client: httpx.AsyncClient, url: str) -> Dict[str, Any]:
+    """Table names, summaries and domains from the server's list_tables."""
+    session_id = await _initialize(client, url)
+    try:
+        result = await _call_tool(client, url, session_id, 2, "list_tables", {})
+    finally:
+        await _close(client, url, session_id)
+    structured = result.get("structuredContent") or {}
+    rows = structured.get("result") if isinstance(structured, dict) else None
+    if rows is None:
+        rows = json.loads("".join(block.get("text", "") for block in result.get("content", [])) or "[]")
+    if not rows:
+        raise SystemExit(f"list_tables returned no tables at {url}")
+    return {
+        # list_tables names are already schema-qualified
+        "tables": [row["name"] for row in rows],
+        "linked": [],
+        "summaries": [row["summary"] for row in rows if row.get("summary")] or ["customer orders"],
+        "domains": sorted({row.get("domain") or "default" for row in rows}),
+    }
+
+
+def _latency_summary(samples: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+        "max_ms": round(max(samples), 3) if samples else 0.0,
+    }
+
+
+async def run(
+    url: str,
+    mix: Dict[str, float],
+    rate: float = 20.0,
+    concurrency: int = 16,
+    duration: float = 30.0,
+    calls_per_session: int = 1,
+    timeout: float = 30.0,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Replay the tool mix against an MCP endpoint and summarize the run (see module docstring)."""
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        ctx = await _catalog_context(client, url)
+        stats, elapsed = await _run_load(client, url, ctx, mix, rate, concurrency, duration, calls_per_session, seed)
+
+    calls = len(stats["response_ms"])
+    errors = sum(stats["errors"].values())
+    return {
+        "url": url,
+        "mode": "open" if rate > 0 else "closed",
+        "target_rate": rate or None,
+        "concurrency": concurrency,
+        "calls_per_session": calls_per_session,
+        "duration_seconds": duration,
+        "elapsed_seconds": round(elapsed, 3),
+        "catalog_tables": len(ctx["tables"]),
+        "calls": calls,
+        "errors": errors,
+        "error_rate": round(errors / calls, 4) if calls else None,
+        "throughput_rps": round(calls / elapsed, 2) if elapsed else 0.0,
+        "ok_throughput_rps": round((calls - errors) / elapsed, 2) if elapsed else 0.0,
+        "sessions_opened": stats["sessions"],
+        "initialize": _latency_summary(stats["initialize_ms"]),
+        "tool_call": _latency_summary(stats["latency_ms"]),
+        "response_time": _latency_summary(stats["response_ms"]),
+        "errors_by_kind": dict(stats["errors"]),
+        "error_samples": stats["error_samples"],
+        "tools": [
+            {
+                "workload": workload,
+                "tool": WORKLOAD_TOOLS.get(workload, workload),
+                "weight": mix[workload],
+                "calls": entry["calls"],
+                "errors": entry["errors"],
+                "error_rate": round(entry["errors"] / entry["calls"], 4) if entry["calls"] else None,
+                **_latency_summary(entry["latency_ms"]),
+            }
+            for workload, entry in sorted(stats["by_workload"].items())
+        ],
+        "completed_per_second": [stats["per_second"][s] for s in range(int(elapsed) + 1)],
+    }
+
+
+# --- Local server ---
+
+def _spawn_server(mcp_name: str, port: int, wait: float) -> subprocess.Popen:
+    """
+    Start server.py for mcp_name on port and wait until /health/<mcp_name> is ready. The
+    server runs offline: no OpenAI key, local embedding provider.
+    """
+    env = dict(os.environ, MCP_NAME=mcp_name, MCP_PORT=str(port), EMBEDDING_PROVIDER="local")
+    env.pop("OPENAI_API_KEY", None)
+    process = subprocess.Popen(
+        [sys.executable, str(BASE_DIR / "server.py")],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    health = f"http://127.0.0.1:{port}/health/{mcp_name}"
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"server.py exited with code {process.returncode} before becoming ready")
+        try:
+            if httpx.get(health, timeout=1.0).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise SystemExit(f"server.py not ready at {health} after {wait:.0f}s")
+
+
+def _parse_mix(items: List[str]) -> Dict[str, float]:
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition("=")
+        if name not in WORKLOADS:
+            raise SystemExit(f"Unknown workload '{name}'. Available: {', '.join(sorted(WORKLOADS))}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a tool mix against an MCP HTTP endpoint at a target rate.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="MCP endpoint, e.g. http://localhost:8000/mcp/synth")
+    target.add_argument("--spawn", metavar="MCP_NAME", help="Start a local server.py for this dataset")
+    parser.add_argument("--port", type=int, default=18700, help="Port for --spawn")
+    parser.add_argument(
+        "--mix", nargs="+", default=None,
+        help="Workloads as name=weight (default: typical agent session mix, without vector search under --spawn)",
+    )
+    parser.add_argument("--rate", type=float, default=20.0, help="Target calls per second (0 = closed loop)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent sessions")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load")
+    parser.add_argument("--calls-per-session", type=int, default=1, help="Calls before re-initializing a session")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=120.0, help="Seconds to wait for --spawn")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.mix:
+        mix = _parse_mix(args.mix)
+    else:
+        mix = {
+            name: float(weight) for name, weight in DEFAULT_MIX.items()
+            if not (args.spawn and name in VECTOR_WORKLOADS)
+        }
+    process = None
+    url = args.url
+    if args.spawn:
+        process = _spawn_server(args.spawn, args.port, args.startup_timeout)
+        url = f"http://127.0.0.1:{args.port}/mcp/{args.spawn}"
+    try:
+        report = asyncio.run(run(
+            url,
+            mix,
+            rate=args.rate,
+            concurrency=max(1, args.concurrency),
+            duration=args.duration,
+            calls_per_session=max(1, args.calls_per_session),
+            timeout=args.timeout,
+            seed=args.seed,
+        ))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Latency/memory benchmark of the context tools at catalog scale.
+
+For each catalog (an existing MCP name, or a synthetic one generated with
+benchmarks.catalog), measures the cold cache load, then calls every tool through an
+in-memory FastMCP client with randomized arguments drawn from the catalog and reports
+p50/p95/p99 latency, error counts, per-call peak Python allocations (tracemalloc) and
+resident memory as JSON, tagged with the git commit so runs can be compared.
+
+The result cache is cleared before every timed call unless --warm-cache is given.
+search_vector/search_hybrid need a vector index (sqlite-vec, or a numpy/ivf engine export);
+synthetic catalogs are embedded with the offline "local" provider.
+
+Usage:
+    python -m benchmarks.tool_latency --tables 1000 10000 100000       # generate missing bench_<n>
+    python -m benchmarks.tool_latency --mcp synth --iterations 200 --output synth.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import subprocess
+import time
+import tracemalloc
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from fastmcp import Client
+
+import server
+from benchmarks import catalog
+from benchmarks.workload import WORKLOADS, WORKLOAD_TOOLS, percentile
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _rss_mb() -> float:
+    """Current resident set size (Linux /proc), falling back to the peak elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return _max_rss_mb()
+    return round(pages * resource.getpagesize() / (1024 * 1024), 1)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=server.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _catalog_context(cache: Dict[str, Any]) -> Dict[str, Any]:
+    segments = cache["DB_SEGMENTS"]
+    return {
+        # Segment ids are already schema-qualified, as the name index keys them
+        "tables": [seg["id"] for seg in segments],
+        "linked": [seg["id"] for seg in segments if seg["keys"]["foreign"]],
+        "summaries": [seg["summary"] for seg in segments if seg.get("summary")] or ["customer orders"],
+        "domains": sorted({seg["domain"] for seg in segments}) or ["default"],
+    }
+
+
+def _clear_result_cache() -> None:
+    with server._RESULT_CACHE_LOCK:
+        server._RESULT_CACHE.clear()
+
+
+def _is_error(result: Any) -> bool:
+    if result.is_error:
+        return True
+    data = result.structured_content
+    return isinstance(data, dict) and "error" in data
+
+
+async def _bench_tool(
+    client: Client,
+    workload: str,
+    ctx: Dict[str, Any],
+    rng: random.Random,
+    iterations: int,
+    warmup: int,
+    memory_samples: int,
+    warm_cache: bool,
+) -> Dict[str, Any]:
+    tool = WORKLOAD_TOOLS.get(workload, workload)
+    latencies, errors, sizes = [], 0, []
+    last_error = None
+    for i in range(warmup + iterations):
+        arguments = WORKLOADS[workload](rng, ctx)
+        if not warm_cache:
+            _clear_result_cache()
+        started = time.perf_counter()
+        result = await client.call_tool(tool, arguments, raise_on_error=False)
+        elapsed = (time.perf_counter() - started) * 1000
+        if i < warmup:
+            continue
+        latencies.append(elapsed)
+        sizes.append(sum(len(getattr(block, "text", "")) for block in result.content))
+        if _is_error(result):
+            errors += 1
+            last_error = (result.content[0].text if result.content else "")[:200]
+
+    # Peak Python allocations per call, measured separately since tracing slows every call
+    peaks = []
+    for _ in range(memory_samples):
+        arguments = WORKLOADS[workload](rng, ctx)
+        if not warm_cache:
+            _clear_result_cache()
+        tracemalloc.start()
+        await client.call_tool(tool, arguments, raise_on_error=False)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    report = {
+        "tool": tool,
+        "workload": workload,
+        "calls": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": round(max(latencies), 3) if latencies else 0.0,
+        "mean_response_bytes": int(np.mean(sizes)) if sizes else 0,
+        "peak_alloc_kb": round(max(peaks) / 1024, 1) if peaks else None,
+    }
+    if last_error:
+        report["last_error"] = last_error
+    return report
+
+
+async def _run_async(
+    mcp_name: str,
+    workloads: List[str],
+    iterations: int,
+    warmup: int,
+    memory_samples: int,
+    warm_cache: bool,
+    seed: int,
+) -> Dict[str, Any]:
+    server.MCP_NAME = mcp_name
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    cache = server._get_mcp_cache(mcp_name)
+    load_seconds = time.perf_counter() - started
+    if not cache["DB_SEGMENTS"]:
+        raise SystemExit(f"No tables indexed for '{mcp_name}'. Run: python setup_db.py --mcp {mcp_name}")
+
+    ctx = _catalog_context(cache)
+    rng = random.Random(seed)
+    tools = []
+    async with Client(server.mcp) as client:
+        for workload in workloads:
+            tools.append(
+                await _bench_tool(client, workload, ctx, rng, iterations, warmup, memory_samples, warm_cache)
+            )
+
+    return {
+        "mcp_name": mcp_name,
+        "tables": len(cache["DB_SEGMENTS"]),
+        "columns": sum(len(seg["columns"]) for seg in cache["DB_SEGMENTS"]),
+        "foreign_keys": sum(len(seg["keys"]["foreign"]) for seg in cache["DB_SEGMENTS"]),
+        "index_version": cache["INDEX_VERSION"],
+        "vector_engine": server._index_vector_config(server._get_pooled_connection(mcp_name))["engine"],
+        "load_seconds": round(load_seconds, 3),
+        "rss_mb_before_load": rss_before,
+        "rss_mb_after_load": _rss_mb(),
+        "iterations": iterations,
+        "warm_cache": warm_cache,
+        "tools": tools,
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+def run(mcp_name: str, workloads: List[str], iterations: int = 50, warmup: int = 3,
+        memory_samples: int = 3, warm_cache: bool = False, seed: int = 0) -> Dict[str, Any]:
+    """Benchmark the given workloads against one MCP catalog (see module docstring)."""
+    return asyncio.run(_run_async(mcp_name, workloads, iterations, warmup, memory_samples, warm_cache, seed))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure context tool latency and memory at catalog scale.")
+    parser.add_argument("--mcp", nargs="+", default=[], help="Existing MCP names to benchmark")
+    parser.add_argument(
+        "--tables", type=int, nargs="+", default=[],
+        help="Synthetic catalog sizes; bench_<n> is generated (and indexed) when missing",
+    )
+    parser.add_argument("--regenerate", action="store_true", help="Regenerate synthetic catalogs even if present")
+    parser.add_argument("--columns", type=int, default=0, help="Minimum columns per generated table")
+    parser.add_argument("--extra-fks", type=int, default=2, help="Extra cross-replica foreign keys per generated table")
+    parser.add_argument("--tools", nargs="+", default=list(WORKLOADS), choices=list(WORKLOADS), help="Workloads to run")
+    parser.add_argument("--iterations", type=int, default=50, help="Timed calls per tool")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed calls per tool")
+    parser.add_argument("--memory-samples", type=int, default=3, help="Calls per tool traced with tracemalloc")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the result cache between calls")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    targets = list(args.mcp)
+    generated = {}
+    for tables in args.tables:
+        mcp_name = f"bench_{tables}"
+        if args.regenerate or not server._get_db_path(mcp_name).exists():
+            stats = catalog.generate(
+                mcp_name, tables, min_columns=args.columns, extra_fks=args.extra_fks, seed=args.seed
+            )
+            stats["index"] = catalog.build(mcp_name)
+            generated[mcp_name] = stats
+        targets.append(mcp_name)
+    if not targets:
+        targets.append(server._get_mcp_name())
+
+    runs = []
+    for mcp_name in targets:
+        result = run(
+            mcp_name, args.tools, args.iterations, args.warmup, args.memory_samples, args.warm_cache, args.seed
+        )
+        if mcp_name in generated:
+            result["generated"] = generated[mcp_name]
+        runs.append(result)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
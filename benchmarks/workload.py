@@ -0,0 +1,54 @@
+"""
+Tool-call workloads shared by the benchmarks.
+
+A catalog context is a dict with "tables" (qualified names), "linked" (tables with foreign
+keys), "summaries" and "domains"; each workload turns it into random tool arguments.
+"""
+import random
+import re
+from typing import List, Dict, Any, Callable
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"[A-Za-z]{3,}")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    return round(float(np.percentile(samples, pct)), 3) if samples else 0.0
+
+
+def _query(rng: random.Random, ctx: Dict[str, Any]) -> str:
+    # Plain words only, so search_fts does not parse them as FTS5 syntax
+    words = _WORD_PATTERN.findall(rng.choice(ctx["summaries"]))
+    start = rng.randrange(max(1, len(words) - 3))
+    return " ".join(words[start:start + 3]) or "customer orders"
+
+
+def _table(rng: random.Random, ctx: Dict[str, Any]) -> str:
+    return rng.choice(ctx["tables"])
+
+
+def _linked_pair(rng: random.Random, ctx: Dict[str, Any]) -> List[str]:
+    source = rng.choice(ctx["linked"] or ctx["tables"])
+    return [source, rng.choice(ctx["tables"])]
+
+
+# Workload name -> argument generator over the catalog: (rng, context) -> arguments
+WORKLOADS: Dict[str, Callable[[random.Random, Dict[str, Any]], Dict[str, Any]]] = {
+    "search_tables": lambda rng, ctx: {"query": _query(rng, ctx), "limit": 10},
+    "search_fts": lambda rng, ctx: {"query": _query(rng, ctx), "limit": 10},
+    "search_vector": lambda rng, ctx: {"query": _query(rng, ctx), "limit": 10},
+    "search_hybrid": lambda rng, ctx: {"query": _query(rng, ctx), "limit": 10},
+    "search_db_map": lambda rng, ctx: {"query": _query(rng, ctx), "top_k": 5},
+    "list_tables": lambda rng, ctx: {},
+    "list_tables_by_domain": lambda rng, ctx: {"domain": rng.choice(ctx["domains"])},
+    "list_columns": lambda rng, ctx: {"table": _table(rng, ctx)},
+    "get_table_schema": lambda rng, ctx: {"table": _table(rng, ctx)},
+    "get_table_schemas": lambda rng, ctx: {"tables": [_table(rng, ctx) for _ in range(5)]},
+    "get_join_path": lambda rng, ctx: dict(zip(("source_table", "target_table"), _linked_pair(rng, ctx))),
+    "plan_joins": lambda rng, ctx: {"tables": [_table(rng, ctx) for _ in range(3)]},
+    "get_domain_overview": lambda rng, ctx: {"domain": rng.choice(ctx["domains"])},
+    "list_domains": lambda rng, ctx: {},
+}
+# Workload name -> tool it calls, where they differ
+WORKLOAD_TOOLS = {"list_tables_by_domain": "list_tables"}
@@ -34,7 +34,7 @@ SFTP_PASSWORD = os.getenv("SFTP_PASSWORD", "changeme")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 
 # MCP Server URL - connects to MCP server within Docker network
-MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://mcp-dabstep:8000")
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://mcp-context:8000")
 
 # Database paths
 BASE_DIR = Path(__file__).resolve().parent
@@ -74,8 +74,8 @@ app_settings: Dict[str, Any] = {
 
 # Known internal MCP server mappings (external path -> internal URL)
 INTERNAL_MCP_SERVERS = {
-    "/mcp/dabstep": "http://mcp-dabstep:8000",
-    "/mcp/synth": "http://mcp-synth:8000",
+    "/mcp/dabstep": "http://mcp-context:8000/mcp/dabstep",
+    "/mcp/synth": "http://mcp-context:8000/mcp/synth",
     "/mcp/postgres": "http://mcp-postgres:8000",
 }
 
@@ -85,7 +85,7 @@ def normalize_mcp_url(url: str) -> str:
     Normalize MCP server URL to use internal Docker URLs when running locally.
     
     Only converts localhost URLs (http://localhost/mcp/dabstep) to internal
-    Docker URLs (http://mcp-dabstep:8000).
+    Docker URLs (http://mcp-context:8000/mcp/dabstep).
     
     Production URLs (https://company-mcp.com/mcp/synth) are left unchanged.
     """
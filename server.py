@@ -1,11 +1,36 @@
 from fastmcp import FastMCP
+from fastmcp.server.dependencies import get_http_request
+from fastmcp.tools.tool import ToolResult
+from mcp.types import TextContent
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+import asyncio
+import base64
+import contextvars
+import cProfile
+import functools
+import hashlib
+import heapq
+import inspect
+import io
 import json
+import math
 import os
+import pickle
+import pstats
+import random
 import re
 import sqlite3
-from collections import defaultdict, deque
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, DefaultDict, Set, Optional
+from typing import List, Dict, Any, Callable, DefaultDict, Set, Optional, Tuple, get_origin
 
 # Try to import sqlite_vec for vector search
 try:
@@ -14,9 +39,24 @@ try:
 except ImportError:
     HAS_SQLITE_VEC = False
 
+# Try to import NumPy for the in-memory vector engine
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# Try to import tiktoken for exact token counts
+try:
+    import tiktoken
+    import tiktoken.load as tiktoken_load
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
+
 # Try to import OpenAI for embeddings
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI, OpenAI
     HAS_OPENAI = True
 except ImportError:
     HAS_OPENAI = False
@@ -29,24 +69,75 @@ except ImportError:
     pass
 
 # Database Context MCP Server - provides schema context through search and metadata tools.
-# MCP name comes from MCP_NAME environment variable (set by docker-compose for each container)
-# Each container (mcp-dabstep, mcp-synth) has its own MCP_NAME which determines its data directory
+# One process serves every dataset directory under data/: requests to /mcp/<name> use
+# data/<name>/. MCP_NAME is the default for requests to plain /mcp and for non-HTTP callers
+# (stdio, setup_db.py).
 MCP_NAME = os.getenv("MCP_NAME", "dabstep")
 mcp = FastMCP(f"{MCP_NAME.title()} Database Context Server")
 
 BASE_DIR = Path(__file__).resolve().parent
 
+# Most tenants (MCP names) whose in-memory caches stay loaded; the least recently used
+# is evicted when another one is loaded (0 = no limit)
+MCP_MAX_TENANTS = int(os.getenv("MCP_MAX_TENANTS", "8"))
+_TENANT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]*$")
+_TENANT_PATH_PATTERN = re.compile(r"^/mcp/([^/]+)(/.*)?$")
+
 
 def _get_mcp_name() -> str:
     """
-    Get the MCP name for this server instance.
-    Uses MCP_NAME environment variable set by docker-compose.
-    
-    Each container runs with its own MCP_NAME:
-    - mcp-dabstep container: MCP_NAME=dabstep -> uses data/dabstep/
-    - mcp-synth container: MCP_NAME=synth -> uses data/synth/
+    Get the MCP name for the current request.
+    HTTP requests to /mcp/<name> carry the name (set by _tenant_routing); anything else
+    uses the MCP_NAME environment variable:
+    - /mcp/dabstep -> uses data/dabstep/
+    - /mcp/synth -> uses data/synth/
     """
-    return MCP_NAME
+    try:
+        request = get_http_request()
+    except RuntimeError:
+        return MCP_NAME
+    return request.scope.get("mcp_name") or MCP_NAME
+
+
+def _is_tenant(mcp_name: str) -> bool:
+    """True if mcp_name is a dataset directory under data/ (one with a map/ or index/)."""
+    if not _TENANT_NAME_PATTERN.match(mcp_name):
+        return False
+    data_dir = BASE_DIR / "data" / mcp_name
+    return (data_dir / "map").is_dir() or (data_dir / "index").is_dir()
+
+
+def _list_tenants() -> List[str]:
+    data_dir = BASE_DIR / "data"
+    if not data_dir.is_dir():
+        return []
+    return sorted(path.name for path in data_dir.iterdir() if _is_tenant(path.name))
+
+
+def _tenant_routing(app: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    ASGI middleware: rewrite /mcp/<name>[/...] to the MCP endpoint at /mcp and record the
+    name in the request scope for _get_mcp_name. Unknown names get a 404.
+    """
+
+    async def route(scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        match = _TENANT_PATH_PATTERN.match(scope.get("path", "")) if scope["type"] == "http" else None
+        if match:
+            mcp_name = match.group(1)
+            if not _is_tenant(mcp_name):
+                body = json.dumps({"error": f"unknown MCP '{mcp_name}'"}).encode("utf-8")
+                await send({
+                    "type": "http.response.start",
+                    "status": 404,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+            path = "/mcp" + (match.group(2) or "").rstrip("/")
+            scope = dict(scope, path=path, raw_path=path.encode("utf-8"), mcp_name=mcp_name)
+        await app(scope, receive, send)
+
+    return route
 
 
 def _get_data_dir(mcp_name: Optional[str] = None) -> Path:
@@ -65,16 +156,49 @@ def _get_db_path(mcp_name: Optional[str] = None) -> Path:
     """Get database path for the given MCP name."""
     return _get_data_dir(mcp_name) / "index" / "index.db"
 
+
+def _get_snapshot_path(mcp_name: Optional[str] = None) -> Path:
+    """Get the precompiled cache snapshot path (written next to index.db)."""
+    return _get_data_dir(mcp_name) / "index" / "cache.snapshot"
+
+
+def _get_vector_dir(mcp_name: Optional[str] = None) -> Path:
+    """Get the exported vector matrix directory used by the NumPy vector engine."""
+    return _get_data_dir(mcp_name) / "index" / "vectors"
+
+
+# Bump when the shape of cached structures (segments, index, graph) changes
+SNAPSHOT_FORMAT = 5
+
+# Seconds between background checks for a new index.db version (0 disables hot reload)
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "5"))
+
 # OpenAI embedding configuration
 EMBEDDING_MODEL = "text-embedding-3-small"
 EMBEDDING_DIMENSIONS = 1536
 
-# Initialize OpenAI client if available
+# Embedding provider used by setup_db.py for new indexes ("openai" or "local");
+# queries always use the provider recorded in the index's index_metadata
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").strip().lower()
+LOCAL_EMBEDDING_MODEL = "local-hashed-ngram-v1"
+LOCAL_EMBEDDING_DIMENSIONS = int(os.getenv("LOCAL_EMBEDDING_DIMENSIONS", "512"))
+
+# documents columns that setup_db.py mirrors into documents_vec as vec0 metadata
+# columns so search_vector filters are applied inside the KNN scan
+VEC_FILTER_COLUMNS = ("database_name", "domain", "doc_type")
+
+# Seconds a query embedding request may take (retries included) before search_vector gives up
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "10"))
+
+# Initialize OpenAI clients if available: the sync client embeds documents in setup_db.py,
+# the async one embeds search queries without blocking the server's event loop
 _openai_client: Optional["OpenAI"] = None
+_async_openai_client: Optional["AsyncOpenAI"] = None
 if HAS_OPENAI:
     api_key = os.getenv("OPENAI_API_KEY")
     if api_key:
         _openai_client = OpenAI(api_key=api_key)
+        _async_openai_client = AsyncOpenAI(api_key=api_key, timeout=OPENAI_TIMEOUT)
 
 
 def _load_json(path: Path) -> Any:
@@ -108,6 +232,54 @@ def _load_map_file(db_path: str, mcp_name: Optional[str] = None) -> Optional[Dic
     return None
 
 
+# --- Parsed schema cache ---
+
+# Parsed table JSON keyed by (mcp_name, file_path, content_hash): a reindexed file gets a
+# new content_hash, so entries never need invalidating, only LRU eviction
+SCHEMA_CACHE_SIZE = int(os.getenv("SCHEMA_CACHE_SIZE", "2048"))
+_SCHEMA_CACHE: "OrderedDict[Tuple[str, str, str], Optional[Dict[str, Any]]]" = OrderedDict()
+_SCHEMA_CACHE_LOCK = threading.Lock()
+_SCHEMA_CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def _load_table_schema(db: sqlite3.Connection, row: sqlite3.Row, mcp_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Parsed JSON for a table document row (needs file_path and content_hash). On a miss the
+    JSON is parsed from the row's content column (queried only if the row lacks it), falling
+    back to the map file, so steady-state lookups touch neither. Returned dicts are shared
+    and must not be mutated.
+    """
+    key = (mcp_name, row["file_path"], row["content_hash"] or "")
+    with _SCHEMA_CACHE_LOCK:
+        if key in _SCHEMA_CACHE:
+            _SCHEMA_CACHE.move_to_end(key)
+            _SCHEMA_CACHE_STATS["hits"] += 1
+            return _SCHEMA_CACHE[key]
+        _SCHEMA_CACHE_STATS["misses"] += 1
+
+    schema = None
+    if row["file_path"].endswith(".json"):
+        if "content" in row.keys():
+            content = row
+        else:
+            content = db.execute(
+                "SELECT content FROM documents WHERE doc_type = 'table' AND file_path = ? LIMIT 1",
+                (row["file_path"],),
+            ).fetchone()
+        try:
+            schema = json.loads(content["content"]) if content and content["content"] else None
+        except ValueError:
+            schema = None
+        if not isinstance(schema, dict):
+            schema = _load_map_file(row["file_path"], mcp_name)
+
+    with _SCHEMA_CACHE_LOCK:
+        _SCHEMA_CACHE[key] = schema
+        while len(_SCHEMA_CACHE) > SCHEMA_CACHE_SIZE:
+            _SCHEMA_CACHE.popitem(last=False)
+    return schema
+
+
 def _safe_load_map(mcp_name: Optional[str] = None) -> List[Dict[str, Any]]:
     """Load table segments from index.db database for the given MCP name."""
     db = _get_db_connection(mcp_name)
@@ -156,105 +328,507 @@ def _safe_load_map(mcp_name: Optional[str] = None) -> List[Dict[str, Any]]:
         return []
 
 
-# Per-MCP-name caches for loaded data structures
-# These are initialized lazily per MCP instance
-_MCP_CACHE: Dict[str, Dict[str, Any]] = {}
+# Per-MCP-name caches for loaded data structures, in least-recently-used order
+# These are initialized lazily per MCP instance; at most MCP_MAX_TENANTS stay loaded
+_MCP_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_MCP_CACHE_LOCK = threading.Lock()
+# mcp_name -> lock serializing that tenant's initial load
+_TENANT_LOAD_LOCKS: Dict[str, threading.Lock] = {}
 
 
 def _normalize(text: str) -> List[str]:
     return re.findall(r"[a-z0-9]+", text.lower())
 
 
-def _segment_tokens(seg: Dict[str, Any]) -> Set[str]:
-    text_parts = [
-        seg.get("id", ""),
-        seg.get("title", ""),
-        seg.get("summary", ""),
-        seg.get("database", ""),
-        seg.get("domain", ""),
-        " ".join(col.get("name", "") for col in seg.get("columns", [])),
-    ]
-    return set(_normalize(" ".join(text_parts)))
+# --- BM25 ranking ---
+
+# Field boosts for the in-memory BM25 index: table name > summary > column names > database/domain
+BM25_FIELD_BOOSTS = {"name": 3.0, "summary": 1.5, "columns": 1.0, "meta": 0.5}
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Query terms with no exact posting are expanded to at most this many vocabulary prefixes
+BM25_MAX_PREFIX_EXPANSIONS = 20
+BM25_PREFIX_WEIGHT = 0.5
 
 
-def _build_index(segments: List[Dict[str, Any]]) -> Dict[str, Set[str]]:
+def _segment_fields(seg: Dict[str, Any]) -> Dict[str, List[str]]:
+    return {
+        "name": _normalize(seg.get("id", "")),
+        "summary": _normalize(seg.get("summary", "")),
+        "columns": _normalize(" ".join(col.get("name", "") for col in seg.get("columns", []))),
+        "meta": _normalize(f"{seg.get('database', '')} {seg.get('domain', '')}"),
+    }
+
+
+def _build_index(segments: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Build a lightweight inverted index: token -> set(segment_ids).
-    Scales better as the context map grows.
+    Build the BM25 inverted index over segment positions in DB_SEGMENTS.
+    postings: term -> (positions, field-boosted term frequencies), both compact arrays;
+    doc_len holds field-boosted document lengths. vocab is sorted for prefix lookups.
     """
-    index: DefaultDict[str, Set[str]] = defaultdict(set)
-    for seg in segments:
-        for token in _segment_tokens(seg):
-            index[token].add(seg["id"])
-    return dict(index)
+    postings: DefaultDict[str, Tuple[array, array]] = defaultdict(lambda: (array("I"), array("f")))
+    doc_len = array("f")
+    for pos, seg in enumerate(segments):
+        weighted: DefaultDict[str, float] = defaultdict(float)
+        length = 0.0
+        for field, tokens in _segment_fields(seg).items():
+            boost = BM25_FIELD_BOOSTS[field]
+            length += boost * len(tokens)
+            for token in tokens:
+                weighted[token] += boost
+        doc_len.append(length)
+        for token, tf in weighted.items():
+            positions, tfs = postings[token]
+            positions.append(pos)
+            tfs.append(tf)
+    n_docs = len(segments)
+    return {
+        "postings": dict(postings),
+        "doc_len": doc_len,
+        "avg_len": (sum(doc_len) / n_docs) if n_docs else 0.0,
+        "n_docs": n_docs,
+        "vocab": sorted(postings),
+    }
 
 
-def _safe_load_index(segments: List[Dict[str, Any]]) -> Dict[str, Set[str]]:
+def _safe_load_index(segments: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Build inverted index from segments."""
     return _build_index(segments)
 
 
+def _query_terms(index: Dict[str, Any], query: str) -> Dict[str, float]:
+    """
+    Map query tokens to index terms with weights: exact terms at 1.0, otherwise up to
+    BM25_MAX_PREFIX_EXPANSIONS vocabulary terms sharing the prefix (e.g. 'pay' -> 'payments').
+    """
+    terms: Dict[str, float] = {}
+    vocab = index["vocab"]
+    for token in set(_normalize(query)):
+        if token in index["postings"]:
+            terms[token] = 1.0
+            continue
+        if len(token) < 3:
+            continue
+        start = bisect_left(vocab, token)
+        for term in vocab[start:start + BM25_MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            terms[term] = max(terms.get(term, 0.0), BM25_PREFIX_WEIGHT)
+    return terms
+
+
+def _bm25_search(
+    index: Dict[str, Any],
+    segments: List[Dict[str, Any]],
+    query: str,
+    limit: int,
+    database: str = "",
+    domain: str = "",
+) -> Tuple[List[Tuple[int, float]], int]:
+    """
+    Score segments for a query with BM25 over the touched postings only, and pick the
+    top `limit` with a heap. Returns ([(position, score)], number of matching segments).
+    """
+    n_docs = index["n_docs"]
+    if not n_docs:
+        return [], 0
+    avg_len = index["avg_len"] or 1.0
+    doc_len = index["doc_len"]
+    scores: DefaultDict[int, float] = defaultdict(float)
+    allowed: Dict[int, bool] = {}
+
+    for term, weight in _query_terms(index, query).items():
+        positions, tfs = index["postings"][term]
+        idf = math.log(1.0 + (n_docs - len(positions) + 0.5) / (len(positions) + 0.5))
+        for pos, tf in zip(positions, tfs):
+            ok = allowed.get(pos)
+            if ok is None:
+                seg = segments[pos]
+                ok = allowed[pos] = (
+                    (not database or seg.get("database", "") == database)
+                    and (not domain or seg.get("domain", "") == domain)
+                )
+            if not ok:
+                continue
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[pos] / avg_len)
+            scores[pos] += weight * idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+    top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+    return top, len(scores)
+
+
 # Helper function to get or initialize cache for an MCP name
 def _get_mcp_cache(mcp_name: Optional[str] = None) -> Dict[str, Any]:
-    """Get or initialize the cache for a specific MCP name."""
+    """Get or initialize the cache for a specific MCP name (marking it most recently used)."""
     if mcp_name is None:
         mcp_name = _get_mcp_name()
     
-    if mcp_name not in _MCP_CACHE:
-        _MCP_CACHE[mcp_name] = {
-            "DB_SEGMENTS": [],
-            "INDEX": {},
-            "SEGMENT_BY_ID": {},
-            "GRAPH": {},
-            "initialized": False,
-        }
-    
-    cache = _MCP_CACHE[mcp_name]
+    with _MCP_CACHE_LOCK:
+        cache = _MCP_CACHE.get(mcp_name)
+        if cache is not None:
+            _MCP_CACHE.move_to_end(mcp_name)
     
-    # Lazy initialization - only load if not already initialized
-    if not cache["initialized"]:
-        _initialize_globals(mcp_name)
+    # Lazy initialization - only load if not already loaded
+    if cache is None:
+        cache = _initialize_globals(mcp_name)
     
     return cache
 
 
-def _find_table(table: str, database: str = "", mcp_name: Optional[str] = None) -> Dict[str, Any]:
-    """Find a table segment by name (flexible matching), optionally filtered by database."""
-    # Normalize input: strip .json suffix if present
-    table_clean = table
-    if table_clean.endswith(".json"):
-        table_clean = table_clean[:-5]
-    table_norm = table_clean.lower()
-    
-    # Get cache for current MCP
-    cache = _get_mcp_cache(mcp_name)
-    segments = cache["DB_SEGMENTS"]
-    
-    # Filter by database if specified
+# --- Table name resolution ---
+
+# Minimum trigram similarity (Dice coefficient over bare table names) for typo-tolerant matches
+NAME_MATCH_MIN_SIMILARITY = 0.7
+
+
+def _trigrams(text: str, pad: bool = True) -> Set[str]:
+    if pad:
+        text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _normalize_table_name(table: str) -> str:
+    table = table.strip()
+    if table.endswith(".json"):
+        table = table[:-5]
+    return table.casefold()
+
+
+def _table_name_keys(seg: Dict[str, Any]) -> Tuple[Set[str], Set[str]]:
+    """
+    Return (id_keys, alias_keys) for a segment. id_keys are the case-folded id, optionally
+    database-scoped; alias_keys add the bare table name and the schema-qualified name.
+    """
+    table_id = seg["id"].casefold()
+    bare = table_id.rsplit(".", 1)[-1]
+    aliases = {bare}
+    schema = (seg.get("schema") or "").casefold()
+    if schema:
+        aliases.add(f"{schema}.{bare}")
+    aliases.discard(table_id)
+    id_keys = {table_id}
+    database = (seg.get("database") or "").casefold()
     if database:
-        segments = [s for s in segments if s.get("database") == database]
-    
-    # Try exact match first (case-insensitive)
-    for seg in segments:
-        if seg["id"].lower() == table_norm:
-            return seg
-    
-    # Try matching title
-    for seg in segments:
-        if seg.get("title", "").lower() == f"{table_norm} table":
-            return seg
-    
-    # Try partial match (table name contains search term)
-    for seg in segments:
-        if table_norm in seg["id"].lower():
-            return seg
-    
-    return {}
+        id_keys.add(f"{database}.{table_id}")
+        aliases |= {f"{database}.{alias}" for alias in aliases}
+    return id_keys, aliases - id_keys
+
+
+def _build_name_index(segments: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build the table name resolution index over segment positions in DB_SEGMENTS:
+    hash maps for exact/alias keys, a trigram index over full names for substring matches and
+    one over bare table names for typo matches. Posting lists stay sorted by position, so
+    ties resolve to the first segment.
+    """
+    ids: DefaultDict[str, List[int]] = defaultdict(list)
+    aliases: DefaultDict[str, List[int]] = defaultdict(list)
+    trigrams: DefaultDict[str, List[int]] = defaultdict(list)
+    bare_trigrams: DefaultDict[str, List[int]] = defaultdict(list)
+    names: List[str] = []
+    gram_counts: List[int] = []
+    for pos, seg in enumerate(segments):
+        id_keys, alias_keys = _table_name_keys(seg)
+        for key in id_keys:
+            ids[key].append(pos)
+        for key in alias_keys:
+            aliases[key].append(pos)
+        name = seg["id"].casefold()
+        for gram in _trigrams(name):
+            trigrams[gram].append(pos)
+        bare_grams = _trigrams(name.rsplit(".", 1)[-1])
+        for gram in bare_grams:
+            bare_trigrams[gram].append(pos)
+        names.append(name)
+        gram_counts.append(len(bare_grams))
+    return {
+        "ids": dict(ids),
+        "aliases": dict(aliases),
+        "trigrams": dict(trigrams),
+        "bare_trigrams": dict(bare_trigrams),
+        "names": names,
+        "gram_counts": gram_counts,
+    }
+
+
+def _resolve_table(
+    name_index: Dict[str, Any],
+    segments: List[Dict[str, Any]],
+    table: str,
+    database: str = "",
+) -> Optional[int]:
+    """
+    Resolve a table name to a DB_SEGMENTS position: exact id, then alias (bare,
+    schema-qualified or database-scoped name), then substring, then closest trigram match.
+    """
+    query = _normalize_table_name(table)
+    if not query or not segments:
+        return None
+
+    def allowed(pos: int) -> bool:
+        return not database or segments[pos].get("database") == database
+
+    for tier in ("ids", "aliases"):
+        for pos in name_index[tier].get(query, ()):
+            if allowed(pos):
+                return pos
+
+    names = name_index["names"]
+    postings = name_index["trigrams"]
+
+    # Substring: intersect the query's trigram postings, then verify
+    grams = _trigrams(query, pad=False)
+    if grams:
+        lists = [postings.get(gram) for gram in grams]
+        if all(lists):
+            lists.sort(key=len)
+            candidates = set(lists[0])
+            for other in lists[1:]:
+                candidates.intersection_update(other)
+                if not candidates:
+                    break
+            for pos in sorted(candidates):
+                if allowed(pos) and query in names[pos]:
+                    return pos
+    else:
+        for pos, name in enumerate(names):
+            if allowed(pos) and query in name:
+                return pos
+
+    # Typo tolerance: best Dice similarity between bare names over shared padded trigrams
+    query_grams = _trigrams(query.rsplit(".", 1)[-1])
+    bare_postings = name_index["bare_trigrams"]
+    overlap: DefaultDict[int, int] = defaultdict(int)
+    for gram in query_grams:
+        for pos in bare_postings.get(gram, ()):
+            overlap[pos] += 1
+    best_pos, best_score = None, NAME_MATCH_MIN_SIMILARITY
+    for pos in sorted(overlap):
+        if not allowed(pos):
+            continue
+        score = 2.0 * overlap[pos] / (len(query_grams) + name_index["gram_counts"][pos])
+        if score > best_score:
+            best_pos, best_score = pos, score
+    return best_pos
+
+
+def _find_table(
+    table: str,
+    database: str = "",
+    mcp_name: Optional[str] = None,
+    cache: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Find a table segment by name (flexible matching), optionally filtered by database.
+    Pass the caller's cache so one tool call resolves against a single index snapshot.
+    """
+    if cache is None:
+        cache = _get_mcp_cache(mcp_name)
+    segments = cache["DB_SEGMENTS"]
+    pos = _resolve_table(cache["NAME_INDEX"], segments, table, database)
+    return segments[pos] if pos is not None else {}
+
+
+# --- Token counting and budgets ---
+
+# Counts use the tiktoken encoding when its BPE file is in tiktoken's cache
+# (TIKTOKEN_CACHE_DIR, warmed when the Docker image is built); otherwise a word/punctuation
+# heuristic that tracks BPE counts far closer than len // 4 on identifiers and JSON. The
+# file is only downloaded when TOKENIZER_DOWNLOAD=1.
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+TOKENIZER_DOWNLOAD = os.getenv("TOKENIZER_DOWNLOAD", "").strip().lower() in ("1", "true", "yes")
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "8192"))
+# Counts keyed by a digest of the text, so large responses are not retained by the cache
+_TOKEN_COUNT_CACHE: "OrderedDict[bytes, int]" = OrderedDict()
+_TOKEN_COUNT_LOCK = threading.Lock()
+_TOKENIZER: Dict[str, Any] = {}
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]+")
+
+
+def _offline_bpe_fetch(blobpath: str) -> bytes:
+    raise RuntimeError(f"{blobpath} is not cached and TOKENIZER_DOWNLOAD is off")
+
+
+def _get_tokenizer() -> Any:
+    """
+    tiktoken encoding, loaded once (at startup, under _TOKEN_COUNT_LOCK); None when
+    tiktoken or its cached BPE file is unavailable.
+    """
+    if "encoder" in _TOKENIZER:
+        return _TOKENIZER["encoder"]
+    with _TOKEN_COUNT_LOCK:
+        if "encoder" not in _TOKENIZER:
+            encoder = None
+            if HAS_TIKTOKEN:
+                # tiktoken fetches uncached BPE files through tiktoken.load.read_file
+                fetch = tiktoken_load.read_file
+                if not TOKENIZER_DOWNLOAD:
+                    tiktoken_load.read_file = _offline_bpe_fetch
+                try:
+                    encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    print(f"[MCP] Tokenizer {TOKENIZER_ENCODING} unavailable ({e}); using heuristic token counts")
+                finally:
+                    tiktoken_load.read_file = fetch
+            _TOKENIZER["encoder"] = encoder
+    return _TOKENIZER["encoder"]
 
 
 def _estimate_tokens(text: str) -> int:
-    # Rough heuristic: 1 token ≈ 4 chars; sufficient for budget hints.
-    return max(1, len(text) // 4)
+    """Token count of text (tiktoken, or the heuristic fallback), cached by content digest."""
+    key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _TOKEN_COUNT_LOCK:
+        count = _TOKEN_COUNT_CACHE.get(key)
+        if count is not None:
+            _TOKEN_COUNT_CACHE.move_to_end(key)
+            return count
+    encoder = _get_tokenizer()
+    if encoder is not None:
+        count = len(encoder.encode(text, disallowed_special=()))
+    else:
+        # Words split into ~4-character pieces, digit runs into 3-digit pieces and
+        # punctuation runs (e.g. JSON's '":"') into pairs
+        count = 0
+        for piece in _TOKEN_PATTERN.findall(text):
+            if piece[0].isalpha():
+                count += (len(piece) + 3) // 4
+            elif piece[0].isdigit():
+                count += (len(piece) + 2) // 3
+            else:
+                count += (len(piece) + 1) // 2
+    count = max(1, count)
+    with _TOKEN_COUNT_LOCK:
+        _TOKEN_COUNT_CACHE[key] = count
+        while len(_TOKEN_COUNT_CACHE) > TOKEN_COUNT_CACHE_SIZE:
+            _TOKEN_COUNT_CACHE.popitem(last=False)
+    return count
+
+
+# Response detail levels: how many steps of a tool's elision ladder are always applied
+DETAIL_LEVELS = ("full", "compact", "minimal")
+
+# Elision ladders: (field path, action, max chars for "abbreviated"), applied in order until
+# the response fits max_tokens. "columns.x" addresses field x of every column.
+SCHEMA_ELISION_STEPS: List[Tuple[str, str, int]] = [
+    ("columns.samples", "dropped", 0),
+    ("columns.description", "abbreviated", 80),
+    ("related_tables", "dropped", 0),
+    ("indexes", "dropped", 0),
+    ("description", "abbreviated", 200),
+    ("columns.description", "dropped", 0),
+    ("columns.nullable", "dropped", 0),
+    ("file_path", "dropped", 0),
+    ("description", "dropped", 0),
+]
+SCHEMA_DETAIL_STEPS = {"full": 0, "compact": 5, "minimal": 8}
+SEARCH_ELISION_STEPS: List[Tuple[str, str, int]] = [
+    ("content_preview", "dropped", 0),
+    ("summary", "abbreviated", 120),
+    ("file_path", "dropped", 0),
+    ("summary", "dropped", 0),
+]
+SEARCH_DETAIL_STEPS = {"full": 0, "compact": 2, "minimal": 4}
+
+
+def _response_tokens(response: Dict[str, Any]) -> int:
+    return _estimate_tokens(json.dumps(response, default=str))
+
+
+def _elide_field(items: List[Dict[str, Any]], path: str, action: str, max_chars: int) -> int:
+    """Drop or abbreviate a (possibly columns.-nested) field in place; returns how many values changed."""
+    head, _, leaf = path.rpartition(".")
+    targets = [child for item in items for child in item.get(head, [])] if head else items
+    changed = 0
+    for target in targets:
+        if leaf not in target:
+            continue
+        if action == "dropped":
+            del target[leaf]
+            changed += 1
+        elif isinstance(target[leaf], str) and len(target[leaf]) > max_chars:
+            target[leaf] = target[leaf][:max_chars].rstrip() + "..."
+            changed += 1
+    return changed
+
+
+def _truncate_lists(response: Dict[str, Any], owners: List[Dict[str, Any]], key: str, max_tokens: int) -> int:
+    """Cap every owner[key] list at the largest common length that fits; returns entries removed."""
+    owners = [owner for owner in owners if isinstance(owner.get(key), list) and owner[key]]
+    if not owners:
+        return 0
+    full = [owner[key] for owner in owners]
+    low, high = 1, max(len(entries) for entries in full)
+    while low < high:
+        mid = (low + high + 1) // 2
+        for owner, entries in zip(owners, full):
+            owner[key] = entries[:mid]
+        if _response_tokens(response) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    removed = 0
+    for owner, entries in zip(owners, full):
+        owner[key] = entries[:low]
+        removed += len(entries) - low
+    return removed
+
+
+def _fit_budget(
+    response: Dict[str, Any],
+    items: List[Dict[str, Any]],
+    steps: List[Tuple[str, str, int]],
+    detail_steps: int,
+    max_tokens: int,
+    truncate: Tuple[List[Dict[str, Any]], str],
+) -> Dict[str, Any]:
+    """
+    Progressively elide fields of items (dicts inside response, edited in place): the first
+    detail_steps are always applied, the rest only while the response exceeds max_tokens
+    (0 = no budget). As a last resort the truncate = (owners, key) lists are shortened
+    (e.g. ([response], "results") drops the lowest-ranked results). Sets response["elided"]
+    to what was removed, as {"abbreviated": [fields], "dropped": [fields], "truncated":
+    {key: count}} with each field under its final action, and response["tokens_used"] to
+    the final token count. When even the smallest form exceeds max_tokens,
+    response["budget_exceeded"] is True and response["min_tokens"] its size.
+    """
+    # The report is part of the response while measuring, so it counts against the budget;
+    # it stays compact (field names grouped by action) so it costs few tokens
+    final_actions: Dict[str, str] = {}
+    elided: Dict[str, Any] = {}
+    response["elided"] = elided
+
+    def report() -> None:
+        elided.clear()
+        for field, action in final_actions.items():
+            elided.setdefault(action, []).append(field)
+
+    for position, (path, action, max_chars) in enumerate(steps):
+        if position >= detail_steps and (not max_tokens or _response_tokens(response) <= max_tokens):
+            break
+        if _elide_field(items, path, action, max_chars):
+            # A later step on the same field (abbreviated, then dropped) supersedes the earlier one
+            final_actions.pop(path, None)
+            final_actions[path] = action
+            report()
+    if max_tokens and _response_tokens(response) > max_tokens:
+        owners, key = truncate
+        elided["truncated"] = {key: 0}
+        removed = _truncate_lists(response, owners, key, max_tokens)
+        if removed:
+            elided["truncated"][key] = removed
+        else:
+            del elided["truncated"]
+    if not elided:
+        del response["elided"]
+    response["tokens_used"] = _response_tokens(response)
+    if max_tokens and response["tokens_used"] > max_tokens:
+        response["budget_exceeded"] = True
+        # min_tokens counts itself; settle once its own digits stop changing the total
+        response["min_tokens"] = 0
+        while response["min_tokens"] != response["tokens_used"]:
+            response["min_tokens"] = response["tokens_used"]
+            response["tokens_used"] = _response_tokens(response)
+    return response
 
 
 def _foreign_key_edges(seg: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -273,32 +847,356 @@ def _foreign_key_edges(seg: Dict[str, Any]) -> List[Dict[str, Any]]:
     return edges
 
 
-def _build_graph(segments: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
-    graph: DefaultDict[str, List[Dict[str, Any]]] = defaultdict(list)
+def _build_graph(segments: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build the relationship graph as interned CSR adjacency: table names map to integer
+    node ids, node i's neighbours are targets[offsets[i]:offsets[i + 1]], and edge_ids
+    index a shared side table of edge metadata. Each directed table pair is stored once
+    (FK edges win over depends_on/referenced_by notes for the same pair), and every
+    relationship is traversable in both directions.
+    """
+    node_ids: Dict[str, int] = {}
+    # Edge metadata: 0/1 are the shared relationship notes, FK infos follow
+    edges: List[Dict[str, Any]] = [{"note": "depends_on"}, {"note": "referenced_by"}]
+    pair_edges: Dict[Tuple[int, int], int] = {}
+
+    def intern(name: str) -> int:
+        node = node_ids.get(name)
+        if node is None:
+            node = node_ids[name] = len(node_ids)
+        return node
+
+    def add(a: int, b: int, edge_id: int) -> None:
+        current = pair_edges.get((a, b))
+        if current is None or (current < 2 <= edge_id):
+            pair_edges[(a, b)] = edge_id
+
     for seg in segments:
-        # Foreign key edges (bidirectional for traversal)
         for edge in _foreign_key_edges(seg):
-            graph[edge["from"]].append({"to": edge["to"], "info": edge})
-            graph[edge["to"]].append({"to": edge["from"], "info": edge})
+            a, b = intern(edge["from"]), intern(edge["to"])
+            if (a, b) in pair_edges and pair_edges[(a, b)] >= 2:
+                continue  # Keep the first FK between a pair
+            edges.append(edge)
+            add(a, b, len(edges) - 1)
+            add(b, a, len(edges) - 1)
         rel = seg.get("relationships", {}) or {}
         for dep in rel.get("depends_on", []) or []:
-            graph[seg["id"]].append({"to": dep, "info": {"note": "depends_on"}})
-            graph[dep].append({"to": seg["id"], "info": {"note": "referenced_by"}})
+            seg_node, dep_node = intern(seg["id"]), intern(dep)
+            add(seg_node, dep_node, 0)
+            add(dep_node, seg_node, 1)
         for ref in rel.get("referenced_by", []) or []:
-            graph[seg["id"]].append({"to": ref, "info": {"note": "referenced_by"}})
-            graph[ref].append({"to": seg["id"], "info": {"note": "depends_on"}})
-    return graph
+            seg_node, ref_node = intern(seg["id"]), intern(ref)
+            add(seg_node, ref_node, 1)
+            add(ref_node, seg_node, 0)
+
+    # Counting sort of the directed pairs by source node (insertion order kept per node)
+    offsets = array("I", [0]) * (len(node_ids) + 1)
+    for a, _ in pair_edges:
+        offsets[a + 1] += 1
+    for i in range(len(node_ids)):
+        offsets[i + 1] += offsets[i]
+    targets = array("I", [0]) * len(pair_edges)
+    edge_ids = array("I", [0]) * len(pair_edges)
+    cursor = array("I", offsets[:-1])
+    for (a, b), edge_id in pair_edges.items():
+        targets[cursor[a]] = b
+        edge_ids[cursor[a]] = edge_id
+        cursor[a] += 1
+
+    nodes = [""] * len(node_ids)
+    for name, node in node_ids.items():
+        nodes[node] = name
+    return {
+        "nodes": nodes,
+        "node_ids": node_ids,
+        "offsets": offsets,
+        "targets": targets,
+        "edge_ids": edge_ids,
+        "edges": edges,
+    }
+
+
+# --- Join path search ---
+
+# Memoized (source, target, max_hops) -> path entries per index version
+JOIN_PATH_CACHE_SIZE = int(os.getenv("JOIN_PATH_CACHE_SIZE", "4096"))
+# Graphs with at most this many nodes get an all-pairs BFS table in the cache snapshot
+JOIN_PATH_ALL_PAIRS_MAX_NODES = int(os.getenv("JOIN_PATH_ALL_PAIRS_MAX_NODES", "500"))
+_JOIN_PATH_LOCK = threading.Lock()
+_MISSING = object()
+
+
+def _bfs_tree(graph: Dict[str, Any], src: int) -> Dict[int, Tuple[int, int]]:
+    """Single-source BFS over node ids: reachable node -> (parent, hops); the source's parent is -1."""
+    offsets, targets = graph["offsets"], graph["targets"]
+    tree = {src: (-1, 0)}
+    queue = deque([src])
+    while queue:
+        node = queue.popleft()
+        depth = tree[node][1] + 1
+        for pos in range(offsets[node], offsets[node + 1]):
+            nxt = targets[pos]
+            if nxt not in tree:
+                tree[nxt] = (node, depth)
+                queue.append(nxt)
+    return tree
+
+
+def _build_all_pairs(graph: Dict[str, Any]) -> List[Dict[int, Tuple[int, int]]]:
+    """All-pairs shortest path table (one BFS tree per node id) for small graphs, else []."""
+    node_count = len(graph["nodes"])
+    if not node_count or node_count > JOIN_PATH_ALL_PAIRS_MAX_NODES:
+        return []
+    return [_bfs_tree(graph, node) for node in range(node_count)]
+
+
+def _bidirectional_path(graph: Dict[str, Any], src: int, tgt: int, max_hops: int) -> Optional[List[int]]:
+    """
+    Shortest path of at most max_hops edges between src and tgt, as a node id list.
+    Expands the smaller frontier one full level at a time, recording parent pointers
+    on both sides, and stops as soon as the two searches meet.
+    """
+    if src == tgt:
+        return [src]
+    offsets, targets = graph["offsets"], graph["targets"]
+    forward: Dict[int, Tuple[int, int]] = {src: (-1, 0)}
+    backward: Dict[int, Tuple[int, int]] = {tgt: (-1, 0)}
+    frontier_f, frontier_b = [src], [tgt]
+    depth_f = depth_b = 0
+    # Every relationship is stored in both directions, so both sides walk the same adjacency
+    while frontier_f and frontier_b and depth_f + depth_b < max_hops:
+        expand_forward = len(frontier_f) <= len(frontier_b)
+        frontier, parents, other = (frontier_f, forward, backward) if expand_forward else (frontier_b, backward, forward)
+        depth = (depth_f if expand_forward else depth_b) + 1
+        next_frontier = []
+        meet = -1
+        for node in frontier:
+            for pos in range(offsets[node], offsets[node + 1]):
+                nxt = targets[pos]
+                if nxt in parents:
+                    continue
+                parents[nxt] = (node, depth)
+                next_frontier.append(nxt)
+                if nxt in other and (meet < 0 or other[nxt][1] < other[meet][1]):
+                    meet = nxt
+        if expand_forward:
+            frontier_f, depth_f = next_frontier, depth
+        else:
+            frontier_b, depth_b = next_frontier, depth
+        if meet >= 0:
+            path = []
+            node = meet
+            while node >= 0:
+                path.append(node)
+                node = forward[node][0]
+            path.reverse()
+            node = backward[meet][0]
+            while node >= 0:
+                path.append(node)
+                node = backward[node][0]
+            return path
+    return None
+
+
+def _tree_path(tree: Dict[int, Tuple[int, int]], tgt: int) -> List[int]:
+    """Node ids from a BFS tree's source to tgt (tgt must be reachable)."""
+    path = [tgt]
+    while tree[path[-1]][0] >= 0:
+        path.append(tree[path[-1]][0])
+    path.reverse()
+    return path
+
+
+def _find_join_path(cache: Dict[str, Any], src: str, tgt: str, max_hops: int) -> Optional[List[int]]:
+    """Node id path from src to tgt within max_hops, memoized per index version (None if unreachable)."""
+    key = (src, tgt, max_hops)
+    memo = cache["JOIN_PATHS"]
+    with _JOIN_PATH_LOCK:
+        path = memo.get(key, _MISSING)
+        if path is not _MISSING:
+            memo.move_to_end(key)
+            return path
+
+    graph = cache["GRAPH"]
+    src_node = graph["node_ids"].get(src)
+    tgt_node = graph["node_ids"].get(tgt)
+    all_pairs = cache.get("JOIN_APSP")
+    path = None
+    if src_node is None or tgt_node is None:
+        pass
+    elif all_pairs:
+        tree = all_pairs[src_node]
+        if tgt_node in tree and tree[tgt_node][1] <= max_hops:
+            path = _tree_path(tree, tgt_node)
+    else:
+        path = _bidirectional_path(graph, src_node, tgt_node, max_hops)
+
+    with _JOIN_PATH_LOCK:
+        memo[key] = path
+        while len(memo) > JOIN_PATH_CACHE_SIZE:
+            memo.popitem(last=False)
+    return path
+
+
+def _fk_on_clause(info: Dict[str, Any]) -> Optional[str]:
+    """Equi-join condition for a foreign key edge ("a.x = b.y AND ..."), or None if unknown."""
+    match = re.match(r"^\s*([^()]+?)\s*\((.*)\)\s*$", info.get("references", ""))
+    columns = info.get("columns") or []
+    if not match or not columns:
+        return None
+    ref_table = match.group(1)
+    ref_columns = [col.strip() for col in match.group(2).split(",") if col.strip()]
+    if len(ref_columns) != len(columns):
+        return None
+    return " AND ".join(
+        f"{info['from']}.{col} = {ref_table}.{ref_col}" for col, ref_col in zip(columns, ref_columns)
+    )
+
+
+def _steiner_tree(cache: Dict[str, Any], terminals: List[str]) -> Tuple[List[Tuple[int, int]], List[str]]:
+    """
+    Approximate minimum Steiner tree connecting terminals (Kou-Markowsky-Berman):
+    MST over the shortest-path metric closure, expanded into graph paths, re-spanned and
+    pruned of non-terminal leaves. Returns (join steps as (parent, child) node ids in BFS
+    order from terminals[0], terminals unreachable from terminals[0]).
+    """
+    graph = cache["GRAPH"]
+    node_ids = graph["node_ids"]
+    if terminals[0] not in node_ids:
+        return [], terminals[1:]
+    all_pairs = cache.get("JOIN_APSP") or []
+    terminal_nodes = [node_ids[t] for t in terminals if t in node_ids]
+    trees = {t: all_pairs[t] if all_pairs else _bfs_tree(graph, t) for t in terminal_nodes}
+
+    # Prim over the metric closure; each chosen pair is expanded into its BFS path
+    root = terminal_nodes[0]
+    connected = {root}
+    edges: Set[Tuple[int, int]] = set()
+    while len(connected) < len(terminal_nodes):
+        best = None
+        best_hops = 0
+        for u in connected:
+            tree = trees[u]
+            for v in terminal_nodes:
+                if v not in connected and v in tree and (best is None or tree[v][1] < best_hops):
+                    best, best_hops = (u, v), tree[v][1]
+        if best is None:
+            break
+        u, v = best
+        path = _tree_path(trees[u], v)
+        edges.update((min(a, b), max(a, b)) for a, b in zip(path, path[1:]))
+        connected.add(v)
+
+    adjacency: DefaultDict[int, Set[int]] = defaultdict(set)
+    for a, b in edges:
+        adjacency[a].add(b)
+        adjacency[b].add(a)
+
+    # Prune non-terminal leaves introduced by overlapping paths
+    terminal_set = set(terminal_nodes)
+    leaves = [n for n, nbrs in adjacency.items() if len(nbrs) == 1 and n not in terminal_set]
+    while leaves:
+        leaf = leaves.pop()
+        for nbr in adjacency.pop(leaf, set()):
+            adjacency[nbr].discard(leaf)
+            if len(adjacency[nbr]) == 1 and nbr not in terminal_set:
+                leaves.append(nbr)
+
+    # Re-span the union (unit weights: any spanning tree is minimal) in BFS order
+    steps: List[Tuple[int, int]] = []
+    seen = {root}
+    queue = deque([root])
+    while queue:
+        node = queue.popleft()
+        for nxt in sorted(adjacency.get(node, ())):
+            if nxt not in seen:
+                seen.add(nxt)
+                steps.append((node, nxt))
+                queue.append(nxt)
+    return steps, [t for t in terminals if node_ids.get(t) not in connected]
+
+
+def _path_edges(graph: Dict[str, Any], path: List[int]) -> List[Dict[str, Any]]:
+    """Edge metadata for each consecutive node id pair in a path."""
+    offsets, targets, edge_ids, edges = graph["offsets"], graph["targets"], graph["edge_ids"], graph["edges"]
+    infos = []
+    for prev, nxt in zip(path, path[1:]):
+        for pos in range(offsets[prev], offsets[prev + 1]):
+            if targets[pos] == nxt:
+                infos.append(edges[edge_ids[pos]])
+                break
+    return infos
 
 
 # --- Database connection helpers ---
 
+# PRAGMAs applied once to every pooled read connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+_POOLED_CONNECTION_PRAGMAS = (
+    f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}",
+    f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA query_only = ON",
+)
+
+# Per-thread pool: {db_path: (connection, inode)} stored on a threading.local
+_DB_POOL = threading.local()
+# Bumped on every tenant eviction so threads drop their connections to evicted tenants
+_DB_POOL_EPOCH = 0
+
+
+# Statement execution and row fetching on tool connections are charged to the current
+# tool call's SQLite time (see Metrics); sqlite3 only allows this through subclasses
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql: str, parameters: Any = ()) -> "_TimedCursor":
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_timing("sqlite", time.perf_counter() - started)
+
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record_timing("sqlite", time.perf_counter() - started)
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _record_timing("sqlite", time.perf_counter() - started)
+
+    def fetchall(self) -> List[Any]:
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_timing("sqlite", time.perf_counter() - started)
+
+    def __next__(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            _record_timing("sqlite", time.perf_counter() - started)
+
+
+class _TimedConnection(sqlite3.Connection):
+    def execute(self, sql: str, parameters: Any = ()) -> _TimedCursor:
+        return self.cursor(_TimedCursor).execute(sql, parameters)
+
+
 def _get_db_connection(mcp_name: Optional[str] = None) -> Optional[sqlite3.Connection]:
     """Get a connection to the SQLite database for the given MCP name."""
     db_path = _get_db_path(mcp_name)
     if not db_path.exists():
         return None
     
-    db = sqlite3.connect(str(db_path))
+    db = sqlite3.connect(str(db_path), factory=_TimedConnection)
     db.row_factory = sqlite3.Row
     
     # Load sqlite-vec extension if available
@@ -313,54 +1211,1030 @@ def _get_db_connection(mcp_name: Optional[str] = None) -> Optional[sqlite3.Conne
     return db
 
 
-def _initialize_globals(mcp_name: Optional[str] = None):
-    """Initialize data structures for a specific MCP name (lazy loading)."""
+def _get_pooled_connection(mcp_name: Optional[str] = None) -> Optional[sqlite3.Connection]:
+    """
+    Get this worker thread's read-only connection for the given MCP name.
+    Opened once per thread (sqlite-vec loaded, PRAGMAs applied) and reused across tool
+    calls; reopened only if index.db was replaced on disk. Callers must not close it.
+    """
+    db_path = _get_db_path(mcp_name)
+    try:
+        inode = db_path.stat().st_ino
+    except OSError:
+        return None
+
+    connections = getattr(_DB_POOL, "connections", None)
+    if connections is None:
+        connections = _DB_POOL.connections = {}
+    if getattr(_DB_POOL, "epoch", 0) != _DB_POOL_EPOCH:
+        # A tenant was evicted since this thread last looked: close connections to non-resident tenants
+        _DB_POOL.epoch = _DB_POOL_EPOCH
+        for path in [path for path in connections if path.parent.parent.name not in _MCP_CACHE]:
+            connections.pop(path)[0].close()
+
+    entry = connections.get(db_path)
+    if entry is not None:
+        if entry[1] == inode:
+            return entry[0]
+        entry[0].close()
+
+    db = _get_db_connection(mcp_name)
+    if db is None:
+        return None
+    for pragma in _POOLED_CONNECTION_PRAGMAS:
+        db.execute(pragma)
+    connections[db_path] = (db, inode)
+    return db
+
+
+def _get_index_version(mcp_name: Optional[str] = None) -> Optional[str]:
+    """
+    Get the current index version: the index_metadata 'index_version' key written by
+    setup_db.py, falling back to the index.db mtime/size for indexes built without it.
+    """
+    db_path = _get_db_path(mcp_name)
+    if not db_path.exists():
+        return None
+    db = _get_db_connection(mcp_name)
+    if db:
+        try:
+            row = db.execute(
+                "SELECT value FROM index_metadata WHERE key = 'index_version'"
+            ).fetchone()
+            if row and row["value"]:
+                return f"v{row['value']}"
+        except sqlite3.Error:
+            pass
+        finally:
+            db.close()
+    stat = db_path.stat()
+    return f"mtime:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _build_cache_state(segments: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build every derived in-memory structure for a list of table segments."""
+    graph = _build_graph(segments)
+    return {
+        "DB_SEGMENTS": segments,
+        "INDEX": _safe_load_index(segments),
+        "SEGMENT_BY_ID": {seg["id"]: seg for seg in segments},
+        "GRAPH": graph,
+        "JOIN_APSP": _build_all_pairs(graph),
+        "NAME_INDEX": _build_name_index(segments),
+    }
+
+
+def _load_snapshot(mcp_name: Optional[str], index_version: str) -> Optional[Dict[str, Any]]:
+    """Load the cache snapshot if it matches the snapshot format and index version."""
+    path = _get_snapshot_path(mcp_name)
+    try:
+        with path.open("rb") as f:
+            snapshot = pickle.load(f)
+    except Exception:
+        return None
+    if (
+        not isinstance(snapshot, dict)
+        or snapshot.get("format") != SNAPSHOT_FORMAT
+        or snapshot.get("index_version") != index_version
+    ):
+        return None
+    return snapshot.get("state")
+
+
+def _write_snapshot(mcp_name: Optional[str], index_version: str, state: Dict[str, Any]) -> bool:
+    """Atomically write a cache snapshot for the given index version (best-effort)."""
+    path = _get_snapshot_path(mcp_name)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    snapshot = {"format": SNAPSHOT_FORMAT, "index_version": index_version, "state": state}
+    try:
+        with tmp_path.open("wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return True
+    except OSError:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        return False
+
+
+def _rebuild_snapshot(mcp_name: Optional[str] = None) -> Optional[str]:
+    """
+    Build the cache from index.db and write its snapshot (called by setup_db.py).
+    Returns the index version the snapshot was written for, or None if not written.
+    """
+    index_version = _get_index_version(mcp_name)
+    if index_version is None:
+        return None
+    state = _build_cache_state(_safe_load_map(mcp_name))
+    return index_version if _write_snapshot(mcp_name, index_version, state) else None
+
+
+def _load_cache_state(mcp_name: Optional[str]) -> Dict[str, Any]:
+    """
+    Load the cache state for the current index version: the precompiled snapshot when it
+    matches, otherwise built from index.db (and the stale snapshot rewritten).
+    """
+    index_version = _get_index_version(mcp_name)
+    state = _load_snapshot(mcp_name, index_version) if index_version else None
+    if state is None:
+        state = _build_cache_state(_safe_load_map(mcp_name))
+        if index_version:
+            _write_snapshot(mcp_name, index_version, state)
+    # Join path memo starts empty for every index version (never snapshotted)
+    return dict(state, INDEX_VERSION=index_version, JOIN_PATHS=OrderedDict())
+
+
+def _initialize_globals(mcp_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Initialize data structures for a specific MCP name (lazy loading) and return them.
+    Concurrent first calls for one name load it once; loading a new name past
+    MCP_MAX_TENANTS evicts the least recently used tenant.
+    """
     if mcp_name is None:
         mcp_name = _get_mcp_name()
     
-    # Access _MCP_CACHE directly to avoid recursion with _get_mcp_cache()
-    # The cache entry should already exist from _get_mcp_cache() which calls us
-    if mcp_name not in _MCP_CACHE:
-        _MCP_CACHE[mcp_name] = {
-            "DB_SEGMENTS": [],
-            "INDEX": {},
-            "SEGMENT_BY_ID": {},
-            "GRAPH": {},
-            "initialized": False,
-        }
-    
-    cache = _MCP_CACHE[mcp_name]
-    if cache["initialized"]:
-        return  # Already initialized
-    
-    # Mark as initialized FIRST to prevent re-entry during loading
-    cache["initialized"] = True
-    
-    segments = _safe_load_map(mcp_name)
-    index = _safe_load_index(segments)
-    segment_by_id = {seg["id"]: seg for seg in segments}
-    graph = _build_graph(segments)
-    
-    cache["DB_SEGMENTS"] = segments
-    cache["INDEX"] = index
-    cache["SEGMENT_BY_ID"] = segment_by_id
-    cache["GRAPH"] = graph
+    with _MCP_CACHE_LOCK:
+        load_lock = _TENANT_LOAD_LOCKS.setdefault(mcp_name, threading.Lock())
+    with load_lock:
+        # Access _MCP_CACHE directly: another thread may have loaded it meanwhile
+        cache = _MCP_CACHE.get(mcp_name)
+        if cache is not None:
+            return cache
+        cache = _load_cache_state(mcp_name)
+        cache["initialized"] = True
+        with _MCP_CACHE_LOCK:
+            _MCP_CACHE[mcp_name] = cache
+            excess = len(_MCP_CACHE) - MCP_MAX_TENANTS if MCP_MAX_TENANTS > 0 else 0
+            evicted = [name for name in _MCP_CACHE if name != mcp_name][:max(0, excess)]
+            for name in evicted:
+                del _MCP_CACHE[name]
+    for name in evicted:
+        # Under the evicted tenant's load lock, so a concurrent reload of it either finishes
+        # first (then it is resident again and keeps its new watcher/caches) or waits
+        with _MCP_CACHE_LOCK:
+            evicted_lock = _TENANT_LOAD_LOCKS.setdefault(name, threading.Lock())
+        with evicted_lock:
+            if name not in _MCP_CACHE:
+                _release_tenant(name)
+    _start_index_watcher(mcp_name)
+    return cache
+
+
+def _release_tenant(mcp_name: str) -> None:
+    """Drop everything held for an evicted tenant (it is reloaded lazily on its next request)."""
+    global _DB_POOL_EPOCH
+    with _INDEX_WATCHERS_LOCK:
+        stop = _INDEX_WATCHERS.pop(mcp_name, None)
+    if stop is not None:
+        stop.set()
+    with _VECTOR_ENGINE_LOCK:
+        _VECTOR_ENGINES.pop(mcp_name, None)
+    with _RESULT_CACHE_LOCK:
+        for key in [key for key in _RESULT_CACHE if key[0] == mcp_name]:
+            del _RESULT_CACHE[key]
+    with _SCHEMA_CACHE_LOCK:
+        for key in [key for key in _SCHEMA_CACHE if key[0] == mcp_name]:
+            del _SCHEMA_CACHE[key]
+    # Worker threads close their pooled connections to evicted tenants on next use
+    _DB_POOL_EPOCH += 1
+    print(f"[MCP] Evicted tenant '{mcp_name}' (MCP_MAX_TENANTS={MCP_MAX_TENANTS})")
+
+
+# --- Hot reload ---
+
+# mcp_name -> stop event of its watcher thread; one background watcher per loaded MCP instance
+_INDEX_WATCHERS: Dict[str, threading.Event] = {}
+_INDEX_WATCHERS_LOCK = threading.Lock()
+
+
+def _index_file_signature(mcp_name: Optional[str]) -> tuple:
+    """Cheap change detector: (mtime_ns, size) of index.db and its WAL file."""
+    db_path = _get_db_path(mcp_name)
+    signature = []
+    for path in (db_path, db_path.with_name(db_path.name + "-wal")):
+        try:
+            stat = path.stat()
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _reload_if_changed(mcp_name: str) -> bool:
+    """
+    Rebuild the cache off the request path if the index version changed, then swap it in.
+    Tool calls already holding the old cache dict keep using it until they finish.
+    """
+    current = _MCP_CACHE.get(mcp_name)
+    if current is None or not current["initialized"]:
+        return False
+    index_version = _get_index_version(mcp_name)
+    if index_version is None or index_version == current.get("INDEX_VERSION"):
+        return False
+    new_cache = _load_cache_state(mcp_name)
+    new_cache["initialized"] = True
+    with _MCP_CACHE_LOCK:
+        if mcp_name not in _MCP_CACHE:
+            return False  # Evicted while rebuilding
+        _MCP_CACHE[mcp_name] = new_cache  # single reference assignment: atomic swap
+    print(f"[{mcp_name}] Reloaded index {current.get('INDEX_VERSION')} -> {new_cache['INDEX_VERSION']}")
+    return True
+
+
+def _watch_index(mcp_name: str, interval: float, stop: threading.Event) -> None:
+    signature = _index_file_signature(mcp_name)
+    while not stop.wait(interval):
+        new_signature = _index_file_signature(mcp_name)
+        if new_signature == signature:
+            continue
+        signature = new_signature
+        try:
+            _reload_if_changed(mcp_name)
+        except Exception as e:
+            print(f"[{mcp_name}] Index reload failed, keeping current cache: {e}")
+
+
+def _start_index_watcher(mcp_name: str) -> None:
+    """Start the background index watcher for an MCP instance (once)."""
+    if INDEX_RELOAD_INTERVAL <= 0:
+        return
+    with _INDEX_WATCHERS_LOCK:
+        if mcp_name in _INDEX_WATCHERS:
+            return
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=_watch_index,
+            args=(mcp_name, INDEX_RELOAD_INTERVAL, stop),
+            name=f"index-watcher-{mcp_name}",
+            daemon=True,
+        )
+        _INDEX_WATCHERS[mcp_name] = stop
+        thread.start()
+
+
+# --- Query embedding cache ---
+
+# Shared by every MCP instance/replica mounting the same data directory
+EMBEDDING_CACHE_PATH = Path(os.getenv("EMBEDDING_CACHE_PATH", str(BASE_DIR / "data" / "embedding_cache.db")))
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "1024"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+
+_EMBEDDING_LRU: "OrderedDict[str, List[float]]" = OrderedDict()
+_EMBEDDING_CACHE_LOCK = threading.Lock()
+_EMBEDDING_CACHE_STATS = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+_embedding_cache_db: Optional[sqlite3.Connection] = None
+# Disk writes are batched: last_used_at of disk hits is buffered (key -> time) and written
+# every EMBEDDING_CACHE_WRITE_BATCH hits or with the next insert, and the size bound is
+# checked every _EMBEDDING_PRUNE_INTERVAL inserts (within the eviction headroom) rather than
+# with COUNT(*) on each one. A lost touch only makes an entry look older to eviction.
+EMBEDDING_CACHE_WRITE_BATCH = 64
+_EMBEDDING_PRUNE_INTERVAL = min(EMBEDDING_CACHE_WRITE_BATCH, max(1, EMBEDDING_CACHE_MAX_ENTRIES // 10))
+_EMBEDDING_TOUCHES: Dict[str, float] = {}
+_EMBEDDING_INSERTS = {"since_prune": 0}
+
+
+def _embedding_cache_key(query: str, model: str, dimensions: int) -> str:
+    normalized = " ".join(query.lower().split())
+    return hashlib.sha256(f"{model}\0{dimensions}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+def _get_embedding_cache_db() -> Optional[sqlite3.Connection]:
+    """Open (once) the persistent embedding cache store; call with _EMBEDDING_CACHE_LOCK held."""
+    global _embedding_cache_db
+    if _embedding_cache_db is None:
+        try:
+            EMBEDDING_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(EMBEDDING_CACHE_PATH), check_same_thread=False, timeout=5.0)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    dimensions INTEGER NOT NULL,
+                    query TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings(last_used_at)")
+            db.commit()
+            _embedding_cache_db = db
+        except (sqlite3.Error, OSError):
+            _EMBEDDING_CACHE_STATS["errors"] += 1
+            return None
+    return _embedding_cache_db
+
+
+def _remember_embedding(key: str, embedding: List[float]) -> None:
+    """Insert into the in-process LRU, evicting the least recently used entry when full."""
+    _EMBEDDING_LRU[key] = embedding
+    _EMBEDDING_LRU.move_to_end(key)
+    while len(_EMBEDDING_LRU) > EMBEDDING_CACHE_MEMORY_SIZE:
+        _EMBEDDING_LRU.popitem(last=False)
+
+
+def _flush_embedding_touches(db: sqlite3.Connection) -> None:
+    """Write buffered last_used_at updates (uncommitted); call with _EMBEDDING_CACHE_LOCK held."""
+    if _EMBEDDING_TOUCHES:
+        db.executemany(
+            "UPDATE query_embeddings SET last_used_at = ? WHERE key = ?",
+            [(used_at, key) for key, used_at in _EMBEDDING_TOUCHES.items()],
+        )
+        _EMBEDDING_TOUCHES.clear()
+
+
+def _cached_embedding(key: str) -> Optional[List[float]]:
+    """Look up a query embedding in the LRU, then the persistent store."""
+    with _EMBEDDING_CACHE_LOCK:
+        embedding = _EMBEDDING_LRU.get(key)
+        if embedding is not None:
+            _EMBEDDING_LRU.move_to_end(key)
+            _EMBEDDING_CACHE_STATS["memory_hits"] += 1
+            return embedding
+        db = _get_embedding_cache_db()
+        if db is not None:
+            try:
+                row = db.execute("SELECT embedding FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    _EMBEDDING_TOUCHES[key] = time.time()
+                    if len(_EMBEDDING_TOUCHES) >= EMBEDDING_CACHE_WRITE_BATCH:
+                        _flush_embedding_touches(db)
+                        db.commit()
+                    embedding = array("f", row[0]).tolist()
+                    _remember_embedding(key, embedding)
+                    _EMBEDDING_CACHE_STATS["disk_hits"] += 1
+                    return embedding
+            except sqlite3.Error:
+                _EMBEDDING_CACHE_STATS["errors"] += 1
+        _EMBEDDING_CACHE_STATS["misses"] += 1
+        return None
 
 
-def _generate_query_embedding(query: str) -> Optional[List[float]]:
-    """Generate embedding for a search query using OpenAI."""
+def _store_embedding(key: str, query: str, model: str, dimensions: int, embedding: List[float]) -> None:
+    """Persist a query embedding (float32 blob), periodically evicting the oldest entries past the size bound."""
+    with _EMBEDDING_CACHE_LOCK:
+        _remember_embedding(key, embedding)
+        db = _get_embedding_cache_db()
+        if db is None:
+            return
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, model, dimensions, query, embedding, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, dimensions, query, array("f", embedding).tobytes(), time.time()),
+            )
+            _flush_embedding_touches(db)
+            _EMBEDDING_INSERTS["since_prune"] += 1
+            count = 0
+            if _EMBEDDING_INSERTS["since_prune"] >= _EMBEDDING_PRUNE_INTERVAL:
+                _EMBEDDING_INSERTS["since_prune"] = 0
+                count = db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+            if count > EMBEDDING_CACHE_MAX_ENTRIES:
+                # Evict in batches (10% headroom) so we don't delete on every insert
+                excess = count - EMBEDDING_CACHE_MAX_ENTRIES + max(1, EMBEDDING_CACHE_MAX_ENTRIES // 10)
+                evicted = db.execute(
+                    "DELETE FROM query_embeddings WHERE key IN "
+                    "(SELECT key FROM query_embeddings ORDER BY last_used_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+                _EMBEDDING_CACHE_STATS["evictions"] += evicted
+            db.commit()
+        except sqlite3.Error:
+            _EMBEDDING_CACHE_STATS["errors"] += 1
+
+
+def _embedding_cache_stats() -> Dict[str, Any]:
+    with _EMBEDDING_CACHE_LOCK:
+        stats = dict(_EMBEDDING_CACHE_STATS)
+        stats["memory_entries"] = len(_EMBEDDING_LRU)
+        db = _get_embedding_cache_db()
+        try:
+            stats["disk_entries"] = db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0] if db else 0
+        except sqlite3.Error:
+            stats["disk_entries"] = None
+    lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else None
+    return stats
+
+
+# --- Embedding providers ---
+# setup_db.py embeds documents and search_vector embeds queries through the same
+# provider, chosen at index time and recorded in index_metadata.
+
+def _openai_embed(texts: List[str], model: str, dimensions: int) -> List[List[float]]:
     if not _openai_client:
+        raise RuntimeError("OpenAI client not available. Set OPENAI_API_KEY environment variable.")
+    response = _openai_client.embeddings.create(model=model, input=texts, dimensions=dimensions)
+    return [item.embedding for item in response.data]
+
+
+async def _openai_aembed(texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+    if not _async_openai_client:
+        raise RuntimeError("OpenAI client not available. Set OPENAI_API_KEY environment variable.")
+    response = await asyncio.wait_for(
+        _async_openai_client.embeddings.create(model=model, input=texts, dimensions=dimensions),
+        OPENAI_TIMEOUT,
+    )
+    return [item.embedding for item in response.data]
+
+
+def _local_features(text: str) -> Dict[str, float]:
+    """Sublinear-TF weighted word unigrams/bigrams and in-word character trigrams."""
+    counts: DefaultDict[str, int] = defaultdict(int)
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    for word in words:
+        counts["w:" + word] += 1
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            counts["c:" + padded[i:i + 3]] += 1
+    for first, second in zip(words, words[1:]):
+        counts[f"b:{first} {second}"] += 1
+    weights = {"w": 1.0, "b": 0.5, "c": 0.35}
+    return {feature: weights[feature[0]] * (1.0 + math.log(count)) for feature, count in counts.items()}
+
+
+def _local_embed(texts: List[str], model: str, dimensions: int) -> List[List[float]]:
+    """
+    Offline embedding: n-gram features hashed (crc32, signed) into `dimensions` buckets,
+    i.e. a random sign projection of the sparse feature vector, then L2-normalized so
+    sqlite-vec's L2 distance ranks like cosine similarity. Deterministic across processes.
+    """
+    vectors = []
+    for text in texts:
+        vector = [0.0] * dimensions
+        for feature, weight in _local_features(text).items():
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % dimensions] += weight if h & 0x80000000 else -weight
+        norm = math.sqrt(sum(v * v for v in vector))
+        vectors.append([v / norm for v in vector] if norm else vector)
+    return vectors
+
+
+EMBEDDING_PROVIDERS: Dict[str, Dict[str, Any]] = {
+    "openai": {
+        "model": EMBEDDING_MODEL,
+        "dimensions": EMBEDDING_DIMENSIONS,
+        "embed": _openai_embed,
+        # Async variant used for query embeddings on the event loop
+        "aembed": _openai_aembed,
+        "available": lambda: _openai_client is not None,
+        "unavailable_error": "OpenAI client not available. Set OPENAI_API_KEY environment variable.",
+        "cache": True,
+    },
+    "local": {
+        "model": LOCAL_EMBEDDING_MODEL,
+        "dimensions": LOCAL_EMBEDDING_DIMENSIONS,
+        "embed": _local_embed,
+        "aembed": None,
+        "available": lambda: True,
+        "unavailable_error": "",
+        # Cheaper to recompute than to look up
+        "cache": False,
+    },
+}
+
+
+def _get_embedding_provider(name: str) -> Dict[str, Any]:
+    provider = EMBEDDING_PROVIDERS.get(name)
+    if provider is None:
+        raise ValueError(f"Unknown embedding provider '{name}'. Available: {', '.join(sorted(EMBEDDING_PROVIDERS))}")
+    return provider
+
+
+def _default_embedding_config(provider: str = "") -> Dict[str, Any]:
+    """Provider/model/dimensions that setup_db.py uses for a new vector index."""
+    name = provider or EMBEDDING_PROVIDER
+    spec = _get_embedding_provider(name)
+    return {"provider": name, "model": spec["model"], "dimensions": spec["dimensions"]}
+
+
+def _index_embedding_config(db: sqlite3.Connection) -> Dict[str, Any]:
+    """Embedding provider/model/dimensions recorded in index_metadata (indexes without them used OpenAI)."""
+    try:
+        metadata = {
+            row[0]: row[1]
+            for row in db.execute(
+                "SELECT key, value FROM index_metadata "
+                "WHERE key IN ('embedding_provider', 'embedding_model', 'embedding_dimensions', "
+                "'embedding_filter_columns')"
+            )
+        }
+    except sqlite3.Error:
+        metadata = {}
+    config = _default_embedding_config(metadata.get("embedding_provider", "openai"))
+    if metadata.get("embedding_model"):
+        config["model"] = metadata["embedding_model"]
+    if metadata.get("embedding_dimensions"):
+        config["dimensions"] = int(metadata["embedding_dimensions"])
+    config["filter_columns"] = [
+        column for column in metadata.get("embedding_filter_columns", "").split(",") if column in VEC_FILTER_COLUMNS
+    ]
+    return config
+
+
+def _embed_texts(texts: List[str], config: Dict[str, Any]) -> List[List[float]]:
+    """Embed a batch of texts with the provider/model/dimensions in config; raises on provider errors."""
+    spec = _get_embedding_provider(config["provider"])
+    return spec["embed"](texts, config["model"], config["dimensions"])
+
+
+def _embed_query(query: str, config: Dict[str, Any]) -> Optional[List[float]]:
+    """Embed one query with the provider in config, recording embedding metrics (None on error)."""
+    started = time.perf_counter()
+    try:
+        embedding = _embed_texts([query], config)[0]
+    except Exception:
+        _record_embedding(config["provider"], time.perf_counter() - started, ok=False)
+        return None
+    _record_embedding(config["provider"], time.perf_counter() - started, ok=True)
+    return embedding
+
+
+def _generate_query_embedding(query: str, config: Optional[Dict[str, Any]] = None) -> Optional[List[float]]:
+    """
+    Generate embedding for a search query. Remote providers are served from the in-process
+    LRU or the persistent embedding cache when the same normalized query was embedded before.
+    """
+    config = config or _default_embedding_config()
+    spec = _get_embedding_provider(config["provider"])
+    if not spec["available"]():
         return None
+    if not spec["cache"]:
+        return _embed_query(query, config)
+
+    key = _embedding_cache_key(query, config["model"], config["dimensions"])
+    embedding = _cached_embedding(key)
+    if embedding is not None:
+        return embedding
     
+    embedding = _embed_query(query, config)
+    if embedding is None:
+        return None
+    _store_embedding(key, query, config["model"], config["dimensions"], embedding)
+    return embedding
+
+
+async def _generate_query_embedding_async(query: str, config: Dict[str, Any]) -> Optional[List[float]]:
+    """
+    _generate_query_embedding for providers with an async client: the request is awaited on
+    the event loop (bounded by OPENAI_TIMEOUT) and cache reads/writes run on the tool pool.
+    """
+    spec = _get_embedding_provider(config["provider"])
+    key = _embedding_cache_key(query, config["model"], config["dimensions"])
+    if spec["cache"]:
+        embedding = await _run_blocking(_cached_embedding, key)
+        if embedding is not None:
+            return embedding
+    started = time.perf_counter()
     try:
-        response = _openai_client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=query,
-            dimensions=EMBEDDING_DIMENSIONS,
-        )
-        return response.data[0].embedding
+        embedding = (await spec["aembed"]([query], config["model"], config["dimensions"]))[0]
     except Exception:
+        _record_embedding(config["provider"], time.perf_counter() - started, ok=False)
         return None
+    _record_embedding(config["provider"], time.perf_counter() - started, ok=True)
+    if spec["cache"]:
+        # Persisting is off the response path
+        _TOOL_EXECUTOR.submit(_store_embedding, key, query, config["model"], config["dimensions"], embedding)
+    return embedding
+
+
+# --- Tool execution ---
+# Tools are coroutines on FastMCP's event loop; their blocking SQLite and file work runs on
+# a bounded thread pool (which also bounds pooled SQLite connections, one per thread), so a
+# slow call in one session does not stall the others.
+
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+_TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="mcp-tool")
+
+
+async def _run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run fn on the tool thread pool with the caller's contextvars (e.g. the HTTP request)."""
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_TOOL_EXECUTOR, functools.partial(context.run, _profiled_call, fn, *args, **kwargs))
+
+
+def _threaded_tool(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Expose a blocking tool function as a coroutine that runs on the tool thread pool."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return await _run_blocking(fn, *args, **kwargs)
+
+    return wrapper
+
+
+# --- Tool result cache ---
+
+# Read tools are pure functions of (arguments, index version): their serialized results
+# are cached per (mcp, tool, normalized args, index version) and carry an ETag in _meta
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+_RESULT_CACHE: "OrderedDict[Tuple[str, str, str, Optional[str]], ToolResult]" = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+_RESULT_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _versioned_result(fn: Callable[..., Any]) -> Callable[..., ToolResult]:
+    """
+    Cache a read tool's result per index version. The cached ToolResult holds the
+    already-serialized content, so hits skip both recomputation and re-serialization.
+    _meta carries {"etag", "index_version"}; the ETag is a hash of the content, so
+    clients can skip refetching when it is unchanged.
+    """
+    signature = inspect.signature(fn)
+    # FastMCP wraps non-object results as {"result": ...} in structured content
+    wrap_result = get_origin(signature.return_annotation) not in (dict, Dict)
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> ToolResult:
+        mcp_name = _get_mcp_name()
+        index_version = _get_mcp_cache(mcp_name)["INDEX_VERSION"]
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (mcp_name, fn.__name__, json.dumps(bound.arguments, sort_keys=True, default=str), index_version)
+        with _RESULT_CACHE_LOCK:
+            result = _RESULT_CACHE.get(key)
+            if result is not None:
+                _RESULT_CACHE.move_to_end(key)
+                _RESULT_CACHE_STATS["hits"] += 1
+                return result
+            _RESULT_CACHE_STATS["misses"] += 1
+
+        value = fn(*args, **kwargs)
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+        result = ToolResult(
+            content=[TextContent(type="text", text=text)],
+            structured_content={"result": value} if wrap_result else value,
+            meta={
+                "etag": hashlib.sha256(text.encode("utf-8")).hexdigest()[:20],
+                "index_version": index_version,
+            },
+        )
+        with _RESULT_CACHE_LOCK:
+            _RESULT_CACHE[key] = result
+            while len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+                _RESULT_CACHE.popitem(last=False)
+                _RESULT_CACHE_STATS["evictions"] += 1
+        return result
+
+    return wrapper
+
+
+def _result_cache_stats() -> Dict[str, Any]:
+    with _RESULT_CACHE_LOCK:
+        stats = dict(_RESULT_CACHE_STATS, entries=len(_RESULT_CACHE))
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+    return stats
+
+
+# --- Metrics ---
+# Every tools/call is timed by a FastMCP middleware. Its wall time is split into SQLite
+# time (tool connections), embedding API time and the remainder (Python), and exposed with
+# call/error counts, latency and result-size histograms and cache statistics in Prometheus
+# text format at /metrics. /health reports per-MCP readiness as JSON.
+
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+_METRICS_LOCK = threading.Lock()
+# (tool, mcp_name) -> call counts by status, histograms and time split
+_TOOL_METRICS: Dict[Tuple[str, str], Dict[str, Any]] = {}
+# provider -> embedding request counts and seconds
+_EMBEDDING_METRICS: Dict[str, Dict[str, float]] = {}
+_STARTED_AT = time.time()
+# (kind, seconds) spans of the current tool call; a shared list, so pool threads working on
+# one call (they inherit the caller's contextvars) append to the same record
+_CALL_TIMINGS: "contextvars.ContextVar[Optional[List[Tuple[str, float]]]]" = contextvars.ContextVar(
+    "mcp_call_timings", default=None
+)
+
+
+def _record_timing(kind: str, seconds: float) -> None:
+    timings = _CALL_TIMINGS.get()
+    if timings is not None:
+        timings.append((kind, seconds))
+
+
+def _record_embedding(provider: str, seconds: float, ok: bool) -> None:
+    _record_timing("embedding", seconds)
+    with _METRICS_LOCK:
+        stats = _EMBEDDING_METRICS.setdefault(provider, {"requests": 0, "errors": 0, "seconds": 0.0})
+        stats["requests"] += 1
+        stats["seconds"] += seconds
+        if not ok:
+            stats["errors"] += 1
+
+
+def _new_histogram(buckets: Tuple[float, ...]) -> Dict[str, Any]:
+    # One count per bucket plus the +Inf overflow
+    return {"counts": [0] * (len(buckets) + 1), "sum": 0.0}
+
+
+def _observe(histogram: Dict[str, Any], buckets: Tuple[float, ...], value: float) -> None:
+    histogram["counts"][bisect_left(buckets, value)] += 1
+    histogram["sum"] += value
+
+
+def _record_tool_call(
+    tool: str, mcp_name: str, status: str, seconds: float, timings: List[Tuple[str, float]], result_bytes: int
+) -> None:
+    sqlite_seconds = sum(span for kind, span in timings if kind == "sqlite")
+    embedding_seconds = sum(span for kind, span in timings if kind == "embedding")
+    with _METRICS_LOCK:
+        stats = _TOOL_METRICS.get((tool, mcp_name))
+        if stats is None:
+            stats = _TOOL_METRICS[(tool, mcp_name)] = {
+                "calls": {},
+                "latency": _new_histogram(METRICS_LATENCY_BUCKETS),
+                "result_bytes": _new_histogram(METRICS_SIZE_BUCKETS),
+                "sqlite_seconds": 0.0,
+                "embedding_seconds": 0.0,
+                "python_seconds": 0.0,
+            }
+        stats["calls"][status] = stats["calls"].get(status, 0) + 1
+        _observe(stats["latency"], METRICS_LATENCY_BUCKETS, seconds)
+        _observe(stats["result_bytes"], METRICS_SIZE_BUCKETS, result_bytes)
+        stats["sqlite_seconds"] += sqlite_seconds
+        stats["embedding_seconds"] += embedding_seconds
+        # Concurrent spans (search_hybrid) can exceed the wall time
+        stats["python_seconds"] += max(0.0, seconds - sqlite_seconds - embedding_seconds)
+
+
+async def _metrics_middleware(context: Any, call_next: Callable[..., Any]) -> Any:
+    """FastMCP middleware: time every tools/call and record its metrics."""
+    if context.method != "tools/call":
+        return await call_next(context)
+    tool = context.message.name
+    mcp_name = _get_mcp_name()
+    timings: List[Tuple[str, float]] = []
+    token = _CALL_TIMINGS.set(timings)
+    status = "exception"
+    result_bytes = 0
+    started = time.perf_counter()
+    try:
+        result = await call_next(context)
+        result_bytes = sum(
+            len(block.text.encode("utf-8")) for block in result.content if isinstance(block, TextContent)
+        )
+        # Tools report handled failures as {"error": ...} results
+        structured = result.structured_content
+        status = "error" if isinstance(structured, dict) and structured.get("error") else "ok"
+        return result
+    finally:
+        _CALL_TIMINGS.reset(token)
+        _record_tool_call(tool, mcp_name, status, time.perf_counter() - started, timings, result_bytes)
+
+
+mcp.add_middleware(_metrics_middleware)
+
+
+# --- Profiling ---
+# Opt-in cProfile sampling of tool calls. A sampled call profiles every job it runs on the
+# tool thread pool (one profiler per job, since cProfile is per thread), merges them and
+# writes <id>.prof (pstats) plus <id>.json (tool, arguments, timing) to PROFILE_DIR, keeping
+# the newest PROFILE_MAX_FILES profiles. Enabled by PROFILE_SAMPLE_RATE or set_profiling().
+# The admin tools (set_profiling, list_profiles, get_profile) are only registered when
+# PROFILE_ADMIN is set, and only show profiles of the caller's MCP name.
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(BASE_DIR / "data" / "profiles")))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_ADMIN = os.getenv("PROFILE_ADMIN", "").strip().lower() in ("1", "true", "yes")
+_PROFILING = {
+    # Fraction of tool calls profiled (0 disables profiling)
+    "sample_rate": float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    # Tool names eligible for sampling (empty = all)
+    "tools": {name.strip() for name in os.getenv("PROFILE_TOOLS", "").split(",") if name.strip()},
+}
+_PROFILE_ID_PATTERN = re.compile(r"^[0-9]+-[0-9a-f]{6}$")
+_PROFILE_LOCK = threading.Lock()
+_CALL_PROFILES: "contextvars.ContextVar[Optional[List[cProfile.Profile]]]" = contextvars.ContextVar(
+    "mcp_call_profiles", default=None
+)
+
+
+def _profiled_call(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run fn, under its own profiler when the current tool call is being profiled."""
+    profiles = _CALL_PROFILES.get()
+    if profiles is None:
+        return fn(*args, **kwargs)
+    profiler = cProfile.Profile()
+    profiles.append(profiler)
+    profiler.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+
+
+def _write_profile(profiles: List[cProfile.Profile], meta: Dict[str, Any]) -> None:
+    """Merge a call's profilers into PROFILE_DIR and trim the ring buffer to PROFILE_MAX_FILES."""
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stats = pstats.Stats(profiles[0])
+        for profiler in profiles[1:]:
+            stats.add(profiler)
+        stats.dump_stats(str(PROFILE_DIR / f"{meta['id']}.prof"))
+        (PROFILE_DIR / f"{meta['id']}.json").write_text(json.dumps(meta, default=str), encoding="utf-8")
+        with _PROFILE_LOCK:
+            for stale in _profile_ids()[max(0, PROFILE_MAX_FILES):]:
+                for suffix in (".prof", ".json"):
+                    (PROFILE_DIR / f"{stale}{suffix}").unlink(missing_ok=True)
+    except Exception as e:
+        print(f"[MCP] Failed to write profile {meta['id']}: {e}")
+
+
+def _profile_ids() -> List[str]:
+    """Stored profile ids, newest first (ids start with a millisecond timestamp)."""
+    if not PROFILE_DIR.is_dir():
+        return []
+    ids = [path.stem for path in PROFILE_DIR.glob("*.prof") if _PROFILE_ID_PATTERN.match(path.stem)]
+    return sorted(ids, key=lambda profile_id: int(profile_id.split("-")[0]), reverse=True)
+
+
+async def _profiling_middleware(context: Any, call_next: Callable[..., Any]) -> Any:
+    """FastMCP middleware: profile a PROFILE_SAMPLE_RATE fraction of tools/call requests."""
+    if (
+        context.method != "tools/call"
+        or _PROFILING["sample_rate"] <= 0
+        or (_PROFILING["tools"] and context.message.name not in _PROFILING["tools"])
+        or random.random() >= _PROFILING["sample_rate"]
+    ):
+        return await call_next(context)
+    profiles: List[cProfile.Profile] = []
+    token = _CALL_PROFILES.set(profiles)
+    started_at = time.time()
+    started = time.perf_counter()
+    try:
+        return await call_next(context)
+    finally:
+        _CALL_PROFILES.reset(token)
+        if profiles:
+            meta = {
+                "id": f"{int(started_at * 1000)}-{random.getrandbits(24):06x}",
+                "tool": context.message.name,
+                "mcp": _get_mcp_name(),
+                "arguments": context.message.arguments,
+                "started_at": started_at,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+            # Written off the response path
+            _TOOL_EXECUTOR.submit(_write_profile, profiles, meta)
+
+
+mcp.add_middleware(_profiling_middleware)
+
+
+def _admin_tool(fn: Callable[..., Any]) -> Any:
+    """Register fn as an MCP tool only when PROFILE_ADMIN is enabled."""
+    return mcp.tool(fn) if PROFILE_ADMIN else fn
+
+
+def _read_profile_meta(profile_id: str) -> Dict[str, Any]:
+    try:
+        return json.loads((PROFILE_DIR / f"{profile_id}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"id": profile_id}
+
+
+def _prometheus_line(name: str, labels: Dict[str, Any], value: float) -> str:
+    if labels:
+        rendered = ",".join(
+            '{}="{}"'.format(key, str(val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for key, val in labels.items()
+        )
+        return f"{name}{{{rendered}}} {value}"
+    return f"{name} {value}"
+
+
+def _prometheus_histogram(
+    lines: List[str], name: str, labels: Dict[str, Any], buckets: Tuple[float, ...], histogram: Dict[str, Any]
+) -> None:
+    cumulative = 0
+    for bound, count in zip(list(buckets) + ["+Inf"], histogram["counts"]):
+        cumulative += count
+        lines.append(_prometheus_line(f"{name}_bucket", dict(labels, le=bound), cumulative))
+    lines.append(_prometheus_line(f"{name}_sum", labels, round(histogram["sum"], 6)))
+    lines.append(_prometheus_line(f"{name}_count", labels, cumulative))
+
+
+def _render_metrics() -> str:
+    """All metrics in Prometheus text exposition format (version 0.0.4)."""
+    with _METRICS_LOCK:
+        tools = {key: dict(stats, calls=dict(stats["calls"])) for key, stats in _TOOL_METRICS.items()}
+        embeddings = {provider: dict(stats) for provider, stats in _EMBEDDING_METRICS.items()}
+    lines: List[str] = []
+
+    def header(name: str, kind: str, help_text: str) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    header("mcp_tool_calls_total", "counter", "Tool calls by tool, MCP name and status (ok, error, exception).")
+    for (tool, mcp_name), stats in sorted(tools.items()):
+        for status, count in sorted(stats["calls"].items()):
+            lines.append(_prometheus_line("mcp_tool_calls_total", {"tool": tool, "mcp": mcp_name, "status": status}, count))
+    header("mcp_tool_duration_seconds", "histogram", "Tool call wall time.")
+    for (tool, mcp_name), stats in sorted(tools.items()):
+        _prometheus_histogram(
+            lines, "mcp_tool_duration_seconds", {"tool": tool, "mcp": mcp_name}, METRICS_LATENCY_BUCKETS, stats["latency"]
+        )
+    header("mcp_tool_result_bytes", "histogram", "Serialized tool result size.")
+    for (tool, mcp_name), stats in sorted(tools.items()):
+        _prometheus_histogram(
+            lines, "mcp_tool_result_bytes", {"tool": tool, "mcp": mcp_name}, METRICS_SIZE_BUCKETS, stats["result_bytes"]
+        )
+    for part, help_text in (
+        ("sqlite", "Time tool calls spent executing SQLite statements and fetching rows."),
+        ("embedding", "Time tool calls spent waiting for query embeddings."),
+        ("python", "Remaining tool call time (Python work, scheduling)."),
+    ):
+        name = f"mcp_tool_{part}_seconds_total"
+        header(name, "counter", help_text)
+        for (tool, mcp_name), stats in sorted(tools.items()):
+            lines.append(_prometheus_line(name, {"tool": tool, "mcp": mcp_name}, round(stats[f"{part}_seconds"], 6)))
+
+    header("mcp_embedding_requests_total", "counter", "Query embedding requests by provider.")
+    for provider, stats in sorted(embeddings.items()):
+        lines.append(_prometheus_line("mcp_embedding_requests_total", {"provider": provider}, stats["requests"]))
+    header("mcp_embedding_errors_total", "counter", "Failed query embedding requests by provider.")
+    for provider, stats in sorted(embeddings.items()):
+        lines.append(_prometheus_line("mcp_embedding_errors_total", {"provider": provider}, stats["errors"]))
+    header("mcp_embedding_seconds_total", "counter", "Time spent in query embedding requests by provider.")
+    for provider, stats in sorted(embeddings.items()):
+        lines.append(_prometheus_line("mcp_embedding_seconds_total", {"provider": provider}, round(stats["seconds"], 6)))
+
+    embedding_cache = _embedding_cache_stats()
+    with _SCHEMA_CACHE_LOCK:
+        schema_cache = dict(_SCHEMA_CACHE_STATS, entries=len(_SCHEMA_CACHE))
+    result_cache = _result_cache_stats()
+    caches = {
+        "result": (result_cache["hits"], result_cache["misses"], result_cache["entries"]),
+        "schema": (schema_cache["hits"], schema_cache["misses"], schema_cache["entries"]),
+        "embedding": (
+            embedding_cache["memory_hits"] + embedding_cache["disk_hits"],
+            embedding_cache["misses"],
+            embedding_cache["memory_entries"],
+        ),
+    }
+    for index, (name, help_text) in enumerate((
+        ("mcp_cache_hits_total", "Cache hits by cache."),
+        ("mcp_cache_misses_total", "Cache misses by cache."),
+        ("mcp_cache_entries", "In-memory cache entries by cache."),
+    )):
+        header(name, "gauge" if name == "mcp_cache_entries" else "counter", help_text)
+        for cache, values in caches.items():
+            lines.append(_prometheus_line(name, {"cache": cache}, values[index]))
+    header("mcp_cache_hit_ratio", "gauge", "Cache hits / lookups by cache.")
+    for cache, (hits, misses, _) in caches.items():
+        if hits + misses:
+            lines.append(_prometheus_line("mcp_cache_hit_ratio", {"cache": cache}, round(hits / (hits + misses), 4)))
+
+    loaded = list(_MCP_CACHE.items())
+    header("mcp_index_info", "gauge", "Loaded index version per MCP name (value is always 1).")
+    for mcp_name, cache in loaded:
+        lines.append(_prometheus_line("mcp_index_info", {"mcp": mcp_name, "index_version": cache.get("INDEX_VERSION") or ""}, 1))
+    header("mcp_tenants_loaded", "gauge", "MCP names whose caches are loaded.")
+    lines.append(_prometheus_line("mcp_tenants_loaded", {}, len(loaded)))
+    header("mcp_uptime_seconds", "gauge", "Seconds since the server process started.")
+    lines.append(_prometheus_line("mcp_uptime_seconds", {}, round(time.time() - _STARTED_AT, 3)))
+    return "\n".join(lines) + "\n"
+
+
+def _tenant_health(mcp_name: str) -> Dict[str, Any]:
+    """Readiness of one MCP name: index.db present; index_version once its caches are loaded."""
+    cache = _MCP_CACHE.get(mcp_name)
+    return {
+        "ready": _get_db_path(mcp_name).exists(),
+        "loaded": cache is not None,
+        "index_version": cache.get("INDEX_VERSION") if cache is not None else None,
+    }
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> Response:
+    # Cache statistics read the persistent embedding cache: keep it off the event loop
+    text = await _run_blocking(_render_metrics)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@mcp.custom_route("/health", methods=["GET"])
+@mcp.custom_route("/health/{mcp_name}", methods=["GET"])
+async def health_endpoint(request: Request) -> Response:
+    """Readiness of every MCP name (or just /health/<name>); 503 unless all are ready."""
+    mcp_name = request.path_params.get("mcp_name")
+    if mcp_name is not None and not _is_tenant(mcp_name):
+        return JSONResponse({"status": "not_found", "ready": False, "error": f"unknown MCP '{mcp_name}'"}, status_code=404)
+    tenants = {name: _tenant_health(name) for name in ([mcp_name] if mcp_name else _list_tenants())}
+    ready = bool(tenants) and all(tenant["ready"] for tenant in tenants.values())
+    body = {
+        "status": "ok" if ready else "unavailable",
+        "ready": ready,
+        "default_mcp": MCP_NAME,
+        "uptime_seconds": round(time.time() - _STARTED_AT, 3),
+        "tenants": tenants,
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
 
 
 # --- Basic tools ---
@@ -393,9 +2267,120 @@ def echo(message: str) -> str:
 
 
 @mcp.tool
+@_threaded_tool
+def get_embedding_cache_stats() -> Dict[str, Any]:
+    """
+    Report query-embedding cache statistics for vector search.
+
+    Returns:
+        Dict with memory_hits, disk_hits, misses, evictions, errors, memory_entries,
+        disk_entries, and hit_ratio.
+    """
+    return _embedding_cache_stats()
+
+
+@mcp.tool
+@_threaded_tool
+def get_index_version() -> Dict[str, Any]:
+    """
+    Report the loaded index version so clients can tell whether cached tool results
+    (identified by the etag/index_version in each result's _meta) are still current.
+
+    Returns:
+        Dict with mcp_name, index_version, and result_cache statistics.
+    """
+    mcp_name = _get_mcp_name()
+    return {
+        "mcp_name": mcp_name,
+        "index_version": _get_mcp_cache(mcp_name)["INDEX_VERSION"],
+        "result_cache": _result_cache_stats(),
+    }
+
+
+@_admin_tool
+def set_profiling(sample_rate: float, tools: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Admin: enable, tune or disable cProfile sampling of tool calls at runtime
+    (overrides PROFILE_SAMPLE_RATE / PROFILE_TOOLS until restart).
+
+    Args:
+        sample_rate: Fraction of tool calls to profile (0 disables, 1 profiles every call).
+        tools: Optional tool names to sample (e.g., ['search_tables', 'get_join_path']); empty = all.
+    Returns:
+        Dict with the active sample_rate, tools, profile_dir and max_profiles.
+    """
+    if not 0.0 <= sample_rate <= 1.0:
+        return {"error": "sample_rate must be between 0 and 1"}
+    _PROFILING["sample_rate"] = sample_rate
+    _PROFILING["tools"] = set(tools or [])
+    return {
+        "sample_rate": _PROFILING["sample_rate"],
+        "tools": sorted(_PROFILING["tools"]),
+        "profile_dir": str(PROFILE_DIR),
+        "max_profiles": PROFILE_MAX_FILES,
+    }
+
+
+@_admin_tool
+@_threaded_tool
+def list_profiles(limit: int = 20) -> Dict[str, Any]:
+    """
+    Admin: list stored tool-call profiles of this MCP name, newest first.
+
+    Args:
+        limit: Max profiles to list (1-200).
+    Returns:
+        Dict with profiles [{id, tool, mcp, arguments, started_at, duration_ms}], total, and sampling settings.
+    """
+    limit = max(1, min(limit, 200))
+    mcp_name = _get_mcp_name()
+    # Arguments are user queries, so other datasets' profiles are never shown
+    profiles = [meta for meta in map(_read_profile_meta, _profile_ids()) if meta.get("mcp") == mcp_name]
+    return {
+        "profiles": profiles[:limit],
+        "total": len(profiles),
+        "sample_rate": _PROFILING["sample_rate"],
+        "tools": sorted(_PROFILING["tools"]),
+    }
+
+
+@_admin_tool
+@_threaded_tool
+def get_profile(profile_id: str, format: str = "text", sort: str = "cumulative", top: int = 40) -> Dict[str, Any]:
+    """
+    Admin: download a stored tool-call profile.
+
+    Args:
+        profile_id: Profile id from list_profiles.
+        format: 'text' (pstats report) or 'pstats' (base64 of the .prof file, for snakeviz/pstats).
+        sort: pstats sort key for the text report ('cumulative', 'tottime', 'calls', ...).
+        top: Functions listed in the text report (1-500).
+    Returns:
+        Dict with id, metadata, and report (text) or data (base64 pstats).
+    """
+    if not _PROFILE_ID_PATTERN.match(profile_id):
+        return {"error": f"invalid profile id '{profile_id}'"}
+    path = PROFILE_DIR / f"{profile_id}.prof"
+    meta = _read_profile_meta(profile_id)
+    if not path.exists() or meta.get("mcp") != _get_mcp_name():
+        return {"error": f"profile '{profile_id}' not found"}
+    if format == "pstats":
+        return {"id": profile_id, "metadata": meta, "data": base64.b64encode(path.read_bytes()).decode("ascii")}
+    if format != "text":
+        return {"error": "format must be 'text' or 'pstats'"}
+    report = io.StringIO()
+    try:
+        pstats.Stats(str(path), stream=report).strip_dirs().sort_stats(sort).print_stats(max(1, min(top, 500)))
+    except KeyError:
+        return {"error": f"unknown sort key '{sort}'"}
+    return {"id": profile_id, "metadata": meta, "report": report.getvalue()}
+
+
+@mcp.tool
+@_threaded_tool
 def search_db_map(query: str, top_k: int = 3) -> List[Dict[str, Any]]:
     """
-    Match a natural language query to the most relevant DB map segments.
+    Match a natural language query to the most relevant DB map segments (BM25 ranked).
     Returns top_k segments with id, title, score, and snippet.
 
     Args:
@@ -408,70 +2393,39 @@ def search_db_map(query: str, top_k: int = 3) -> List[Dict[str, Any]]:
     cache = _get_mcp_cache(mcp_name)
     index = cache["INDEX"]
     segments = cache["DB_SEGMENTS"]
-    
-    q_tokens = set(_normalize(query))
-    candidate_ids: Set[str] = set()
-
-    # Retrieve candidate segment ids via inverted index for efficiency.
-    for token in q_tokens:
-        candidate_ids |= index.get(token, set())
+    top_k = max(1, top_k)
 
-    # Fallback: if no candidates, consider all segments.
-    if not candidate_ids:
-        candidate_ids = {seg["id"] for seg in segments}
+    top, _ = _bm25_search(index, segments, query, top_k)
 
-    scored = []
-    for seg in segments:
-        if seg["id"] not in candidate_ids:
-            continue
-        text_parts = [
-            seg.get("id", ""),
-            seg.get("title", ""),
-            seg.get("summary", ""),
-            " ".join(col.get("name", "") for col in seg.get("columns", [])),
-        ]
-        seg_tokens = set(_normalize(" ".join(text_parts)))
-        score = len(q_tokens & seg_tokens)
-        scored.append(
-            {
-                "id": seg["id"],
-                "title": seg["title"],
-                "score": score,
-                "snippet": seg["summary"],
-            }
-        )
+    # Fallback: if nothing matched, return the first segments unscored.
+    if not top:
+        top = [(pos, 0.0) for pos in range(min(top_k, len(segments)))]
 
-    scored.sort(key=lambda x: x["score"], reverse=True)
-    return scored[: max(1, top_k)]
+    return [
+        {
+            "id": segments[pos]["id"],
+            "title": segments[pos]["title"],
+            "score": round(score, 3),
+            "snippet": segments[pos]["summary"],
+        }
+        for pos, score in top
+    ]
 
 
 # --- Search Tools ---
 
-@mcp.tool
-def search_fts(
+def _search_fts(
+    mcp_name: str,
     query: str,
     database: str = "",
     domain: str = "",
     doc_type: str = "",
-    limit: int = 10
+    limit: int = 10,
 ) -> Dict[str, Any]:
-    """
-    Full-text search using FTS5 with BM25 ranking.
-    Searches document content, summary, and keywords.
-
-    Args:
-        query: Search text (supports FTS5 query syntax like AND, OR, NOT, quotes).
-        database: Optional database filter.
-        domain: Optional domain filter.
-        doc_type: Optional document type filter (table, column, relationship, domain).
-        limit: Max results (1-50).
-    Returns:
-        Dict with results list, each containing id, table_name, doc_type, summary, rank, and tokens_used.
-    """
+    """Run an FTS5 BM25 search for the given MCP name (backs search_fts and search_hybrid)."""
     limit = max(1, min(limit, 50))
-    mcp_name = _get_mcp_name()
     
-    db = _get_db_connection(mcp_name)
+    db = _get_pooled_connection(mcp_name)
     if not db:
         return {
             "error": "Database not found. Run setup_db.py first.",
@@ -546,8 +2500,6 @@ def search_fts(
             }
             results.append(result)
         
-        db.close()
-        
         return {
             "results": results,
             "total_matches": len(results),
@@ -556,7 +2508,6 @@ def search_fts(
         }
         
     except sqlite3.OperationalError as e:
-        db.close()
         error_msg = str(e)
         if "no such table" in error_msg:
             return {
@@ -578,58 +2529,330 @@ def search_fts(
             }
 
 
-@mcp.tool
-def search_vector(
+def _fit_search_budget(response: Dict[str, Any], detail: str, max_tokens: int) -> Dict[str, Any]:
+    """Apply the search elision ladder to a search response (errors pass through)."""
+    if response.get("error"):
+        return response
+    return _fit_budget(
+        response,
+        response.get("results", []),
+        SEARCH_ELISION_STEPS,
+        SEARCH_DETAIL_STEPS[detail],
+        max_tokens,
+        ([response], "results"),
+    )
+
+
+@mcp.tool
+@_threaded_tool
+def search_fts(
+    query: str,
+    database: str = "",
+    domain: str = "",
+    doc_type: str = "",
+    limit: int = 10,
+    max_tokens: int = 0,
+    detail: str = "full",
+) -> Dict[str, Any]:
+    """
+    Full-text search using FTS5 with BM25 ranking.
+    Searches document content, summary, and keywords.
+
+    Args:
+        query: Search text (supports FTS5 query syntax like AND, OR, NOT, quotes).
+        database: Optional database filter.
+        domain: Optional domain filter.
+        doc_type: Optional document type filter (table, column, relationship, domain).
+        limit: Max results (1-50).
+        max_tokens: Optional token budget; previews and summaries are dropped or abbreviated
+            (and finally the lowest-ranked results truncated) until the response fits. 0 = no budget.
+        detail: 'full', 'compact' (no content_preview, short summaries) or 'minimal' (no text fields).
+    Returns:
+        Dict with results list, each containing id, table_name, doc_type, summary, rank, and tokens_used;
+        elided lists anything removed to honor detail/max_tokens.
+    """
+    if detail not in DETAIL_LEVELS:
+        return {"error": f"detail must be one of {', '.join(DETAIL_LEVELS)}", "results": [], "tokens_used": 0}
+    response = _search_fts(_get_mcp_name(), query, database, domain, doc_type, limit)
+    return _fit_search_budget(response, detail, max_tokens)
+
+
+# --- NumPy vector engine ---
+# Optional alternative to vec0 KNN: setup_db.py exports every embedding to
+# index/vectors/ (float32 plus float16 and int8 copies); the server memory-maps the
+# quantized matrix, scores all (filtered) rows with one batched matrix-vector product
+# and rescores the best candidates exactly against the float32 rows. With an IVF
+# (k-means inverted file) index in the export, only the nearest clusters are scored.
+
+# "sqlite-vec" (vec0 KNN), "numpy" (exact scan of the exported matrix) or "ivf"
+# (approximate: only the IVF_NPROBE nearest clusters are scanned); the exported
+# engines fall back to vec0 while the export is missing. These are process-wide
+# defaults: an index selects its own engine/nprobe with the index_metadata keys
+# 'vector_engine' and 'ivf_nprobe' (setup_db.py --vector-engine / --ivf-nprobe)
+VECTOR_ENGINE = os.getenv("VECTOR_ENGINE", "sqlite-vec").strip().lower()
+# IVF clusters built by setup_db.py (0 = sqrt(vector count)) and probed per query
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# Matrix scanned by the NumPy engine: "int8" (1 byte/dim) or "float16" (2 bytes/dim)
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "int8").strip().lower()
+# Candidates rescored exactly per requested result
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+VECTOR_EXPORT_FORMAT = 1
+VECTOR_SCAN_CHUNK = 16384
+
+_VECTOR_ENGINES: Dict[str, Dict[str, Any]] = {}
+_VECTOR_ENGINE_LOCK = threading.Lock()
+
+
+def _index_vector_config(db: sqlite3.Connection) -> Dict[str, Any]:
+    """Vector engine and IVF nprobe of one index (index_metadata), defaulting to VECTOR_ENGINE / IVF_NPROBE."""
+    try:
+        metadata = {
+            row[0]: row[1]
+            for row in db.execute(
+                "SELECT key, value FROM index_metadata WHERE key IN ('vector_engine', 'ivf_nprobe')"
+            )
+        }
+    except sqlite3.Error:
+        metadata = {}
+    try:
+        nprobe = int(metadata.get("ivf_nprobe") or IVF_NPROBE)
+    except ValueError:
+        nprobe = IVF_NPROBE
+    return {"engine": (metadata.get("vector_engine") or VECTOR_ENGINE).strip().lower(), "nprobe": nprobe}
+
+
+def _load_vector_engine(mcp_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Memory-map the exported vectors for an MCP instance, reloading when setup_db.py
+    replaces the export. Returns None when NumPy or the export is unavailable.
+    """
+    if not HAS_NUMPY:
+        return None
+    vector_dir = _get_vector_dir(mcp_name)
+    meta_path = vector_dir / "meta.json"
+    try:
+        stat = meta_path.stat()
+    except OSError:
+        return None
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    engine = _VECTOR_ENGINES.get(mcp_name)
+    if engine is not None and engine["signature"] == signature:
+        return engine
+
+    with _VECTOR_ENGINE_LOCK:
+        engine = _VECTOR_ENGINES.get(mcp_name)
+        if engine is not None and engine["signature"] == signature:
+            return engine
+        quantization = VECTOR_QUANTIZATION if VECTOR_QUANTIZATION in ("int8", "float16") else "int8"
+        try:
+            meta = json.loads(meta_path.read_text())
+            if meta.get("format") != VECTOR_EXPORT_FORMAT:
+                return None
+            engine = {
+                "signature": signature,
+                "meta": meta,
+                "quantization": quantization,
+                "ids": np.load(vector_dir / "ids.npy"),
+                "norms": np.load(vector_dir / "norms.npy"),
+                "filters": np.load(vector_dir / "filters.npy"),
+                "scales": np.load(vector_dir / "int8_scales.npy") if quantization == "int8" else None,
+                "vectors": np.load(vector_dir / f"{quantization}.npy", mmap_mode="r"),
+                "exact": np.load(vector_dir / "float32.npy", mmap_mode="r"),
+                "filter_codes": {
+                    column: {value: code for code, value in enumerate(values)}
+                    for column, values in meta["filter_values"].items()
+                },
+            }
+            if meta.get("ivf"):
+                centroids = np.load(vector_dir / "ivf_centroids.npy")
+                engine["ivf"] = {
+                    "centroids": centroids,
+                    "centroid_norms": (centroids * centroids).sum(axis=1),
+                    "order": np.load(vector_dir / "ivf_order.npy"),
+                    "offsets": np.load(vector_dir / "ivf_offsets.npy"),
+                }
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[MCP] Vector export unreadable for {mcp_name}: {e}")
+            return None
+        rows = len(engine["ids"])
+        if engine["vectors"].shape[0] != rows or engine["exact"].shape[0] != rows or rows != meta.get("count"):
+            # Export replaced mid-load; the next query retries
+            return None
+        _VECTOR_ENGINES[mcp_name] = engine
+        print(f"[MCP] Vector engine loaded for {mcp_name}: {rows} x {meta['dimensions']} ({quantization})")
+    return engine
+
+
+def _filter_mask(engine: Dict[str, Any], filters: Dict[str, str]) -> Optional["np.ndarray"]:
+    """Boolean row mask for the vec filter columns (None when unfiltered)."""
+    if not filters:
+        return None
+    mask = np.ones(len(engine["ids"]), dtype=bool)
+    for column, value in filters.items():
+        code = engine["filter_codes"].get(column, {}).get(value)
+        if code is None:
+            return np.zeros(len(engine["ids"]), dtype=bool)
+        mask &= engine["filters"][:, VEC_FILTER_COLUMNS.index(column)] == code
+    return mask
+
+
+def _ivf_candidates(
+    engine: Dict[str, Any],
+    q: "np.ndarray",
+    mask: Optional["np.ndarray"],
+    limit: int,
+    nprobe: int,
+) -> "np.ndarray":
+    """
+    Rows in the nprobe clusters whose centroids are nearest to q. nprobe doubles while
+    fewer than limit rows survive the filter mask, so selective filters still fill up.
+    """
+    ivf = engine["ivf"]
+    nlist = len(ivf["centroids"])
+    # ||c - q||^2 up to the constant ||q||^2
+    centroid_scores = ivf["centroid_norms"] - 2.0 * (ivf["centroids"] @ q)
+    ranked = np.argsort(centroid_scores)
+    nprobe = max(1, min(nprobe, nlist))
+    while True:
+        rows = np.concatenate([
+            ivf["order"][ivf["offsets"][cluster]:ivf["offsets"][cluster + 1]] for cluster in ranked[:nprobe]
+        ])
+        if mask is not None:
+            rows = rows[mask[rows]]
+        if len(rows) >= limit or nprobe >= nlist:
+            return np.sort(rows)
+        nprobe = min(nlist, nprobe * 2)
+
+
+def _numpy_knn(
+    engine: Dict[str, Any],
+    query_embedding: List[float],
+    filters: Dict[str, str],
+    limit: int,
+    nprobe: int = 0,
+) -> List[Tuple[int, float]]:
+    """
+    Exact-rescored KNN over the exported matrix; returns [(document_id, L2 distance)] ascending.
+    With nprobe > 0 and an IVF index only the nprobe nearest clusters are scanned.
+    """
+    q = np.asarray(query_embedding, dtype=np.float32)
+    mask = _filter_mask(engine, filters)
+    if nprobe > 0 and "ivf" in engine:
+        rows = _ivf_candidates(engine, q, mask, limit, nprobe)
+    elif mask is not None:
+        rows = np.flatnonzero(mask)
+    else:
+        rows = None
+    total = len(rows) if rows is not None else len(engine["ids"])
+    if not total:
+        return []
+
+    # Approximate ||x - q||^2 - ||q||^2 = ||x||^2 - 2 x.q against the quantized matrix, in chunks
+    # so only VECTOR_SCAN_CHUNK rows are ever upcast to float32 at once
+    vectors, scales, norms = engine["vectors"], engine["scales"], engine["norms"]
+    scores = np.empty(total, dtype=np.float32)
+    for start in range(0, total, VECTOR_SCAN_CHUNK):
+        selection = rows[start:start + VECTOR_SCAN_CHUNK] if rows is not None else slice(start, start + VECTOR_SCAN_CHUNK)
+        dots = vectors[selection].astype(np.float32) @ q
+        if scales is not None:
+            dots *= scales[selection]
+        scores[start:start + len(dots)] = norms[selection] - 2.0 * dots
+
+    candidates = min(total, limit * max(1, VECTOR_RESCORE_FACTOR))
+    top = np.argpartition(scores, candidates - 1)[:candidates] if candidates < total else np.arange(total)
+    positions = np.sort(rows[top] if rows is not None else top)
+
+    exact = np.asarray(engine["exact"][positions], dtype=np.float32)
+    distances = np.sqrt(((exact - q) ** 2).sum(axis=1))
+    order = np.argsort(distances, kind="stable")[:limit]
+    return [(int(engine["ids"][positions[i]]), float(distances[i])) for i in order]
+
+
+# sqlite-vec rejects KNN queries with k above 4096
+VEC_MAX_K = 4096
+VEC_REQUERY_GROWTH = 4
+
+VEC_KNN_SQL = """
+    WITH vec_matches AS (
+        SELECT document_id, distance
+        FROM documents_vec
+        WHERE embedding MATCH ? AND k = ?{knn_filters}
+    )
+    SELECT 
+        d.id,
+        d.doc_type,
+        d.database_name,
+        d.table_name,
+        d.column_name,
+        d.domain,
+        d.summary,
+        d.content,
+        d.file_path,
+        vm.distance
+    FROM vec_matches vm
+    JOIN documents d ON d.id = vm.document_id
+    {doc_filters}
+    ORDER BY vm.distance
+    LIMIT ?
+"""
+
+
+def _search_vector(
+    mcp_name: str,
     query: str,
     database: str = "",
     domain: str = "",
     doc_type: str = "",
-    limit: int = 10
+    limit: int = 10,
+    query_embedding: Optional[List[float]] = None,
 ) -> Dict[str, Any]:
     """
-    Semantic vector search using OpenAI embeddings and sqlite-vec.
-    Finds documents with similar meaning to the query.
-
-    Args:
-        query: Natural language search query.
-        database: Optional database filter.
-        domain: Optional domain filter.
-        doc_type: Optional document type filter (table, column, relationship, domain).
-        limit: Max results (1-50).
-    Returns:
-        Dict with results list, each containing id, table_name, doc_type, summary, distance, and tokens_used.
+    Run a vector KNN search for the given MCP name (backs search_vector and search_hybrid).
+    The query is embedded here unless query_embedding was already computed by the caller.
     """
     limit = max(1, min(limit, 50))
-    mcp_name = _get_mcp_name()
-    
-    # Check prerequisites
-    if not HAS_SQLITE_VEC:
+    db = _get_pooled_connection(mcp_name)
+    if not db:
         return {
-            "error": "sqlite-vec not installed. Install with: pip install sqlite-vec",
+            "error": "Database not found. Run setup_db.py first.",
             "results": [],
             "tokens_used": 0,
         }
+    vector_config = _index_vector_config(db)
+    engine = _load_vector_engine(mcp_name) if vector_config["engine"] in ("numpy", "ivf") else None
     
-    if not _openai_client:
+    # Check prerequisites
+    if engine is None and not HAS_SQLITE_VEC:
         return {
-            "error": "OpenAI client not available. Set OPENAI_API_KEY environment variable.",
+            "error": "sqlite-vec not installed. Install with: pip install sqlite-vec",
             "results": [],
             "tokens_used": 0,
         }
     
-    db = _get_db_connection(mcp_name)
-    if not db:
+    # Queries must be embedded by the same provider/model the index was built with
+    embedding_config = _index_embedding_config(db)
+    provider = _get_embedding_provider(embedding_config["provider"])
+    if not provider["available"]():
         return {
-            "error": "Database not found. Run setup_db.py first.",
+            "error": provider["unavailable_error"],
             "results": [],
             "tokens_used": 0,
         }
+    if engine is not None and (
+        (engine["meta"]["embedding_model"], engine["meta"]["dimensions"])
+        != (embedding_config["model"], embedding_config["dimensions"])
+        or f"v{engine['meta'].get('index_version')}" != _get_mcp_cache(mcp_name)["INDEX_VERSION"]
+    ):
+        # Export predates a reindex or an embedding model change (new documents missing,
+        # rowids possibly recycled); vec0 is authoritative until setup_db.py re-exports
+        engine = None
     
     try:
         # Generate embedding for query
-        query_embedding = _generate_query_embedding(query)
+        if query_embedding is None:
+            query_embedding = _generate_query_embedding(query, embedding_config)
         if not query_embedding:
-            db.close()
             return {
                 "error": "Failed to generate query embedding.",
                 "results": [],
@@ -639,75 +2862,42 @@ def search_vector(
         # Convert embedding to JSON for sqlite-vec
         embedding_json = json.dumps(query_embedding)
         
-        # Build WHERE clause for filters on the joined documents table
-        filters = []
-        params: List[Any] = []
-        
-        if database:
-            filters.append("d.database_name = ?")
-            params.append(database)
-        if domain:
-            filters.append("d.domain = ?")
-            params.append(domain)
-        if doc_type:
-            filters.append("d.doc_type = ?")
-            params.append(doc_type)
+        # Filters map to documents columns (and vec0 metadata columns on current indexes)
+        filters = {"database_name": database, "domain": domain, "doc_type": doc_type}
+        filters = {column: value for column, value in filters.items() if value}
         
-        # For vec0, we need k = ? in WHERE clause for KNN queries
-        # First get vector matches, then filter
-        if filters:
-            filter_clause = "WHERE " + " AND ".join(filters)
-            
-            sql = f"""
-                WITH vec_matches AS (
-                    SELECT 
-                        document_id,
-                        distance
-                    FROM documents_vec
-                    WHERE embedding MATCH ? AND k = ?
+        if engine is not None:
+            nprobe = vector_config["nprobe"] if vector_config["engine"] == "ivf" else 0
+            matches = _numpy_knn(engine, query_embedding, filters, limit, nprobe)
+            docs = {
+                row["id"]: row
+                for row in db.execute(
+                    "SELECT id, doc_type, database_name, table_name, column_name, domain, summary, content, "
+                    f"file_path FROM documents WHERE id IN ({', '.join('?' for _ in matches)})",
+                    [doc_id for doc_id, _ in matches],
                 )
-                SELECT 
-                    d.id,
-                    d.doc_type,
-                    d.database_name,
-                    d.table_name,
-                    d.column_name,
-                    d.domain,
-                    d.summary,
-                    d.content,
-                    d.file_path,
-                    vm.distance
-                FROM vec_matches vm
-                JOIN documents d ON d.id = vm.document_id
-                {filter_clause}
-                ORDER BY vm.distance
-            """
-            params = [embedding_json, limit * 2] + params  # Fetch more to account for filtering
+            }
+            rows = [dict(docs[doc_id], distance=distance) for doc_id, distance in matches if doc_id in docs]
+        elif set(filters) <= set(embedding_config["filter_columns"]):
+            # Constraints are applied inside the KNN scan, so k = limit is already exact
+            knn_filters = "".join(f" AND {column} = ?" for column in filters)
+            sql = VEC_KNN_SQL.format(knn_filters=knn_filters, doc_filters="")
+            rows = db.execute(sql, [embedding_json, limit, *filters.values(), limit]).fetchall()
         else:
-            sql = """
-                SELECT 
-                    d.id,
-                    d.doc_type,
-                    d.database_name,
-                    d.table_name,
-                    d.column_name,
-                    d.domain,
-                    d.summary,
-                    d.content,
-                    d.file_path,
-                    v.distance
-                FROM documents_vec v
-                JOIN documents d ON d.id = v.document_id
-                WHERE v.embedding MATCH ? AND k = ?
-                ORDER BY v.distance
-            """
-            params = [embedding_json, limit]
-        
-        cursor = db.execute(sql, params)
-        rows = cursor.fetchall()
+            # Index without filter columns: re-query with growing k until enough neighbours
+            # survive the filters (or every vector has been considered)
+            doc_filters = "WHERE " + " AND ".join(f"d.{column} = ?" for column in filters)
+            sql = VEC_KNN_SQL.format(knn_filters="", doc_filters=doc_filters)
+            max_k = min(VEC_MAX_K, db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]) or limit
+            k = min(limit * VEC_REQUERY_GROWTH, max_k)
+            while True:
+                rows = db.execute(sql, [embedding_json, k, *filters.values(), limit]).fetchall()
+                if len(rows) >= limit or k >= max_k:
+                    break
+                k = min(k * VEC_REQUERY_GROWTH, max_k)
         
         results = []
-        for row in rows[:limit]:  # Ensure we respect limit after filtering
+        for row in rows:
             # Convert DB path to actual file path
             file_path = row["file_path"]
             actual_path = str(_db_path_to_file_path(file_path, mcp_name)) if file_path else None
@@ -726,18 +2916,20 @@ def search_vector(
             }
             results.append(result)
         
-        db.close()
-        
         return {
             "results": results,
             "total_matches": len(results),
             "query": query,
-            "embedding_model": EMBEDDING_MODEL,
+            "embedding_provider": embedding_config["provider"],
+            "embedding_model": embedding_config["model"],
+            "vector_engine": (
+                "sqlite-vec" if engine is None
+                else "ivf" if vector_config["engine"] == "ivf" and "ivf" in engine else "numpy"
+            ),
             "tokens_used": _estimate_tokens(query + str(results)),
         }
         
     except sqlite3.OperationalError as e:
-        db.close()
         error_msg = str(e)
         if "no such table" in error_msg:
             return {
@@ -753,10 +2945,217 @@ def search_vector(
             }
 
 
+def _mcp_embedding_config(mcp_name: str) -> Optional[Dict[str, Any]]:
+    db = _get_pooled_connection(mcp_name)
+    return _index_embedding_config(db) if db else None
+
+
+async def _search_vector_async(
+    mcp_name: str, query: str, database: str, domain: str, doc_type: str, limit: int
+) -> Dict[str, Any]:
+    """_search_vector with a remote query embedding awaited on the event loop and the KNN scan on the tool pool."""
+    config = await _run_blocking(_mcp_embedding_config, mcp_name)
+    query_embedding = None
+    if config is not None:
+        provider = _get_embedding_provider(config["provider"])
+        if provider["aembed"] is not None and provider["available"]():
+            query_embedding = await _generate_query_embedding_async(query, config)
+            if query_embedding is None:
+                return {"error": "Failed to generate query embedding.", "results": [], "tokens_used": 0}
+    # Local providers embed inside _search_vector (cheap CPU work, already off the loop)
+    return await _run_blocking(_search_vector, mcp_name, query, database, domain, doc_type, limit, query_embedding)
+
+
+@mcp.tool
+async def search_vector(
+    query: str,
+    database: str = "",
+    domain: str = "",
+    doc_type: str = "",
+    limit: int = 10,
+    max_tokens: int = 0,
+    detail: str = "full",
+) -> Dict[str, Any]:
+    """
+    Semantic vector search using sqlite-vec and the embedding provider the index
+    was built with (OpenAI or the offline local n-gram model).
+    Finds documents with similar meaning to the query.
+
+    Args:
+        query: Natural language search query.
+        database: Optional database filter.
+        domain: Optional domain filter.
+        doc_type: Optional document type filter (table, column, relationship, domain).
+        limit: Max results (1-50).
+        max_tokens: Optional token budget; previews and summaries are dropped or abbreviated
+            (and finally the lowest-ranked results truncated) until the response fits. 0 = no budget.
+        detail: 'full', 'compact' (no content_preview, short summaries) or 'minimal' (no text fields).
+    Returns:
+        Dict with results list, each containing id, table_name, doc_type, summary, distance, and tokens_used;
+        elided lists anything removed to honor detail/max_tokens.
+    """
+    if detail not in DETAIL_LEVELS:
+        return {"error": f"detail must be one of {', '.join(DETAIL_LEVELS)}", "results": [], "tokens_used": 0}
+    response = await _search_vector_async(_get_mcp_name(), query, database, domain, doc_type, limit)
+    return await _run_blocking(_fit_search_budget, response, detail, max_tokens)
+
+
+# --- Hybrid search ---
+
+# Per-doc_type (fts_weight, vec_weight, boost); setup_db.py seeds index_weights from these
+DEFAULT_INDEX_WEIGHTS = {
+    "table": (1.0, 1.0, 1.5),
+    "column": (0.8, 0.8, 1.0),
+    "relationship": (1.0, 1.0, 1.2),
+}
+RRF_K = 60
+
+
+def _load_index_weights(mcp_name: str) -> Dict[str, Tuple[float, float, float]]:
+    """Read per-doc_type (fts_weight, vec_weight, boost) from index_weights, with defaults."""
+    weights = dict(DEFAULT_INDEX_WEIGHTS)
+    db = _get_pooled_connection(mcp_name)
+    if not db:
+        return weights
+    try:
+        for row in db.execute("SELECT doc_type, fts_weight, vec_weight, boost FROM index_weights"):
+            weights[row["doc_type"]] = (
+                row["fts_weight"] if row["fts_weight"] is not None else 1.0,
+                row["vec_weight"] if row["vec_weight"] is not None else 1.0,
+                row["boost"] if row["boost"] is not None else 1.0,
+            )
+    except sqlite3.Error:
+        pass
+    return weights
+
+
+def _fts_or_query(query: str) -> str:
+    """Turn free text into an FTS5 OR query of quoted terms (no syntax errors, better recall)."""
+    return " OR ".join(f'"{token}"' for token in dict.fromkeys(_normalize(query)))
+
+
+def _minmax(values: Dict[int, float], invert: bool = False) -> Dict[int, float]:
+    """Min-max normalize scores to [0, 1]; invert for lower-is-better scores."""
+    if not values:
+        return {}
+    low, high = min(values.values()), max(values.values())
+    span = high - low
+    normalized = {}
+    for key, value in values.items():
+        scaled = (value - low) / span if span else 1.0
+        normalized[key] = 1.0 - scaled if invert and span else scaled
+    return normalized
+
+
+@mcp.tool
+async def search_hybrid(
+    query: str,
+    database: str = "",
+    domain: str = "",
+    doc_type: str = "",
+    limit: int = 10,
+    fusion: str = "rrf",
+    max_tokens: int = 0,
+    detail: str = "full",
+) -> Dict[str, Any]:
+    """
+    Hybrid search: runs FTS5 (BM25) and vector search concurrently and fuses them into
+    one ranked list using the per-doc_type weights in index_weights.
+    Falls back to FTS-only results when vector search is unavailable.
+
+    Args:
+        query: Natural language search query (terms are OR-ed for the FTS side).
+        database: Optional database filter.
+        domain: Optional domain filter.
+        doc_type: Optional document type filter (table, column, relationship, domain).
+        limit: Max results (1-50).
+        fusion: 'rrf' (weighted reciprocal-rank fusion) or 'weighted' (weighted normalized scores).
+        max_tokens: Optional token budget (see search_fts). 0 = no budget.
+        detail: 'full', 'compact' or 'minimal' (see search_fts).
+    Returns:
+        Dict with fused results (each with score, fts_rank, vec_rank, bm25_rank, distance),
+        per-retriever errors if any, elided, and tokens_used.
+    """
+    limit = max(1, min(limit, 50))
+    if fusion not in ("rrf", "weighted"):
+        return {"error": "fusion must be 'rrf' or 'weighted'", "results": [], "tokens_used": 0}
+    if detail not in DETAIL_LEVELS:
+        return {"error": f"detail must be one of {', '.join(DETAIL_LEVELS)}", "results": [], "tokens_used": 0}
+    mcp_name = _get_mcp_name()
+    fts_query = _fts_or_query(query)
+    if not fts_query:
+        return {"error": "Query has no searchable terms.", "results": [], "tokens_used": 0}
+
+    # Fetch deeper candidate lists than requested so fusion can reorder them
+    depth = min(50, max(limit * 2, 20))
+    fts, vec = await asyncio.gather(
+        _run_blocking(_search_fts, mcp_name, fts_query, database, domain, doc_type, depth),
+        _search_vector_async(mcp_name, query, database, domain, doc_type, depth),
+    )
+
+    errors = {}
+    if fts.get("error"):
+        errors["fts"] = fts["error"]
+    if vec.get("error"):
+        errors["vector"] = vec["error"]
+    if len(errors) == 2:
+        return {"error": "Both retrievers failed.", "errors": errors, "results": [], "tokens_used": 0}
+
+    weights = await _run_blocking(_load_index_weights, mcp_name)
+    docs: Dict[int, Dict[str, Any]] = {}
+    fts_rank: Dict[int, int] = {}
+    vec_rank: Dict[int, int] = {}
+    for rank, result in enumerate(fts.get("results", []), start=1):
+        docs.setdefault(result["id"], dict(result))
+        fts_rank[result["id"]] = rank
+    for rank, result in enumerate(vec.get("results", []), start=1):
+        docs.setdefault(result["id"], dict(result))["distance"] = result["distance"]
+        vec_rank[result["id"]] = rank
+
+    if fusion == "weighted":
+        fts_norm = _minmax({doc_id: docs[doc_id]["bm25_rank"] for doc_id in fts_rank}, invert=True)
+        vec_norm = _minmax({doc_id: docs[doc_id]["distance"] for doc_id in vec_rank}, invert=True)
+
+    scored = []
+    for doc_id, doc in docs.items():
+        fts_weight, vec_weight, boost = weights.get(doc["doc_type"], (1.0, 1.0, 1.0))
+        if fusion == "rrf":
+            score = 0.0
+            if doc_id in fts_rank:
+                score += fts_weight / (RRF_K + fts_rank[doc_id])
+            if doc_id in vec_rank:
+                score += vec_weight / (RRF_K + vec_rank[doc_id])
+        else:
+            score = fts_weight * fts_norm.get(doc_id, 0.0) + vec_weight * vec_norm.get(doc_id, 0.0)
+        scored.append((boost * score, doc_id))
+
+    results = []
+    for score, doc_id in heapq.nlargest(limit, scored):
+        doc = docs[doc_id]
+        doc["score"] = round(score, 6)
+        doc["fts_rank"] = fts_rank.get(doc_id)
+        doc["vec_rank"] = vec_rank.get(doc_id)
+        doc.setdefault("bm25_rank", None)
+        doc.setdefault("distance", None)
+        results.append(doc)
+
+    response = {
+        "results": results,
+        "total_matches": len(results),
+        "query": query,
+        "fusion": fusion,
+    }
+    if errors:
+        response["errors"] = errors
+    return await _run_blocking(_fit_search_budget, response, detail, max_tokens)
+
+
 # --- PRD2 tools based on planning spec ---
 
 
 @mcp.tool
+@_threaded_tool
+@_versioned_result
 def list_tables(database: str = "", domain: str = "") -> List[Dict[str, Any]]:
     """
     List available tables, optionally filtered by database or domain.
@@ -769,7 +3168,7 @@ def list_tables(database: str = "", domain: str = "") -> List[Dict[str, Any]]:
     """
     mcp_name = _get_mcp_name()
     # Try database first, fall back to in-memory segments
-    db = _get_db_connection(mcp_name)
+    db = _get_pooled_connection(mcp_name)
     if db:
         try:
             filters = ["doc_type = 'table'", "file_path LIKE '%.json'"]
@@ -806,11 +3205,9 @@ def list_tables(database: str = "", domain: str = "") -> List[Dict[str, Any]]:
                     "summary": row["summary"],
                     "file_path": str(_db_path_to_file_path(row["file_path"])),
                 })
-            
-            db.close()
             return results
         except Exception:
-            db.close()
+            pass  # Fall back to in-memory segments
     
     # Fallback to in-memory segments
     cache = _get_mcp_cache(mcp_name)
@@ -835,6 +3232,8 @@ def list_tables(database: str = "", domain: str = "") -> List[Dict[str, Any]]:
 
 
 @mcp.tool
+@_threaded_tool
+@_versioned_result
 def list_columns(table: str, database: str = "") -> Dict[str, Any]:
     """
     List columns for a given table, with their types and descriptions.
@@ -846,35 +3245,23 @@ def list_columns(table: str, database: str = "") -> Dict[str, Any]:
         Dict with table name, columns list [{name, type, nullable, description}], and file_path.
     """
     mcp_name = _get_mcp_name()
+    cache = _get_mcp_cache(mcp_name)
+    # Resolve the name via the in-memory name index (optionally filtered by database)
+    seg = _find_table(table, database, mcp_name, cache)
     # Try to load from actual JSON file first
-    db = _get_db_connection(mcp_name)
-    if db:
+    db = _get_pooled_connection(mcp_name)
+    if db and seg:
         try:
-            # Find the table's JSON file, optionally filtered by database
-            if database:
-                cursor = db.execute("""
-                    SELECT file_path, table_name
-                    FROM documents 
-                    WHERE doc_type = 'table' 
-                    AND (table_name = ? OR table_name LIKE ? OR LOWER(table_name) = LOWER(?))
-                    AND database_name = ?
-                    AND file_path LIKE '%.json'
-                    LIMIT 1
-                """, (table, f"%{table}%", table, database))
-            else:
-                cursor = db.execute("""
-                    SELECT file_path, table_name
-                    FROM documents 
-                    WHERE doc_type = 'table' 
-                    AND (table_name = ? OR table_name LIKE ? OR LOWER(table_name) = LOWER(?))
-                    AND file_path LIKE '%.json'
-                    LIMIT 1
-                """, (table, f"%{table}%", table))
+            cursor = db.execute("""
+                SELECT file_path, table_name, content_hash, content
+                FROM documents 
+                WHERE doc_type = 'table' AND file_path = ?
+                LIMIT 1
+            """, (seg["file_path"],))
             row = cursor.fetchone()
-            db.close()
             
             if row:
-                json_content = _load_map_file(row["file_path"], mcp_name)
+                json_content = _load_table_schema(db, row, mcp_name)
                 if json_content and "columns" in json_content:
                     columns = []
                     for col in json_content["columns"]:
@@ -895,11 +3282,9 @@ def list_columns(table: str, database: str = "") -> Dict[str, Any]:
                         "file_path": str(_db_path_to_file_path(row["file_path"], mcp_name)),
                     }
         except Exception:
-            if db:
-                db.close()
+            pass  # Fall back to in-memory segments
     
     # Fallback to in-memory segments
-    seg = _find_table(table, database)
     if not seg:
         return {"error": f"table '{table}' not found"}
     columns = []
@@ -916,12 +3301,13 @@ def list_columns(table: str, database: str = "") -> Dict[str, Any]:
 
 
 @mcp.tool
+@_threaded_tool
 def search_tables(
     query: str, database: str = "", domain: str = "", limit: int = 5
 ) -> Dict[str, Any]:
     """
     Find tables relevant to a natural language query.
-    Simplified implementation using token overlap on the curated map.
+    Ranked with BM25 over table name, summary and column names (name weighted highest).
 
     Args:
         query: Search text.
@@ -935,122 +3321,71 @@ def search_tables(
     mcp_name = _get_mcp_name()
     cache = _get_mcp_cache(mcp_name)
     segments = cache["DB_SEGMENTS"]
-    q_tokens = set(_normalize(query))
-    scored = []
-    for seg in segments:
-        if database and seg.get("database", "") != database:
-            continue
-        if domain and seg.get("domain", "") != domain:
-            continue
-        seg_tokens = _segment_tokens(seg)
-        overlap = len(q_tokens & seg_tokens)
-        # Light boost for substring matches in id/title/summary.
-        text_blob = " ".join(
-            [seg.get("id", ""), seg.get("title", ""), seg.get("summary", "")]
-        ).lower()
-        if any(tok in text_blob for tok in q_tokens):
-            overlap += 0.5
-        scored.append(
+    top, total_matches = _bm25_search(
+        cache["INDEX"], segments, query, limit, database=database, domain=domain
+    )
+    results = []
+    for pos, score in top:
+        seg = segments[pos]
+        results.append(
             {
                 "name": seg["id"],
                 "database": seg.get("database", "default"),
                 "domain": seg.get("domain", "default"),
                 "summary": seg.get("summary", ""),
                 "key_columns": seg.get("keys", {}).get("primary", []),
-                "relevance_score": round(overlap, 3),
+                "relevance_score": round(score, 3),
             }
         )
-
-    scored.sort(key=lambda x: x["relevance_score"], reverse=True)
-    results = scored[:limit]
     return {
         "tables": results,
         "tokens_used": _estimate_tokens(query),
-        "total_matches": len(scored),
+        "total_matches": total_matches,
     }
 
 
-@mcp.tool
-def get_table_schema(table: str, database: str = "", include_samples: bool = False) -> Dict[str, Any]:
-    """
-    Retrieve full schema details for a specific table from the source JSON file.
+# content rides along so schema cache misses parse it without a second query per table
+_SCHEMA_ROW_COLUMNS = "file_path, content_hash, database_name, schema_name, domain, summary, content"
 
-    Args:
-        table: Table name (e.g., 'payments', 'DABSTEP_PAYMENTS').
-        database: Optional database filter (e.g., 'postgres_production', 'snowflake_production').
-        include_samples: Include sample values from the JSON if available.
-    Returns:
-        Complete schema with name, database, schema, description, row_count, columns,
-        primary_key, foreign_keys, indexes, related_tables, and file_path.
-    """
-    mcp_name = _get_mcp_name()
-    # First, try to get the file path from the database and load the actual JSON
-    db = _get_db_connection(mcp_name)
-    if db:
-        try:
-            # Search for the table by name (case-insensitive)
-            # Optionally filter by database
-            if database:
-                cursor = db.execute("""
-                    SELECT file_path, content, database_name, schema_name, domain, summary
-                    FROM documents 
-                    WHERE doc_type = 'table' 
-                    AND (table_name = ? OR table_name LIKE ? OR LOWER(table_name) = LOWER(?))
-                    AND database_name = ?
-                    AND file_path LIKE '%.json'
-                    LIMIT 1
-                """, (table, f"%{table}%", table, database))
-            else:
-                cursor = db.execute("""
-                    SELECT file_path, content, database_name, schema_name, domain, summary
-                    FROM documents 
-                    WHERE doc_type = 'table' 
-                    AND (table_name = ? OR table_name LIKE ? OR LOWER(table_name) = LOWER(?))
-                    AND file_path LIKE '%.json'
-                    LIMIT 1
-                """, (table, f"%{table}%", table))
-            row = cursor.fetchone()
-            db.close()
-            
-            if row:
-                # Try to load the actual JSON file for full content
-                json_content = _load_map_file(row["file_path"], mcp_name)
-                if json_content:
-                    columns = []
-                    for col in json_content.get("columns", []):
-                        col_entry = {
-                            "name": col.get("name"),
-                            "type": col.get("type"),
-                            "nullable": col.get("nullable", True),
-                            "description": col.get("description", ""),
-                        }
-                        if include_samples:
-                            col_entry["samples"] = col.get("sample_values", [])
-                        columns.append(col_entry)
-                    
-                    return {
-                        "name": json_content.get("table", table),
-                        "database": json_content.get("database", row["database_name"]),
-                        "schema": json_content.get("schema", row["schema_name"]),
-                        "description": json_content.get("description", row["summary"]),
-                        "row_count": json_content.get("row_count"),
-                        "columns": columns,
-                        "primary_key": json_content.get("primary_key", []),
-                        "foreign_keys": json_content.get("foreign_keys", []),
-                        "indexes": json_content.get("indexes", []),
-                        "related_tables": json_content.get("relationships", {}),
-                        "file_path": str(_db_path_to_file_path(row["file_path"], mcp_name)),
-                        "tokens_used": _estimate_tokens(json_content.get("description", "")),
-                    }
-        except Exception:
-            if db:
-                db.close()
+
+def _schema_from_row(
+    db: sqlite3.Connection, row: sqlite3.Row, table: str, include_samples: bool, mcp_name: str
+) -> Optional[Dict[str, Any]]:
+    """get_table_schema result from a table document row and its parsed JSON (None if unavailable)."""
+    # Parsed table JSON (cached per content_hash) for full content
+    json_content = _load_table_schema(db, row, mcp_name)
+    if not json_content:
+        return None
+    columns = []
+    for col in json_content.get("columns", []):
+        col_entry = {
+            "name": col.get("name"),
+            "type": col.get("type"),
+            "nullable": col.get("nullable", True),
+            "description": col.get("description", ""),
+        }
+        if include_samples:
+            col_entry["samples"] = col.get("sample_values", [])
+        columns.append(col_entry)
     
-    # Fallback to in-memory segments
-    seg = _find_table(table, database)
-    if not seg:
-        return {"error": f"table '{table}' not found"}
+    return {
+        "name": json_content.get("table", table),
+        "database": json_content.get("database", row["database_name"]),
+        "schema": json_content.get("schema", row["schema_name"]),
+        "description": json_content.get("description", row["summary"]),
+        "row_count": json_content.get("row_count"),
+        "columns": columns,
+        "primary_key": json_content.get("primary_key", []),
+        "foreign_keys": json_content.get("foreign_keys", []),
+        "indexes": json_content.get("indexes", []),
+        "related_tables": json_content.get("relationships", {}),
+        "file_path": str(_db_path_to_file_path(row["file_path"], mcp_name)),
+        "tokens_used": _estimate_tokens(json_content.get("description", "")),
+    }
+
 
+def _schema_from_segment(seg: Dict[str, Any], include_samples: bool) -> Dict[str, Any]:
+    """get_table_schema result built from the in-memory segment (fallback)."""
     columns = []
     for col in seg.get("columns", []):
         col_entry = {
@@ -1087,7 +3422,163 @@ def get_table_schema(table: str, database: str = "", include_samples: bool = Fal
     }
 
 
+def _project_schema(schema: Dict[str, Any], fields: List[str], column_fields: List[str]) -> Dict[str, Any]:
+    """Keep only the requested top-level fields (name always) and column fields."""
+    if fields:
+        schema = {key: value for key, value in schema.items() if key in fields or key == "name"}
+    if column_fields and "columns" in schema:
+        schema = dict(schema, columns=[
+            {key: col[key] for key in column_fields if key in col} for col in schema["columns"]
+        ])
+    return schema
+
+
+@mcp.tool
+@_threaded_tool
+@_versioned_result
+def get_table_schema(
+    table: str,
+    database: str = "",
+    include_samples: bool = False,
+    max_tokens: int = 0,
+    detail: str = "full",
+) -> Dict[str, Any]:
+    """
+    Retrieve full schema details for a specific table from the source JSON file.
+
+    Args:
+        table: Table name (e.g., 'payments', 'DABSTEP_PAYMENTS').
+        database: Optional database filter (e.g., 'postgres_production', 'snowflake_production').
+        include_samples: Include sample values from the JSON if available.
+        max_tokens: Optional token budget; fields are abbreviated or dropped (and finally
+            trailing columns truncated) until the response fits. 0 = no budget.
+        detail: 'full', 'compact' (short descriptions, no indexes/related_tables) or
+            'minimal' (column names and types, keys).
+    Returns:
+        Complete schema with name, database, schema, description, row_count, columns,
+        primary_key, foreign_keys, indexes, related_tables, and file_path; elided lists
+        anything removed to honor detail/max_tokens.
+    """
+    if detail not in DETAIL_LEVELS:
+        return {"error": f"detail must be one of {', '.join(DETAIL_LEVELS)}"}
+    schema = _get_table_schema(table, database, include_samples)
+    if "error" in schema:
+        return schema
+    return _fit_budget(
+        schema, [schema], SCHEMA_ELISION_STEPS, SCHEMA_DETAIL_STEPS[detail], max_tokens, ([schema], "columns")
+    )
+
+
+def _get_table_schema(table: str, database: str, include_samples: bool) -> Dict[str, Any]:
+    mcp_name = _get_mcp_name()
+    cache = _get_mcp_cache(mcp_name)
+    # Resolve the name via the in-memory name index (optionally filtered by database)
+    seg = _find_table(table, database, mcp_name, cache)
+    # First, try to get the file path from the database and load the actual JSON
+    db = _get_pooled_connection(mcp_name)
+    if db and seg:
+        try:
+            cursor = db.execute(f"""
+                SELECT {_SCHEMA_ROW_COLUMNS}
+                FROM documents 
+                WHERE doc_type = 'table' AND file_path = ?
+                LIMIT 1
+            """, (seg["file_path"],))
+            row = cursor.fetchone()
+            
+            if row:
+                schema = _schema_from_row(db, row, table, include_samples, mcp_name)
+                if schema:
+                    return schema
+        except Exception:
+            pass  # Fall back to in-memory segments
+    
+    # Fallback to in-memory segments
+    if not seg:
+        return {"error": f"table '{table}' not found"}
+    return _schema_from_segment(seg, include_samples)
+
+
+@mcp.tool
+@_threaded_tool
+@_versioned_result
+def get_table_schemas(
+    tables: List[str],
+    database: str = "",
+    include_samples: bool = False,
+    fields: Optional[List[str]] = None,
+    column_fields: Optional[List[str]] = None,
+    max_tokens: int = 0,
+    detail: str = "full",
+) -> Dict[str, Any]:
+    """
+    Retrieve schemas for several tables in one call (one name-resolution pass and one
+    query), instead of calling get_table_schema per table.
+
+    Args:
+        tables: Table names (e.g., ['payments', 'merchants']).
+        database: Optional database filter (e.g., 'postgres_production', 'snowflake_production').
+        include_samples: Include sample values from the JSON if available.
+        fields: Optional top-level fields to return (e.g., ['columns', 'foreign_keys']); name is always kept.
+        column_fields: Optional column fields to return (e.g., ['name', 'type']).
+        max_tokens: Optional token budget for the whole response (see get_table_schema).
+        detail: 'full', 'compact' or 'minimal' (see get_table_schema).
+    Returns:
+        Dict with schemas (get_table_schema results, in request order), errors
+        [{table, error}] for names that could not be resolved, elided, and tokens_used.
+    """
+    if detail not in DETAIL_LEVELS:
+        return {"error": f"detail must be one of {', '.join(DETAIL_LEVELS)}", "schemas": [], "errors": []}
+    mcp_name = _get_mcp_name()
+    cache = _get_mcp_cache(mcp_name)
+
+    resolved: List[Tuple[str, Dict[str, Any]]] = []
+    errors = []
+    seen: Set[str] = set()
+    for table in tables:
+        seg = _find_table(table, database, mcp_name, cache)
+        if not seg:
+            errors.append({"table": table, "error": f"table '{table}' not found"})
+        elif seg["id"] not in seen:
+            seen.add(seg["id"])
+            resolved.append((table, seg))
+
+    rows: Dict[str, sqlite3.Row] = {}
+    db = _get_pooled_connection(mcp_name)
+    if db and resolved:
+        try:
+            file_paths = [seg["file_path"] for _, seg in resolved]
+            cursor = db.execute(
+                f"SELECT {_SCHEMA_ROW_COLUMNS} FROM documents "
+                f"WHERE doc_type = 'table' AND file_path IN ({', '.join('?' for _ in file_paths)})",
+                file_paths,
+            )
+            rows = {row["file_path"]: row for row in cursor.fetchall()}
+        except sqlite3.Error:
+            pass  # Fall back to in-memory segments
+
+    schemas = []
+    for table, seg in resolved:
+        schema = None
+        row = rows.get(seg["file_path"])
+        if row is not None:
+            try:
+                schema = _schema_from_row(db, row, table, include_samples, mcp_name)
+            except Exception:
+                schema = None
+        if schema is None:
+            schema = _schema_from_segment(seg, include_samples)
+        schema.pop("tokens_used", None)
+        schemas.append(_project_schema(schema, fields or [], column_fields or []))
+
+    response = {"schemas": schemas, "errors": errors}
+    return _fit_budget(
+        response, schemas, SCHEMA_ELISION_STEPS, SCHEMA_DETAIL_STEPS[detail], max_tokens, (schemas, "columns")
+    )
+
+
 @mcp.tool
+@_threaded_tool
 def get_join_path(
     source_table: str, target_table: str, database: str = "", max_hops: int = 3
 ) -> Dict[str, Any]:
@@ -1107,30 +3598,14 @@ def get_join_path(
     cache = _get_mcp_cache(mcp_name)
     graph = cache["GRAPH"]
     
-    src = _find_table(source_table, database, mcp_name).get("id")
-    tgt = _find_table(target_table, database, mcp_name).get("id")
+    src = _find_table(source_table, database, mcp_name, cache).get("id")
+    tgt = _find_table(target_table, database, mcp_name, cache).get("id")
     if not src or not tgt:
         return {"error": "source or target table not found"}
 
-    visited = {src}
-    queue = deque([(src, [])])
-    found_path: List[str] = []
+    node_path = _find_join_path(cache, src, tgt, max_hops)
 
-    while queue:
-        node, path = queue.popleft()
-        if len(path) > max_hops:
-            continue
-        if node == tgt:
-            found_path = path
-            break
-        for edge in graph.get(node, []):
-            nxt = edge["to"]
-            if nxt in visited:
-                continue
-            visited.add(nxt)
-            queue.append((nxt, path + [edge]))
-
-    if not found_path:
+    if not node_path or len(node_path) < 2:
         return {
             "source": src,
             "target": tgt,
@@ -1143,17 +3618,15 @@ def get_join_path(
 
     path_steps = []
     joins = []
-    prev = src
-    for step in found_path:
-        nxt = step["to"]
-        info = step.get("info", {})
+    names = graph["nodes"]
+    for prev_node, nxt_node, info in zip(node_path, node_path[1:], _path_edges(graph, node_path)):
+        prev, nxt = names[prev_node], names[nxt_node]
         on_clause = info.get("references", info.get("note", ""))
         join_type = "inner"
         path_steps.append(
             {"from_table": prev, "to_table": nxt, "join_type": join_type, "on_clause": on_clause}
         )
         joins.append(f"JOIN {nxt} ON {on_clause or '/* specify join condition */'}")
-        prev = nxt
 
     sql_snippet = f"SELECT * FROM {src} " + " ".join(joins)
     return {
@@ -1168,6 +3641,70 @@ def get_join_path(
 
 
 @mcp.tool
+@_threaded_tool
+def plan_joins(tables: List[str], database: str = "") -> Dict[str, Any]:
+    """
+    Plan one join sequence connecting several tables over the foreign key graph
+    (approximate minimal Steiner tree), instead of chaining get_join_path calls.
+
+    Args:
+        tables: Table names to connect (2 or more; resolved like get_table_schema).
+        database: Optional database filter (e.g., 'postgres_production', 'snowflake_production').
+    Returns:
+        Dict with the root table, ordered joins (table, via, on_clause), intermediate_tables
+        added to connect the inputs, unresolved/unreachable tables, sql_snippet and tokens_used.
+    """
+    mcp_name = _get_mcp_name()
+    cache = _get_mcp_cache(mcp_name)
+    graph = cache["GRAPH"]
+
+    terminals: List[str] = []
+    unresolved = []
+    for table in tables:
+        table_id = _find_table(table, database, mcp_name, cache).get("id")
+        if not table_id:
+            unresolved.append(table)
+        elif table_id not in terminals:
+            terminals.append(table_id)
+    if not terminals:
+        return {"error": "no tables found", "unresolved": unresolved}
+
+    steps, unreachable = _steiner_tree(cache, terminals)
+
+    joins = []
+    sql_joins = []
+    for parent_node, child_node in steps:
+        info = _path_edges(graph, [parent_node, child_node])[0]
+        parent, child = graph["nodes"][parent_node], graph["nodes"][child_node]
+        on_clause = _fk_on_clause(info)
+        joins.append({
+            "table": child,
+            "via": parent,
+            "join_type": "inner",
+            "on_clause": on_clause,
+            "relationship": info.get("references", info.get("note", "")),
+        })
+        sql_joins.append(f"JOIN {child} ON {on_clause or '/* specify join condition */'}")
+
+    sql_snippet = f"SELECT * FROM {terminals[0]}" + "".join(f"\n{join}" for join in sql_joins)
+    terminal_set = set(terminals)
+    return {
+        "root": terminals[0],
+        "tables": terminals,
+        "found": not unreachable and not unresolved,
+        "join_count": len(joins),
+        "joins": joins,
+        "intermediate_tables": [join["table"] for join in joins if join["table"] not in terminal_set],
+        "unresolved": unresolved,
+        "unreachable": unreachable,
+        "sql_snippet": sql_snippet,
+        "tokens_used": _estimate_tokens(sql_snippet + str(joins)),
+    }
+
+
+@mcp.tool
+@_threaded_tool
+@_versioned_result
 def get_domain_overview(domain: str, database: str = "") -> Dict[str, Any]:
     """
     Get summary of all tables in a business domain.
@@ -1207,6 +3744,8 @@ def get_domain_overview(domain: str, database: str = "") -> Dict[str, Any]:
 
 
 @mcp.tool
+@_threaded_tool
+@_versioned_result
 def list_domains(database: str = "") -> Dict[str, Any]:
     """
     List all available business domains.
@@ -1246,6 +3785,8 @@ def list_domains(database: str = "") -> Dict[str, Any]:
 
 
 @mcp.tool
+@_threaded_tool
+@_versioned_result
 def list_databases() -> Dict[str, Any]:
     """
     List all available databases in the index.
@@ -1284,6 +3825,8 @@ def list_databases() -> Dict[str, Any]:
 
 
 @mcp.tool
+@_threaded_tool
+@_versioned_result
 def get_common_relationships(
     database: str = "", domain: str = "", limit: int = 10
 ) -> Dict[str, Any]:
@@ -1326,9 +3869,17 @@ def get_common_relationships(
 if __name__ == "__main__":
     # Bind to 0.0.0.0 for container networking; use HTTP transport for remote access.
     # Port can be configured via MCP_PORT environment variable (default 8000)
-    # MCP name is now extracted dynamically from request path (e.g., /mcp/dabstep, /mcp/synth)
+    # MCP name is extracted dynamically from request path (e.g., /mcp/dabstep, /mcp/synth)
     port = int(os.getenv("MCP_PORT", "8000"))
     print(f"Starting Database Context MCP server on port {port}...")
     print(f"Supports dynamic MCP instances via path: /mcp/<mcp_name>")
     print(f"Base data directory: {BASE_DIR / 'data'}")
-    mcp.run(transport="http", host="0.0.0.0", port=port)
\ No newline at end of file
+    print(f"Available MCP instances: {', '.join(_list_tenants()) or 'none'} (default: {MCP_NAME})")
+    # Load the tokenizer before serving so no request waits on it
+    print(f"Token counts: {'tiktoken ' + TOKENIZER_ENCODING if _get_tokenizer() is not None else 'heuristic'}")
+    mcp.run(
+        transport="http",
+        host="0.0.0.0",
+        port=port,
+        middleware=[Middleware(_tenant_routing)],
+    )
\ No newline at end of file
@@ -0,0 +1,948 @@
+"""
+Index builder for the Database Context MCP Server.
+
+Walks data/<mcp_name>/map/<database>/domains/*/tables, parses every JSON/Markdown
+table file in a process pool and upserts the result into data/<mcp_name>/index/index.db
+(documents, documents_fts, documents_vec, keywords, index_weights, index_metadata).
+
+Reindexing is incremental: documents.content_hash is compared per file and per
+document, so only new or changed tables/columns are rewritten (and re-embedded).
+After a change the server's cache snapshot (index/cache.snapshot) is rebuilt too.
+
+Usage:
+    python setup_db.py                     # index MCP_NAME (default: dabstep)
+    python setup_db.py --mcp synth         # index data/synth/map
+    python setup_db.py --full              # re-parse every file regardless of stored hashes
+    python setup_db.py --no-embeddings     # skip embeddings
+    python setup_db.py --embedding-provider local   # offline n-gram embeddings (no API key)
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+from server import (
+    DEFAULT_INDEX_WEIGHTS,
+    EMBEDDING_PROVIDERS,
+    HAS_NUMPY,
+    HAS_SQLITE_VEC,
+    IVF_NLIST,
+    VECTOR_ENGINE,
+    VECTOR_EXPORT_FORMAT,
+    VEC_FILTER_COLUMNS,
+    _default_embedding_config,
+    _embed_texts,
+    _get_data_map_path,
+    _get_db_path,
+    _get_embedding_provider,
+    _get_mcp_name,
+    _get_snapshot_path,
+    _get_vector_dir,
+    _rebuild_snapshot,
+)
+
+if HAS_SQLITE_VEC:
+    import sqlite_vec
+
+if HAS_NUMPY:
+    import numpy as np
+
+
+TABLE_FILE_SUFFIXES = (".json", ".md")
+EMBEDDING_BATCH_SIZE = 100
+VECTOR_EXPORT_CHUNK = 8192
+IVF_TRAINING_POINTS_PER_LIST = 64
+IVF_ITERATIONS = 12
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    doc_type TEXT NOT NULL,
+    database_name TEXT,
+    schema_name TEXT,
+    table_name TEXT,
+    column_name TEXT,
+    domain TEXT,
+    content TEXT NOT NULL,
+    summary TEXT,
+    keywords TEXT,
+    file_path TEXT,
+    content_hash TEXT,
+    indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    parent_doc_id INTEGER REFERENCES documents(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_documents_file_path ON documents(file_path);
+CREATE INDEX IF NOT EXISTS idx_documents_table ON documents(doc_type, database_name, table_name);
+CREATE INDEX IF NOT EXISTS idx_documents_parent ON documents(parent_doc_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    content, summary, keywords,
+    content='documents', content_rowid='id'
+);
+
+CREATE TABLE IF NOT EXISTS keywords (
+    id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL,
+    source_type TEXT NOT NULL,
+    frequency INTEGER NOT NULL DEFAULT 0,
+    UNIQUE(term, source_type)
+);
+
+CREATE TABLE IF NOT EXISTS index_weights (
+    doc_type TEXT PRIMARY KEY,
+    fts_weight REAL NOT NULL DEFAULT 1.0,
+    vec_weight REAL NOT NULL DEFAULT 1.0,
+    boost REAL NOT NULL DEFAULT 1.0
+);
+
+CREATE TABLE IF NOT EXISTS index_metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "with", "id", "table", "column",
+}
+
+
+# --- File parsing (runs in worker processes) ---
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+
+def _keywords(*parts: str) -> List[str]:
+    """Extract de-duplicated keyword terms (in first-seen order) from name-like text."""
+    seen: Dict[str, None] = {}
+    for part in parts:
+        for tok in _tokens(part):
+            if len(tok) > 1 and tok not in _STOPWORDS:
+                seen.setdefault(tok, None)
+    return list(seen)
+
+
+def _summarize(description: str, max_chars: int = 300) -> str:
+    """Shorten a description to its first sentences, capped at max_chars."""
+    description = " ".join((description or "").split())
+    if len(description) <= max_chars:
+        return description
+    cut = description.rfind(". ", 0, max_chars)
+    if cut > 0:
+        return description[: cut + 1]
+    return description[:max_chars].rstrip() + "..."
+
+
+def _split_md_cells(line: str) -> List[str]:
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def _parse_markdown_table(text: str) -> Dict[str, Any]:
+    """
+    Parse a generated table Markdown file into the same shape as the JSON map files
+    (table, schema, database, description, row_count, columns, primary_key, foreign_keys, indexes).
+    """
+    table: Dict[str, Any] = {
+        "table": "",
+        "schema": "",
+        "database": "",
+        "description": "",
+        "row_count": None,
+        "columns": [],
+        "primary_key": [],
+        "foreign_keys": [],
+        "indexes": [],
+    }
+    section = ""
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line.startswith("# "):
+            table["table"] = line[2:].strip()
+            continue
+        if line.startswith("## "):
+            section = line[3:].strip().lower()
+            continue
+        if not line:
+            continue
+
+        field = re.match(r"\*\*(.+?):\*\*\s*(.*)", line)
+        if field and not section:
+            key, value = field.group(1).lower(), field.group(2).strip()
+            if key == "database":
+                table["database"] = value
+            elif key == "schema":
+                table["schema"] = value
+            elif key == "description":
+                table["description"] = value
+            elif key == "row count":
+                try:
+                    table["row_count"] = int(value.replace(",", ""))
+                except ValueError:
+                    pass
+            continue
+
+        if section == "columns" and line.startswith("|"):
+            cells = _split_md_cells(line)
+            if len(cells) < 4 or cells[0].lower() == "column" or set(cells[0]) <= {"-", ":"}:
+                continue
+            table["columns"].append(
+                {
+                    "name": cells[0],
+                    "type": cells[1],
+                    "nullable": cells[2].upper() != "NO",
+                    "description": " | ".join(cells[3:]),
+                }
+            )
+        elif section == "primary key":
+            table["primary_key"].extend(re.findall(r"`([^`]+)`", line))
+        elif section == "foreign keys" and line.startswith("-"):
+            names = re.findall(r"`([^`]+)`", line)
+            if len(names) >= 2:
+                ref_table, _, ref_col = names[1].rpartition(".")
+                table["foreign_keys"].append(
+                    {"columns": [names[0]], "references": f"{ref_table}({ref_col})"}
+                )
+        elif section == "indexes" and line.startswith("-"):
+            match = re.match(r"-\s*`([^`]+)`:\s*(.*)", line)
+            if match:
+                definition = match.group(2)
+                cols = re.search(r"\(([^)]*)\)\s*$", definition)
+                table["indexes"].append(
+                    {
+                        "index_name": match.group(1),
+                        "columns": [c.strip() for c in cols.group(1).split(",")] if cols else [],
+                        "is_unique": "UNIQUE" in definition.upper(),
+                    }
+                )
+
+    depends_on = sorted(
+        {fk["references"].split("(")[0] for fk in table["foreign_keys"] if fk.get("references")}
+    )
+    if depends_on:
+        table["relationships"] = {"depends_on": depends_on}
+    return table
+
+
+def _table_documents(
+    structure: Dict[str, Any],
+    content: str,
+    table_name: str,
+    database: str,
+    domain: str,
+    file_path: str,
+) -> List[Dict[str, Any]]:
+    """Build the table document and its column documents for one map file."""
+    schema = structure.get("schema") or (table_name.split(".")[0] if "." in table_name else "")
+    description = structure.get("description", "") or ""
+    columns = structure.get("columns", []) or []
+    column_names = " ".join(col.get("name", "") for col in columns)
+    base = {
+        "database_name": structure.get("database") or database,
+        "schema_name": schema,
+        "table_name": table_name,
+        "domain": domain,
+        "file_path": file_path,
+    }
+
+    docs = [
+        dict(
+            base,
+            doc_type="table",
+            column_name=None,
+            content=content,
+            summary=_summarize(description) or f"{table_name} table",
+            keywords=_keywords(table_name, domain, column_names),
+        )
+    ]
+    for col in columns:
+        name = col.get("name", "")
+        if not name:
+            continue
+        col_type = col.get("type", "") or ""
+        col_desc = col.get("description", "") or col.get("notes", "") or ""
+        nullable = "YES" if col.get("nullable", True) else "NO"
+        col_content = (
+            f"Column: {name}\nTable: {table_name}\nType: {col_type}\n"
+            f"Nullable: {nullable}\nDescription: {col_desc}"
+        )
+        docs.append(
+            dict(
+                base,
+                doc_type="column",
+                column_name=name,
+                content=col_content,
+                summary=_summarize(f"{name} ({col_type}) in {table_name}: {col_desc}"),
+                keywords=_keywords(name, table_name, col_type),
+            )
+        )
+    return docs
+
+
+def _embedding_text(row: Any) -> str:
+    """Text embedded for a document row: name + summary + keywords for tables, full content for columns."""
+    if row["doc_type"] == "column":
+        return row["content"][:8000]
+    keywords = " ".join(json.loads(row["keywords"] or "[]"))
+    return f"{row['table_name']}: {row['summary'] or ''}\n{keywords}"[:8000]
+
+
+def _parse_file(task: Tuple[str, str, str, str, Optional[str]]) -> Dict[str, Any]:
+    """
+    Hash and (if changed) parse a single map file. Runs in a worker process.
+    Returns {"file_path", "hash", "docs"}; docs is None when the stored hash still matches.
+    """
+    abs_path, file_path, database, domain, known_hash = task
+    data = Path(abs_path).read_bytes()
+    file_hash = _sha256(data)
+    if file_hash == known_hash:
+        return {"file_path": file_path, "hash": file_hash, "docs": None}
+
+    content = data.decode("utf-8", errors="replace")
+    name = Path(abs_path).name
+    try:
+        if name.endswith(".json"):
+            table_name = name[: -len(".json")]
+            structure = json.loads(content)
+        else:
+            table_name = name[: -len(".md")]
+            structure = _parse_markdown_table(content)
+    except (json.JSONDecodeError, ValueError) as e:
+        return {"file_path": file_path, "hash": file_hash, "docs": [], "error": str(e)}
+
+    docs = _table_documents(structure, content, table_name, database, domain, file_path)
+    for doc in docs:
+        doc["content_hash"] = _sha256(doc["content"].encode("utf-8"))
+    return {"file_path": file_path, "hash": file_hash, "docs": docs}
+
+
+def _discover_files(map_root: Path) -> List[Tuple[Path, str, str, str]]:
+    """
+    Return (abs_path, db_file_path, database, domain) for every table file in the map. A
+    Markdown file with a JSON sibling describes the same table and is left out, so its
+    documents are purged like a deleted file's whenever the sibling appears.
+    """
+    files = []
+    if not map_root.exists():
+        return files
+    for tables_dir in sorted(map_root.glob("*/domains/*/tables")):
+        domain = tables_dir.parent.name
+        database = tables_dir.parent.parent.parent.name
+        paths = [path for path in sorted(tables_dir.iterdir()) if path.suffix in TABLE_FILE_SUFFIXES]
+        json_stems = {path.stem for path in paths if path.suffix == ".json"}
+        for path in paths:
+            if path.suffix == ".md" and path.stem in json_stems:
+                continue
+            if path.is_file():
+                file_path = f"databases/{path.relative_to(map_root).as_posix()}"
+                files.append((path, file_path, database, domain))
+    return files
+
+
+# --- Index database helpers ---
+
+def _create_vec_table(db: sqlite3.Connection, dimensions: int) -> str:
+    """
+    Create documents_vec with the document filters as vec0 metadata columns, so filtered
+    KNN queries are resolved inside the vector scan. Returns the filter columns created
+    ("" on sqlite-vec < 0.1.6, which has no metadata columns).
+    """
+    filter_columns = "".join(f",\n                {column} text" for column in VEC_FILTER_COLUMNS)
+    try:
+        db.execute(f"""
+            CREATE VIRTUAL TABLE documents_vec USING vec0(
+                document_id INTEGER PRIMARY KEY,
+                embedding float[{dimensions}]{filter_columns}
+            )
+        """)
+        return ",".join(VEC_FILTER_COLUMNS)
+    except sqlite3.OperationalError as e:
+        print(f"[setup_db] vec0 metadata columns unsupported, filtered KNN will re-query: {e}")
+        db.execute(f"""
+            CREATE VIRTUAL TABLE documents_vec USING vec0(
+                document_id INTEGER PRIMARY KEY,
+                embedding float[{dimensions}]
+            )
+        """)
+        return ""
+
+
+def _add_vec_filter_columns(db: sqlite3.Connection, dimensions: int) -> str:
+    """Recreate a documents_vec built without filter columns, keeping the stored embeddings."""
+    meta_columns = ", ".join(f"d.{column}" for column in VEC_FILTER_COLUMNS)
+    rows = db.execute(
+        f"SELECT v.document_id, v.embedding, {meta_columns} FROM documents_vec v "
+        "JOIN documents d ON d.id = v.document_id"
+    ).fetchall()
+    db.execute("DROP TABLE documents_vec")
+    filter_columns = _create_vec_table(db, dimensions)
+    columns = ["document_id", "embedding"] + (filter_columns.split(",") if filter_columns else [])
+    db.executemany(
+        f"INSERT INTO documents_vec ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+        ([value if value is not None else "" for value in tuple(row)[:len(columns)]] for row in rows),
+    )
+    print(f"[setup_db] Rebuilt documents_vec with filter columns ({len(rows)} vectors kept)")
+    return filter_columns
+
+
+def _open_index(db_path: Path, embedding_config: Dict[str, Any]) -> Tuple[sqlite3.Connection, bool, bool]:
+    """
+    Open (creating if needed) the index database; returns (connection, has_vec, vec_reset).
+
+    documents_vec is dropped and recreated (vec_reset) when the index was embedded with a
+    different provider, model or dimension count, so every document gets re-embedded, and
+    migrated in place when it predates the vec0 filter columns.
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(db_path))
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA foreign_keys = ON")
+    db.executescript(SCHEMA_SQL)
+
+    has_vec = False
+    vec_reset = False
+    if HAS_SQLITE_VEC:
+        try:
+            db.enable_load_extension(True)
+            sqlite_vec.load(db)
+            db.enable_load_extension(False)
+            stored = (
+                _get_metadata(db, "embedding_provider") or "openai",
+                _get_metadata(db, "embedding_model"),
+                _get_metadata(db, "embedding_dimensions"),
+            )
+            wanted = (embedding_config["provider"], embedding_config["model"], str(embedding_config["dimensions"]))
+            vec_exists = db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'documents_vec'"
+            ).fetchone() is not None
+            if vec_exists and stored[1] is not None and stored != wanted:
+                print(f"[setup_db] Embedding model changed ({'/'.join(stored)} -> {'/'.join(wanted)}), "
+                      "rebuilding vector index")
+                db.execute("DROP TABLE documents_vec")
+                vec_exists = False
+                vec_reset = True
+            if not vec_exists:
+                _set_metadata(db, "embedding_filter_columns", _create_vec_table(db, embedding_config["dimensions"]))
+            elif _get_metadata(db, "embedding_filter_columns") is None:
+                # Index built before filter columns existed: migrate without re-embedding
+                filter_columns = _add_vec_filter_columns(db, embedding_config["dimensions"])
+                _set_metadata(db, "embedding_filter_columns", filter_columns)
+                vec_reset = bool(filter_columns)
+            _set_metadata(db, "embedding_provider", embedding_config["provider"])
+            _set_metadata(db, "embedding_model", embedding_config["model"])
+            _set_metadata(db, "embedding_dimensions", embedding_config["dimensions"])
+            has_vec = True
+        except Exception as e:
+            print(f"[setup_db] sqlite-vec unavailable, skipping vector index: {e}")
+
+    db.executemany(
+        "INSERT OR IGNORE INTO index_weights (doc_type, fts_weight, vec_weight, boost) VALUES (?, ?, ?, ?)",
+        [(doc_type, *weights) for doc_type, weights in DEFAULT_INDEX_WEIGHTS.items()],
+    )
+    db.commit()
+    return db, has_vec, vec_reset
+
+
+def _get_metadata(db: sqlite3.Connection, key: str) -> Optional[str]:
+    row = db.execute("SELECT value FROM index_metadata WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _set_metadata(db: sqlite3.Connection, key: str, value: Any) -> None:
+    db.execute(
+        "INSERT INTO index_metadata (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, str(value)),
+    )
+
+
+class _IndexWriter:
+    """Applies document-level upserts/deletes to documents, FTS, vectors and keyword counts."""
+
+    def __init__(self, db: sqlite3.Connection, has_vec: bool, embedding_config: Dict[str, Any]):
+        self.db = db
+        self.has_vec = has_vec
+        self.embedding_config = embedding_config
+        self.vec_filter_columns = [
+            column for column in (_get_metadata(db, "embedding_filter_columns") or "").split(",") if column
+        ]
+        self.keyword_delta: Counter = Counter()
+        self.stats = Counter()
+
+    def _existing(self, file_path: str) -> Dict[Tuple[str, Optional[str]], sqlite3.Row]:
+        rows = self.db.execute(
+            "SELECT id, doc_type, column_name, content, summary, keywords, content_hash "
+            "FROM documents WHERE file_path = ?",
+            (file_path,),
+        ).fetchall()
+        return {(row["doc_type"], row["column_name"]): row for row in rows}
+
+    def _unindex(self, row: sqlite3.Row) -> None:
+        self.db.execute(
+            "INSERT INTO documents_fts (documents_fts, rowid, content, summary, keywords) "
+            "VALUES ('delete', ?, ?, ?, ?)",
+            (row["id"], row["content"], row["summary"], row["keywords"]),
+        )
+        if self.has_vec:
+            self.db.execute("DELETE FROM documents_vec WHERE document_id = ?", (row["id"],))
+        for term in json.loads(row["keywords"] or "[]"):
+            self.keyword_delta[(term, row["doc_type"])] -= 1
+
+    def _index(self, doc_id: int, doc: Dict[str, Any], keywords_json: str) -> None:
+        self.db.execute(
+            "INSERT INTO documents_fts (rowid, content, summary, keywords) VALUES (?, ?, ?, ?)",
+            (doc_id, doc["content"], doc["summary"], keywords_json),
+        )
+        for term in doc["keywords"]:
+            self.keyword_delta[(term, doc["doc_type"])] += 1
+
+    def delete_file(self, file_path: str) -> None:
+        for row in self._existing(file_path).values():
+            self._unindex(row)
+            self.db.execute("DELETE FROM documents WHERE id = ?", (row["id"],))
+            self.stats["deleted"] += 1
+
+    def upsert_file(self, file_path: str, docs: List[Dict[str, Any]]) -> None:
+        existing = self._existing(file_path)
+        table_id: Optional[int] = None
+        # Table document first so column documents can reference it
+        for doc in sorted(docs, key=lambda d: d["doc_type"] != "table"):
+            key = (doc["doc_type"], doc["column_name"])
+            keywords_json = json.dumps(doc["keywords"])
+            old = existing.pop(key, None)
+            parent_id = table_id if doc["doc_type"] == "column" else None
+            values = (
+                doc["doc_type"], doc["database_name"], doc["schema_name"], doc["table_name"],
+                doc["column_name"], doc["domain"], doc["content"], doc["summary"], keywords_json,
+                doc["file_path"], doc["content_hash"], parent_id,
+            )
+            if old is not None and old["content_hash"] == doc["content_hash"]:
+                doc_id = old["id"]
+                self.stats["unchanged"] += 1
+            elif old is not None:
+                doc_id = old["id"]
+                self._unindex(old)
+                self.db.execute(
+                    "UPDATE documents SET doc_type = ?, database_name = ?, schema_name = ?, table_name = ?, "
+                    "column_name = ?, domain = ?, content = ?, summary = ?, keywords = ?, file_path = ?, "
+                    "content_hash = ?, parent_doc_id = ?, indexed_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    values + (doc_id,),
+                )
+                self._index(doc_id, doc, keywords_json)
+                self.stats["updated"] += 1
+            else:
+                cursor = self.db.execute(
+                    "INSERT INTO documents (doc_type, database_name, schema_name, table_name, column_name, "
+                    "domain, content, summary, keywords, file_path, content_hash, parent_doc_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    values,
+                )
+                doc_id = cursor.lastrowid
+                self._index(doc_id, doc, keywords_json)
+                self.stats["inserted"] += 1
+            if doc["doc_type"] == "table":
+                table_id = doc_id
+
+        # Documents that disappeared from the file (e.g. dropped columns)
+        for row in existing.values():
+            self._unindex(row)
+            self.db.execute("DELETE FROM documents WHERE id = ?", (row["id"],))
+            self.stats["deleted"] += 1
+
+    def flush_keywords(self) -> None:
+        for (term, source_type), delta in self.keyword_delta.items():
+            if delta == 0:
+                continue
+            updated = self.db.execute(
+                "UPDATE keywords SET frequency = frequency + ? WHERE term = ? AND source_type = ?",
+                (delta, term, source_type),
+            ).rowcount
+            if not updated and delta > 0:
+                self.db.execute(
+                    "INSERT INTO keywords (term, source_type, frequency) VALUES (?, ?, ?)",
+                    (term, source_type, delta),
+                )
+        self.db.execute("DELETE FROM keywords WHERE frequency <= 0")
+        self.keyword_delta.clear()
+
+    def flush_embeddings(self) -> int:
+        """
+        Embed every document that has no vector yet (new/changed documents lose theirs
+        in _unindex), in batches. Returns number of vectors written.
+        """
+        provider = _get_embedding_provider(self.embedding_config["provider"])
+        if not self.has_vec or not provider["available"]():
+            return 0
+        pending = [
+            (row["id"], _embedding_text(row), [row[column] or "" for column in self.vec_filter_columns])
+            for row in self.db.execute(
+                "SELECT id, doc_type, table_name, summary, keywords, content, database_name, domain FROM documents "
+                "WHERE id NOT IN (SELECT document_id FROM documents_vec)"
+            )
+        ]
+        columns = ", ".join(["document_id", "embedding"] + self.vec_filter_columns)
+        placeholders = ", ".join("?" for _ in range(2 + len(self.vec_filter_columns)))
+        written = 0
+        for start in range(0, len(pending), EMBEDDING_BATCH_SIZE):
+            batch = pending[start:start + EMBEDDING_BATCH_SIZE]
+            try:
+                vectors = _embed_texts([text for _, text, _ in batch], self.embedding_config)
+            except Exception as e:
+                print(f"[setup_db] Embedding batch failed ({len(batch)} docs): {e}")
+                continue
+            for (doc_id, _, filters), vector in zip(batch, vectors):
+                self.db.execute(
+                    f"INSERT OR REPLACE INTO documents_vec ({columns}) VALUES ({placeholders})",
+                    [doc_id, json.dumps(vector)] + filters,
+                )
+                written += 1
+        return written
+
+
+# --- Vector export (NumPy engine) ---
+
+def _nearest_centroids(vectors: "np.ndarray", centroids: "np.ndarray") -> "np.ndarray":
+    """Index of the nearest centroid (L2) for every row, computed in chunks."""
+    centroid_norms = (centroids * centroids).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), VECTOR_EXPORT_CHUNK):
+        block = np.asarray(vectors[start:start + VECTOR_EXPORT_CHUNK], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmin(centroid_norms - 2.0 * (block @ centroids.T), axis=1)
+    return assignments
+
+
+def build_ivf(vectors: "np.ndarray", nlist: int = 0, seed: int = 0) -> Dict[str, "np.ndarray"]:
+    """
+    Train an IVF (inverted file) index: k-means centroids on a sample, then every row
+    bucketed under its nearest centroid. Returns centroids, rows grouped by cluster
+    ("order") and per-cluster offsets into order.
+    """
+    count = len(vectors)
+    nlist = max(1, min(count, nlist or int(round(math.sqrt(count)))))
+    rng = np.random.default_rng(seed)
+    sample_size = min(count, nlist * IVF_TRAINING_POINTS_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(IVF_ITERATIONS):
+        assignments = _nearest_centroids(sample, centroids)
+        counts = np.bincount(assignments, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random sample points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+
+    assignments = _nearest_centroids(vectors, centroids)
+    order = np.argsort(assignments, kind="stable").astype(np.int64)
+    offsets = np.searchsorted(assignments[order], np.arange(nlist + 1)).astype(np.int64)
+    return {"centroids": centroids, "order": order, "offsets": offsets}
+
+
+def _vector_export_current(vector_dir: Path, index_version: int, ivf: bool) -> bool:
+    """True when the export matches the index version and has (or lacks) an IVF index as requested."""
+    try:
+        meta = json.loads((vector_dir / "meta.json").read_text())
+    except (OSError, ValueError):
+        return False
+    return (
+        meta.get("format") == VECTOR_EXPORT_FORMAT
+        and meta.get("index_version") == index_version
+        and bool(meta.get("ivf")) == ivf
+        and (not ivf or not IVF_NLIST or meta["ivf"]["nlist"] == min(IVF_NLIST, meta["count"]))
+    )
+
+
+def export_vectors(
+    db: sqlite3.Connection,
+    vector_dir: Path,
+    embedding_config: Dict[str, Any],
+    index_version: int,
+    ivf_nlist: Optional[int] = None,
+) -> int:
+    """
+    Export documents_vec for the server's NumPy vector engine: float32 rows for exact
+    rescoring, float16 and per-row-scaled int8 copies for the scan, squared norms, and
+    the vec filter columns as integer codes. With ivf_nlist set (0 = automatic) an IVF
+    index is trained as well. The directory is swapped in atomically.
+    Returns the number of vectors exported.
+    """
+    dimensions = int(embedding_config["dimensions"])
+    join = "FROM documents_vec v JOIN documents d ON d.id = v.document_id"
+    count = db.execute(f"SELECT COUNT(*) {join}").fetchone()[0]
+    meta_columns = ", ".join(f"d.{column}" for column in VEC_FILTER_COLUMNS)
+
+    tmp_dir = vector_dir.with_name(vector_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    ids = np.empty(count, dtype=np.int64)
+    filters = np.empty((count, len(VEC_FILTER_COLUMNS)), dtype=np.int32)
+    filter_values: List[Dict[str, int]] = [{} for _ in VEC_FILTER_COLUMNS]
+    exact = np.lib.format.open_memmap(tmp_dir / "float32.npy", mode="w+", dtype=np.float32, shape=(count, dimensions))
+    rows = db.execute(f"SELECT v.document_id, v.embedding, {meta_columns} {join} ORDER BY v.document_id")
+    for n, row in enumerate(rows):
+        ids[n] = row[0]
+        exact[n] = np.frombuffer(row[1], dtype=np.float32)
+        for j, value in enumerate(tuple(row)[2:]):
+            filters[n, j] = filter_values[j].setdefault(value or "", len(filter_values[j]))
+
+    norms = np.empty(count, dtype=np.float32)
+    scales = np.empty(count, dtype=np.float32)
+    half = np.lib.format.open_memmap(tmp_dir / "float16.npy", mode="w+", dtype=np.float16, shape=(count, dimensions))
+    quantized = np.lib.format.open_memmap(tmp_dir / "int8.npy", mode="w+", dtype=np.int8, shape=(count, dimensions))
+    for start in range(0, count, VECTOR_EXPORT_CHUNK):
+        block = np.asarray(exact[start:start + VECTOR_EXPORT_CHUNK])
+        end = start + len(block)
+        norms[start:end] = (block * block).sum(axis=1)
+        half[start:end] = block.astype(np.float16)
+        scale = np.abs(block).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        quantized[start:end] = np.round(block / scale[:, None]).astype(np.int8)
+        scales[start:end] = scale
+    for matrix in (exact, half, quantized):
+        matrix.flush()
+
+    ivf = None
+    if ivf_nlist is not None and count:
+        ivf = build_ivf(exact, ivf_nlist)
+        for name, values in ivf.items():
+            np.save(tmp_dir / f"ivf_{name}.npy", values)
+    del exact, half, quantized
+
+    np.save(tmp_dir / "ids.npy", ids)
+    np.save(tmp_dir / "norms.npy", norms)
+    np.save(tmp_dir / "int8_scales.npy", scales)
+    np.save(tmp_dir / "filters.npy", filters)
+    meta = {
+        "format": VECTOR_EXPORT_FORMAT,
+        "count": count,
+        "dimensions": dimensions,
+        "embedding_provider": embedding_config["provider"],
+        "embedding_model": embedding_config["model"],
+        "index_version": index_version,
+        # Position in each list is the code stored in filters.npy
+        "filter_values": {column: list(filter_values[j]) for j, column in enumerate(VEC_FILTER_COLUMNS)},
+        "ivf": {"nlist": len(ivf["centroids"])} if ivf else None,
+    }
+    (tmp_dir / "meta.json").write_text(json.dumps(meta))
+
+    # Servers keep their mmaps of the old files until they notice the new meta.json
+    old_dir = vector_dir.with_name(vector_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if vector_dir.exists():
+        os.replace(vector_dir, old_dir)
+    os.replace(tmp_dir, vector_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return count
+
+
+# --- Index build ---
+
+def build_index(
+    mcp_name: Optional[str] = None,
+    full: bool = False,
+    workers: Optional[int] = None,
+    embeddings: bool = True,
+    embedding_provider: str = "",
+    vector_export: Optional[bool] = None,
+    ivf: Optional[bool] = None,
+    vector_engine: str = "",
+    ivf_nprobe: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Incrementally (re)build the index for an MCP instance.
+
+    Args:
+        mcp_name: MCP data directory name (defaults to MCP_NAME).
+        full: Ignore stored content hashes and re-parse every file.
+        workers: Parser process count (0 parses in-process; default os.cpu_count()).
+        embeddings: Generate embeddings for new/changed documents.
+        embedding_provider: Embedding provider name (defaults to EMBEDDING_PROVIDER).
+        vector_export: Export vectors for the NumPy engine (defaults to the index's engine being numpy/ivf).
+        ivf: Train an IVF index into the export (defaults to the index's engine being ivf).
+        vector_engine: Store this index's search_vector engine (sqlite-vec, numpy or ivf);
+            otherwise the stored one, falling back to VECTOR_ENGINE.
+        ivf_nprobe: Store this index's IVF clusters probed per query (overrides IVF_NPROBE).
+    Returns:
+        Dict with file/document counters, index_version and elapsed seconds.
+    """
+    started = time.perf_counter()
+    mcp_name = mcp_name or _get_mcp_name()
+    map_root = _get_data_map_path(mcp_name)
+    db_path = _get_db_path(mcp_name)
+
+    embedding_config = _default_embedding_config(embedding_provider)
+    db, has_vec, vec_reset = _open_index(db_path, embedding_config)
+    # Per-index vector engine settings, read by the server for this MCP name
+    if vector_engine:
+        _set_metadata(db, "vector_engine", vector_engine)
+    if ivf_nprobe is not None:
+        _set_metadata(db, "ivf_nprobe", ivf_nprobe)
+    engine = (_get_metadata(db, "vector_engine") or VECTOR_ENGINE).strip().lower()
+    known = {
+        row["file_path"]: row["content_hash"]
+        for row in db.execute("SELECT file_path, content_hash FROM documents WHERE doc_type = 'table'")
+    }
+
+    files = _discover_files(map_root)
+    tasks = [
+        (str(path), file_path, database, domain, None if full else known.get(file_path))
+        for path, file_path, database, domain in files
+    ]
+
+    if workers == 0 or len(tasks) < 2:
+        parsed = map(_parse_file, tasks)
+        results = list(parsed)
+    else:
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_parse_file, tasks, chunksize=chunksize))
+
+    writer = _IndexWriter(db, has_vec, embedding_config)
+    changed_files = 0
+    for result in results:
+        if result.get("error"):
+            print(f"[setup_db] Skipping {result['file_path']}: {result['error']}")
+        if result["docs"] is None:
+            continue
+        changed_files += 1
+        writer.upsert_file(result["file_path"], result["docs"])
+
+    seen = {file_path for _, file_path, _, _ in files}
+    removed = [fp for fp in known if fp not in seen]
+    for file_path in removed:
+        writer.delete_file(file_path)
+
+    writer.flush_keywords()
+    embedded = writer.flush_embeddings() if embeddings else 0
+
+    changed = bool(
+        writer.stats["inserted"] or writer.stats["updated"] or writer.stats["deleted"] or embedded or vec_reset
+    )
+    version = int(_get_metadata(db, "index_version") or 0)
+    if changed or _get_metadata(db, "index_version") is None:
+        version += 1
+        now = datetime.now(timezone.utc).isoformat()
+        doc_count = db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        _set_metadata(db, "index_version", version)
+        _set_metadata(db, "document_count", doc_count)
+        _set_metadata(db, "last_index", now)
+        if full:
+            _set_metadata(db, "last_full_index", now)
+    db.commit()
+
+    exported = None
+    # An existing export is always refreshed (keeping its IVF index), whatever the
+    # index's engine is, so servers never keep scanning a stale matrix
+    vector_dir = _get_vector_dir(mcp_name)
+    try:
+        previous = json.loads((vector_dir / "meta.json").read_text())
+    except (OSError, ValueError):
+        previous = None
+    if ivf is None:
+        ivf = engine == "ivf" or bool(previous and previous.get("ivf"))
+    if vector_export is None:
+        vector_export = ivf or engine == "numpy" or previous is not None
+    if vector_export and not HAS_NUMPY:
+        print("[setup_db] NumPy not installed, skipping vector export")
+    elif vector_export and has_vec and not _vector_export_current(vector_dir, version, ivf):
+        exported = export_vectors(
+            db, vector_dir, embedding_config, version, IVF_NLIST if ivf else None
+        )
+    db.close()
+
+    # Precompile the server's in-memory cache so MCP replicas start with a single load
+    snapshot_version = None
+    if changed or not _get_snapshot_path(mcp_name).exists():
+        snapshot_version = _rebuild_snapshot(mcp_name)
+
+    return {
+        "mcp_name": mcp_name,
+        "db_path": str(db_path),
+        "files_scanned": len(files),
+        "files_changed": changed_files,
+        "files_removed": len(removed),
+        "documents_inserted": writer.stats["inserted"],
+        "documents_updated": writer.stats["updated"],
+        "documents_deleted": writer.stats["deleted"],
+        "documents_unchanged": writer.stats["unchanged"],
+        "embedding_provider": embedding_config["provider"] if has_vec else None,
+        "embeddings_written": embedded,
+        "vectors_exported": exported,
+        "index_version": version,
+        "snapshot_written": snapshot_version is not None,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or incrementally update the MCP context index.")
+    parser.add_argument("--mcp", default=None, help="MCP name (data/<mcp>/map -> data/<mcp>/index/index.db)")
+    parser.add_argument("--full", action="store_true", help="Re-parse every file regardless of content_hash")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (0 = in-process)")
+    parser.add_argument("--no-embeddings", action="store_true", help="Skip embedding generation")
+    parser.add_argument(
+        "--embedding-provider",
+        choices=sorted(EMBEDDING_PROVIDERS),
+        default="",
+        help="Embedding provider (default: EMBEDDING_PROVIDER env var or openai)",
+    )
+    parser.add_argument(
+        "--export-vectors",
+        action="store_true",
+        default=None,
+        help="Export vectors for the NumPy engine (default: on when the index's engine is numpy or ivf, or an export exists)",
+    )
+    parser.add_argument(
+        "--ivf",
+        action="store_true",
+        default=None,
+        help="Also train an IVF ANN index into the export (default: on when the index's engine is ivf or the export has one)",
+    )
+    parser.add_argument(
+        "--vector-engine",
+        choices=["sqlite-vec", "numpy", "ivf"],
+        default="",
+        help="search_vector engine stored for this MCP name (default: keep the stored one, else VECTOR_ENGINE)",
+    )
+    parser.add_argument(
+        "--ivf-nprobe", type=int, default=None, help="IVF clusters probed per query for this MCP name (default: IVF_NPROBE)"
+    )
+    args = parser.parse_args()
+
+    stats = build_index(
+        mcp_name=args.mcp,
+        full=args.full,
+        workers=args.workers,
+        embeddings=not args.no_embeddings,
+        embedding_provider=args.embedding_provider,
+        vector_export=args.export_vectors,
+        ivf=args.ivf,
+        vector_engine=args.vector_engine,
+        ivf_nprobe=args.ivf_nprobe,
+    )
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()